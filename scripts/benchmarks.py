@@ -0,0 +1,641 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import shutil
+import vcffile
+import risksnps
+import genomecache
+import csv
+import csvrows
+import gzip
+import tablesink
+import genotypematrix
+import riskscores
+import correlationmatrix
+import mergejoin
+import similarity
+import minhash
+from array import array
+
+DEFAULT_LINE_COUNT = 5000000
+SHARD_WORKERS = [1, 2, 4, 8]
+DEFAULT_PANEL_LINE_COUNT = 200000
+DEFAULT_ROW_COUNT = 2000000
+ROWS_PER_PERSON = 100000
+DEFAULT_DOSAGE_PEOPLE = 1000
+DOSAGE_PANEL_SIZE = 10000
+DEFAULT_SCORE_PEOPLE = 10000
+SCORE_PANEL_SIZES = [100, 1000, 10000]
+DEFAULT_MATRIX_SIZE = 2000
+DEFAULT_JOIN_SNPS = 500000
+JOIN_OTHERS = 10
+DEFAULT_SIMILARITY_PEOPLE = 100
+SIMILARITY_SNPS = 100000
+DEFAULT_SKETCH_PEOPLE = 40
+DEFAULT_ALLELE_COUNT = 1000000
+SKETCH_SNPS = 100000
+PANEL_SIZES = [71, 1000, 10000, 100000]
+MAX_BASELINE_PANEL_SIZE = 10000
+BASES = ['A', 'C', 'G', 'T']
+CHROMS = ['chr' + str(number) for number in range(1, 23)] + ['chrX', 'chrY']
+
+
+def write_synthetic_vcf(fileName, lineCount, seed=1):
+    '''
+    Writes a single person vcf file with lineCount data lines.  Most lines have
+    an rs id, some have '.' like the novel variants in the real files.
+    '''
+    rand = random.Random(seed)
+    linesPerChrom = lineCount // len(CHROMS) + 1
+    with open(fileName, 'w') as destFile:
+        destFile.write('##fileformat=VCFv4.1\n')
+        for chrom in CHROMS:
+            destFile.write('##contig=<ID=' + chrom + '>\n')
+        destFile.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n')
+        lines = []
+        for index in range(lineCount):
+            chrom = CHROMS[index // linesPerChrom]
+            pos = (index % linesPerChrom) * 100 + 1
+            if (rand.random() < 0.9):
+                snpId = 'rs' + str(index + 1)
+            else:
+                snpId = '.'
+            ref = rand.choice(BASES)
+            alt = rand.choice(BASES)
+            lines.append(chrom + '\t' + str(pos) + '\t' + snpId + '\t' + ref + '\t' + alt +
+                         '\t50.0\tPASS\tDP=10\tGT:DP\t0/1:10\n')
+            if (len(lines) == 10000):
+                destFile.write(''.join(lines))
+                lines = []
+        destFile.write(''.join(lines))
+
+
+def report(name, lineCount, seconds):
+    '''Prints the lines/sec for one timed run.'''
+    print '%-40s %8.2f s %12.0f lines/sec' % (name, seconds, lineCount / seconds)
+
+
+def get_all_snps_and_locations_per_field(vcf):
+    '''
+    The original get_all_snps_and_locations loop, which splits each line once
+    per field.  Kept here as the baseline.
+    '''
+    alldata = []
+    with open(vcf.filename, 'r') as snp_file:
+        for a_line in snp_file:
+            snpId = vcf.get_a_snp_id(a_line)
+            if (len(snpId) > 0):
+                chrom = vcf.get_a_chrom(a_line)
+                location = vcf.get_a_location(a_line)
+                sourceAllele = vcf.get_an_allele(a_line)
+                alldata.append([snpId, sourceAllele, chrom, location])
+    return alldata
+
+
+def bench_parse(lineCount=DEFAULT_LINE_COUNT):
+    '''
+    Compares the per-field parsing with the single pass VcfFile.iter_records
+    parsing on a synthetic vcf file.
+    '''
+    tempDir = tempfile.mkdtemp()
+    fileName = os.path.join(tempDir, 'BENCH_hg19.gatk.flt.vcf')
+    write_synthetic_vcf(fileName, lineCount)
+    try:
+        vcf = vcffile.VcfFile(fileName)
+        genomecache.set_enabled(False)
+
+        start = time.time()
+        before = get_all_snps_and_locations_per_field(vcf)
+        report('per-field split (before)', lineCount, time.time() - start)
+
+        start = time.time()
+        after = vcf.get_all_snps_and_locations()
+        report('iter_records (after)', lineCount, time.time() - start)
+
+        assert before == after
+    finally:
+        os.remove(fileName)
+        os.rmdir(tempDir)
+
+
+def bench_shards(lineCount=DEFAULT_LINE_COUNT):
+    '''
+    Times parsing one synthetic vcf file into GenomeColumns with each count
+    of workers in SHARD_WORKERS (see vcfshards.read_columns).
+    '''
+    tempDir = tempfile.mkdtemp()
+    fileName = os.path.join(tempDir, 'BENCH_hg19.gatk.flt.vcf')
+    write_synthetic_vcf(fileName, lineCount)
+    try:
+        vcf = vcffile.VcfFile(fileName)
+        expected = None
+        for workers in SHARD_WORKERS:
+            start = time.time()
+            columns = vcf.parse_genome_columns(workers)
+            report(str(workers) + ' workers', lineCount, time.time() - start)
+            if (expected is None):
+                expected = columns.get_snp_ids()
+            assert expected == columns.get_snp_ids()
+    finally:
+        shutil.rmtree(tempDir)
+
+
+def get_these_risksnps_list_lookup(vcf, riskSnps):
+    '''
+    The original get_these_risksnps lookup, which searches the snp list for
+    every line.  Kept here as the baseline.
+    '''
+    alleles = ['0']*(riskSnps.len())
+    for record in vcf.iter_snp_records():
+        if (record.id in riskSnps.snps):
+            index = riskSnps.snps.index(record.id)
+            alleles[index] = vcf.get_an_allele_number(record.alt, riskSnps.alleles[index])
+    return alleles
+
+
+def make_panel(panelSize, lineCount, seed=1):
+    '''
+    Returns a RiskSnps panel of panelSize snps.  Half of them are drawn from the
+    synthetic vcf's rs ids and half don't occur in it.
+    '''
+    rand = random.Random(seed)
+    found = rand.sample(xrange(1, lineCount + 1), min(panelSize // 2, lineCount))
+    snps = ['rs' + str(number) for number in found]
+    missing = 0
+    while (len(snps) < panelSize):
+        missing += 1
+        snps.append('rs' + str(lineCount + missing))
+    return risksnps.RiskSnps(snps, [rand.choice(BASES) for snp in snps])
+
+
+def bench_panel(lineCount=DEFAULT_PANEL_LINE_COUNT):
+    '''
+    Times VcfFile.get_these_risksnps against panels from 71 to 100k snps, with
+    the list lookup it replaced as the baseline.  The baseline is only run for
+    the smaller panels since it grows with lines x panel size.
+    '''
+    tempDir = tempfile.mkdtemp()
+    fileName = os.path.join(tempDir, 'BENCH_hg19.gatk.flt.vcf')
+    write_synthetic_vcf(fileName, lineCount)
+    try:
+        vcf = vcffile.VcfFile(fileName)
+        for panelSize in PANEL_SIZES:
+            panel = make_panel(panelSize, lineCount)
+            if (panelSize <= MAX_BASELINE_PANEL_SIZE):
+                start = time.time()
+                before = get_these_risksnps_list_lookup(vcf, panel)
+                report('list lookup, panel ' + str(panelSize), lineCount, time.time() - start)
+            else:
+                before = None
+            start = time.time()
+            after = vcf.get_these_risksnps(panel)
+            report('dict lookup, panel ' + str(panelSize), lineCount, time.time() - start)
+            assert before is None or before == after
+    finally:
+        os.remove(fileName)
+        os.rmdir(tempDir)
+
+
+def bench_cache(lineCount=DEFAULT_LINE_COUNT):
+    '''
+    Times parsing a synthetic vcf file, storing it in an empty genome cache,
+    and then reading it back from the cache, as a second run of a script would.
+    '''
+    tempDir = tempfile.mkdtemp()
+    fileName = os.path.join(tempDir, 'BENCH_hg19.gatk.flt.vcf')
+    write_synthetic_vcf(fileName, lineCount)
+    cache = genomecache.GenomeCache(os.path.join(tempDir, 'cache'))
+    try:
+        vcf = vcffile.VcfFile(fileName)
+        start = time.time()
+        columns = genomecache.GenomeColumns()
+        columns.add_records(vcf.iter_snp_records())
+        report('parse to columns', lineCount, time.time() - start)
+
+        start = time.time()
+        cache.store(fileName, columns)
+        report('store in cache', lineCount, time.time() - start)
+
+        start = time.time()
+        cached = cache.load(fileName)
+        report('load from cache', lineCount, time.time() - start)
+
+        start = time.time()
+        after = cached.get_all_snps_and_alleles()
+        report('snp and allele lists from columns', lineCount, time.time() - start)
+        assert columns.get_all_snps_and_alleles() == after
+    finally:
+        shutil.rmtree(tempDir)
+
+
+def report_rows(name, rowCount, seconds):
+    '''Prints the rows/sec for one timed run.'''
+    print '%-40s %8.2f s %12.0f rows/sec' % (name, seconds, rowCount / seconds)
+
+
+def make_tall_rows(rowCount, seed=1):
+    '''
+    Returns RiskSnpTallTable style rows, [index, personId, snpId, allele,
+    oddsratio], in blocks of ROWS_PER_PERSON per person.  About 1% of the
+    alleles are multi allelic (like A,G) and need quoting.
+    '''
+    rand = random.Random(seed)
+    people = []
+    for start in range(0, rowCount, ROWS_PER_PERSON):
+        personId = 'A' + str(1000 + start // ROWS_PER_PERSON)
+        rows = []
+        for index in range(start, min(rowCount, start + ROWS_PER_PERSON)):
+            allele = rand.choice(BASES)
+            if (rand.random() < 0.01):
+                allele += ',' + rand.choice(BASES)
+            rows.append([index, personId, 'rs' + str(index + 1), allele, '1.2'])
+        people.append(rows)
+    return people
+
+
+def bench_rows(rowCount=DEFAULT_ROW_COUNT):
+    '''
+    Compares writing tall table rows with csv.DictWriter, a row at a time, and
+    with csvrows.format_rows, a person's block at a time.
+    '''
+    tempDir = tempfile.mkdtemp()
+    people = make_tall_rows(rowCount)
+    colNames = ['index', 'personid', 'snpid', 'allele', 'oddsratio']
+    try:
+        beforeFileName = os.path.join(tempDir, 'before.csv')
+        start = time.time()
+        with open(beforeFileName, 'w') as destFile:
+            writer = csv.DictWriter(destFile, fieldnames=colNames, lineterminator='\n')
+            writer.writeheader()
+            for rows in people:
+                for row in rows:
+                    writer.writerow(dict(zip(colNames, row)))
+        report_rows('DictWriter.writerow (before)', rowCount, time.time() - start)
+
+        afterFileName = os.path.join(tempDir, 'after.csv')
+        start = time.time()
+        with open(afterFileName, 'w', csvrows.BUFFER_SIZE) as destFile:
+            destFile.write(csvrows.format_rows([colNames]))
+            for rows in people:
+                destFile.write(csvrows.format_rows(rows))
+        report_rows('csvrows.format_rows (after)', rowCount, time.time() - start)
+
+        with open(beforeFileName, 'rb') as beforeFile:
+            with open(afterFileName, 'rb') as afterFile:
+                assert beforeFile.read() == afterFile.read()
+    finally:
+        shutil.rmtree(tempDir)
+
+
+def read_csv_columns(srcFile):
+    '''Reads a csv table back into a dictionary of columns of strings.'''
+    reader = csv.reader(srcFile)
+    fieldNames = reader.next()
+    return dict(zip(fieldNames, map(list, zip(*reader))))
+
+
+def bench_formats(rowCount=DEFAULT_ROW_COUNT):
+    '''
+    Writes RiskSnpTallTable style rows in each tablesink output format and
+    compares the file sizes and the time to read each back into columns.
+    '''
+    tempDir = tempfile.mkdtemp()
+    people = make_tall_rows(rowCount)
+    colNames = ['index', 'personid', 'snpid', 'allele', 'oddsratio']
+    colTypes = [tablesink.TYPE_INT, tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_FLOAT]
+    outputFormats = [tablesink.FORMAT_CSV, tablesink.FORMAT_CSV_GZIP, tablesink.FORMAT_NPZ]
+    if (tablesink.pyarrow is not None):
+        outputFormats.append(tablesink.FORMAT_ARROW)
+    try:
+        for outputFormat in outputFormats:
+            fileName = tablesink.get_file_name(os.path.join(tempDir, 'table.csv'), outputFormat)
+            start = time.time()
+            with tablesink.open_sink(fileName, colNames, colTypes, outputFormat) as sink:
+                for rows in people:
+                    sink.write_rows(rows)
+            writeSeconds = time.time() - start
+            start = time.time()
+            if (outputFormat == tablesink.FORMAT_CSV):
+                with open(fileName, 'r') as srcFile:
+                    read_csv_columns(srcFile)
+            elif (outputFormat == tablesink.FORMAT_CSV_GZIP):
+                srcFile = gzip.open(fileName, 'rb')
+                read_csv_columns(srcFile)
+                srcFile.close()
+            elif (outputFormat == tablesink.FORMAT_NPZ):
+                tablesink.read_npz(fileName)
+            else:
+                tablesink.pyarrow.feather.read_table(fileName)
+            readSeconds = time.time() - start
+            print '%-10s %12d bytes  write %6.2f s  reload %6.2f s' % (outputFormat, os.path.getsize(fileName),
+                                                                     writeSeconds, readSeconds)
+    finally:
+        shutil.rmtree(tempDir)
+
+
+def bench_dosage(personCount=DEFAULT_DOSAGE_PEOPLE):
+    '''
+    Compares the memory of a cohort's risk snps kept as lists of allele
+    number strings with rows of dosage bytes (see DosageMatrix), and times
+    the per snp sums over the cohort each way.
+    '''
+    rand = random.Random(1)
+    dosageRows = [array('b', [rand.choice([-1, 0, 0, 1, 2]) for index in range(DOSAGE_PANEL_SIZE)])
+                  for personIndex in range(personCount)]
+    codes = dict((dosage, str(dosage)) for dosage in [-1, 0, 1, 2])
+    stringRows = [[codes[dosage] for dosage in row] for row in dosageRows]
+    genotypeCount = personCount * DOSAGE_PANEL_SIZE
+    #the few different strings are shared, so a genotype costs its place in the list
+    stringBytes = sum([sys.getsizeof(row) for row in stringRows])
+    dosageBytes = sum([sys.getsizeof(row) for row in dosageRows])
+    print 'strings %6.1f bytes per genotype' % (float(stringBytes) / genotypeCount)
+    print 'dosages %6.1f bytes per genotype' % (float(dosageBytes) / genotypeCount)
+    start = time.time()
+    before = [0] * DOSAGE_PANEL_SIZE
+    for row in stringRows:
+        for index in range(DOSAGE_PANEL_SIZE):
+            if (row[index] != '-1'):
+                before[index] += int(row[index])
+    report('string sums', genotypeCount, time.time() - start)
+    matrix = genotypematrix.DosageMatrix(['rs' + str(index) for index in range(DOSAGE_PANEL_SIZE)])
+    for personIndex in range(personCount):
+        matrix.add_person_dosages('A' + str(personIndex), dosageRows[personIndex])
+    start = time.time()
+    after = matrix.get_dosage_sums()
+    report('dosage sums', genotypeCount, time.time() - start)
+    assert before == after
+
+
+def bench_scores(personCount=DEFAULT_SCORE_PEOPLE):
+    '''
+    Times RiskScorer scoring personCount people's dosages for two panels of
+    each size in SCORE_PANEL_SIZES, which share half their snps.
+    '''
+    rand = random.Random(1)
+    for panelSize in SCORE_PANEL_SIZES:
+        panels = []
+        for panelIndex in range(2):
+            first = panelIndex * panelSize / 2
+            panel = risksnps.RiskSnps(['rs' + str(number) for number in range(first, first + panelSize)],
+                                      [BASES[number % 4] for number in range(first, first + panelSize)],
+                                      [str(rand.uniform(0.5, 2.0)) for number in range(panelSize)])
+            panels.append(('panel' + str(panelIndex), panel))
+        scorer = riskscores.RiskScorer(panels)
+        matrix = genotypematrix.DosageMatrix(scorer.riskSnps.snps)
+        snpCount = scorer.riskSnps.len()
+        #each person's row is a different slice of one random row twice as long
+        dosages = array('b', [rand.choice([-1, 0, 0, 1, 2]) for index in range(2 * snpCount)])
+        for personIndex in range(personCount):
+            offset = rand.randint(0, snpCount)
+            matrix.add_person_dosages('A' + str(personIndex), dosages[offset:offset + snpCount])
+        start = time.time()
+        scorer.score_matrix(matrix)
+        report('2 panels of ' + str(panelSize), personCount * scorer.riskSnps.len(), time.time() - start)
+
+
+def flatten_per_cell(inputFileName, outputFileName):
+    '''
+    Flattens a matrix the way CorrelationMatrix.flatten did before it worked
+    on blocks, with DictReader and a DictWriter.writerow per cell, to
+    compare against.
+    '''
+    with open(inputFileName, 'r') as inputFile:
+        reader = csv.DictReader(inputFile)
+        with open(outputFileName, 'w') as outputFile:
+            colnames = [correlationmatrix.FIELD_A_NAME, correlationmatrix.FIELD_B_NAME,
+                        correlationmatrix.FIELD_VALUE_NAME]
+            writer = csv.DictWriter(outputFile, colnames)
+            writer.writeheader()
+            for rowIn in reader:
+                colAName = rowIn.pop(correlationmatrix.FIELD_ROW_NAME)
+                for field in rowIn:
+                    writer.writerow({colnames[0]: colAName, colnames[1]: field, colnames[2]: rowIn[field]})
+
+
+def bench_flatten(matrixSize=DEFAULT_MATRIX_SIZE):
+    '''
+    Times flattening a matrixSize square matrix of random correlations a
+    cell at a time and a block of rows at a time, with and without the
+    filters, and unflattening it again.
+    '''
+    tempDir = tempfile.mkdtemp()
+    rand = random.Random(1)
+    names = ['rs' + str(number) for number in range(matrixSize)]
+    wideFileName = os.path.join(tempDir, 'wide.csv')
+    with open(wideFileName, 'w') as destFile:
+        destFile.write(csvrows.format_rows([[correlationmatrix.FIELD_ROW_NAME] + names]))
+        for name in names:
+            destFile.write(csvrows.format_rows([[name] + ['%.4f' % rand.uniform(-1, 1) for other in names]]))
+    cellCount = matrixSize * matrixSize
+    try:
+        tallFileName = os.path.join(tempDir, 'tall.csv')
+        start = time.time()
+        flatten_per_cell(wideFileName, tallFileName)
+        report_rows('DictWriter per cell', cellCount, time.time() - start)
+        matrix = correlationmatrix.CorrelationMatrix(wideFileName, tallFileName)
+        start = time.time()
+        matrix.flatten()
+        report_rows('blocks of rows', cellCount, time.time() - start)
+        start = time.time()
+        matrix.unflatten(os.path.join(tempDir, 'rebuilt.csv'))
+        report_rows('unflatten', cellCount, time.time() - start)
+        start = time.time()
+        matrix.flatten(threshold=0.9, upperTriangle=True)
+        report_rows('threshold 0.9, upper triangle', cellCount, time.time() - start)
+    finally:
+        shutil.rmtree(tempDir)
+
+
+def count_diffs_stepping(snpsAndAlleles, compareSnpsAndAlleles):
+    '''
+    Counts the differences between two people's sorted [snpId, allele] pairs
+    the way DifferenceCounts.count_diffs did before mergejoin, a snp at a
+    time with a string sentinel, to compare against.
+    '''
+    index = 0
+    compareIndex = 0
+    diffCount = 0
+    end = 'zz'
+    snp = snpsAndAlleles[0][0]
+    compareSnp = compareSnpsAndAlleles[0][0]
+    while ((snp < end) or (compareSnp < end)):
+        if (snp == compareSnp):
+            if (snpsAndAlleles[index][1] != compareSnpsAndAlleles[compareIndex][1]):
+                diffCount += 1
+            index += 1
+            compareIndex += 1
+        elif (snp < compareSnp):
+            diffCount += 1
+            index += 1
+        else:
+            diffCount += 1
+            compareIndex += 1
+        snp = snpsAndAlleles[index][0] if index < len(snpsAndAlleles) else end
+        compareSnp = compareSnpsAndAlleles[compareIndex][0] if compareIndex < len(compareSnpsAndAlleles) else end
+    return diffCount
+
+
+def make_join_people(snpCount, peopleCount, seed=1):
+    '''
+    Returns [snpId, allele] pairs for people typed on about snpCount snps,
+    like genomes from the same chip: most snps shared in long runs, a few
+    blocks of 1000 only some people have, and about 1% of alleles differing.
+    '''
+    rand = random.Random(seed)
+    alleles = [rand.choice(BASES) for index in range(snpCount)]
+    people = []
+    for personNumber in range(peopleCount):
+        pairs = []
+        for start in range(0, snpCount, 1000):
+            if (rand.random() < 0.05):
+                continue
+            for index in range(start, min(snpCount, start + 1000)):
+                allele = alleles[index]
+                if (rand.random() < 0.01):
+                    allele = rand.choice(BASES)
+                pairs.append(['rs' + str(index + 1), allele])
+        people.append(pairs)
+    return people
+
+
+def bench_join(snpCount=DEFAULT_JOIN_SNPS):
+    '''
+    Times counting one person's differences from JOIN_OTHERS others a snp at
+    a time on sorted string pairs, and with mergejoin on snp numbers, sorting
+    each person once.
+    '''
+    people = make_join_people(snpCount, JOIN_OTHERS + 1)
+    comparisons = JOIN_OTHERS * snpCount
+    start = time.time()
+    sortedPeople = [sorted(pairs) for pairs in people]
+    expected = [count_diffs_stepping(sortedPeople[0], other) for other in sortedPeople[1:]]
+    report_rows('a snp at a time, with sorting', comparisons, time.time() - start)
+    start = time.time()
+    alleleCodes = mergejoin.AlleleCodes()
+    joinPeople = [mergejoin.from_pairs(pairs, alleleCodes) for pairs in people]
+    report_rows('mergejoin sorting', comparisons, time.time() - start)
+    peopleColumns = []
+    for pairs in people:
+        columns = genomecache.GenomeColumns()
+        columns.add_records([vcffile.VcfRecord('chr1', '1', snpId, 'A', allele) for snpId, allele in pairs])
+        peopleColumns.append(columns)
+    start = time.time()
+    joinPeople = [mergejoin.from_columns(columns, alleleCodes) for columns in peopleColumns]
+    report_rows('mergejoin sorting GenomeColumns', comparisons, time.time() - start)
+    start = time.time()
+    counts = mergejoin.join_many(joinPeople[0], joinPeople[1:])
+    report_rows('mergejoin joins', comparisons, time.time() - start)
+    assert expected == [joinCounts.get_difference_count() for joinCounts in counts]
+
+
+def bench_similarity(personCount=DEFAULT_SIMILARITY_PEOPLE):
+    '''
+    Times counting every pair of people's snps with the same allele and with
+    an allele for both, for SIMILARITY_SNPS snps, a snp at a time for the
+    first row and with similarity.get_pair_counts on packed rows for them all.
+    '''
+    matrix = genotypematrix.GenotypeMatrix()
+    for personNumber, pairs in enumerate(make_join_people(SIMILARITY_SNPS, personCount)):
+        matrix.add_person_alleles('A' + str(personNumber), pairs)
+    rows = [matrix.get_row(personIndex) for personIndex in range(personCount)]
+    start = time.time()
+    for compareIndex in range(1, personCount):
+        pairs = zip(rows[0], rows[compareIndex])
+        same = len([pair for pair in pairs if pair[0] and pair[0] == pair[1]])
+        both = len([pair for pair in pairs if pair[0] and pair[1]])
+    report_rows('a snp at a time, one row', (personCount - 1) * SIMILARITY_SNPS, time.time() - start)
+    start = time.time()
+    counts = similarity.get_pair_counts(matrix)
+    report_rows('packed rows, every pair', personCount * (personCount - 1) / 2 * SIMILARITY_SNPS,
+                time.time() - start)
+    assert (same, both) == (counts.same[0][personCount - 1], counts.both[0][personCount - 1])
+
+
+def bench_minhash(personCount=DEFAULT_SKETCH_PEOPLE):
+    '''
+    Times sketching people typed on SKETCH_SNPS snps, half of them duplicated
+    with a few alleles changed, and finding the duplicates by joining every
+    pair and by joining only the candidate pairs of their sketches.
+    '''
+    rand = random.Random(2)
+    people = [make_join_people(SKETCH_SNPS, 1, seed)[0] for seed in range(personCount // 2)]
+    for pairs in people[:personCount // 2]:
+        people.append([[snpId, rand.choice(BASES)] if rand.random() < 0.02 else [snpId, allele]
+                       for snpId, allele in pairs])
+    alleleCodes = mergejoin.AlleleCodes()
+    sortedPeople = [mergejoin.from_pairs(pairs, alleleCodes) for pairs in people]
+    pairCount = len(people) * (len(people) - 1) // 2
+    start = time.time()
+    related = [(personIndex, compareIndex) for personIndex in range(len(people))
+               for compareIndex in range(personIndex + 1, len(people))
+               if mergejoin.join(sortedPeople[personIndex], sortedPeople[compareIndex]).get_jaccard() >= 0.9]
+    report_rows('joining every pair', pairCount, time.time() - start)
+    start = time.time()
+    sketches = [minhash.sketch_pairs(pairs) for pairs in people]
+    report_rows('sketching', len(people) * SKETCH_SNPS, time.time() - start)
+    start = time.time()
+    candidates = minhash.get_candidate_pairs(sketches, minhash.choose_bands(minhash.SKETCH_SIZE, 0.9))
+    found = [pair for pair in candidates if mergejoin.join(sortedPeople[pair[0]], sortedPeople[pair[1]]).get_jaccard() >= 0.9]
+    report_rows('banding and joining ' + str(len(candidates)) + ' candidates', pairCount, time.time() - start)
+    assert related == found
+
+
+def get_allele_number_per_call(allele, riskAllele):
+    '''The allele number from a dictionary built on every call, as VcfFile.get_an_allele_number once did.'''
+    riskAlleleDictionary = {'C': {'C':'4', 'G':'3', 'T':'2', 'A':'1'},
+                            'A': {'A':'4', 'G':'3', 'T':'2', 'C':'1'},
+                            'T': {'T':'4', 'G':'3', 'C':'2', 'A':'1'},
+                            'G': {'G':'4', 'T':'3', 'C':'2', 'A':'1'}}
+    return riskAlleleDictionary.get(riskAllele, {}).get(allele, '0')
+
+
+def bench_alleles(alleleCount=DEFAULT_ALLELE_COUNT):
+    '''
+    Times giving allele numbers from a dictionary built on every call, from
+    vcffile.ALLELE_NUMBER_TABLE one at a time, and from the table a list at
+    a time with vcffile.get_allele_numbers.
+    '''
+    rand = random.Random(3)
+    choices = ['A', 'C', 'G', 'T', 'A,G', '', 'AT']
+    alleles = [rand.choice(choices) for index in range(alleleCount)]
+    riskAlleles = [rand.choice(choices[:4] + ['N']) for index in range(alleleCount)]
+    start = time.time()
+    expected = [get_allele_number_per_call(alleles[index], riskAlleles[index]) for index in range(alleleCount)]
+    report('dictionary per call', alleleCount, time.time() - start)
+    start = time.time()
+    numbers = [vcffile.get_allele_number(alleles[index], riskAlleles[index]) for index in range(alleleCount)]
+    report('table, one at a time', alleleCount, time.time() - start)
+    assert expected == numbers
+    start = time.time()
+    numbers = vcffile.get_allele_numbers(alleles, riskAlleles)
+    report('table, a list at a time', alleleCount, time.time() - start)
+    assert expected == numbers
+
+
+BENCHMARKS = {'parse': bench_parse,
+              'panel': bench_panel,
+              'cache': bench_cache,
+              'rows': bench_rows,
+              'formats': bench_formats,
+              'dosage': bench_dosage,
+              'scores': bench_scores,
+              'shards': bench_shards,
+              'flatten': bench_flatten,
+              'join': bench_join,
+              'similarity': bench_similarity,
+              'minhash': bench_minhash,
+              'alleles': bench_alleles}
+
+if __name__ == '__main__':
+    #usage: python benchmarks.py [benchmark name] [size]
+    names = sorted(BENCHMARKS)
+    if (len(sys.argv) > 1):
+        names = [sys.argv[1]]
+    for name in names:
+        print name
+        if (len(sys.argv) > 2):
+            BENCHMARKS[name](int(sys.argv[2]))
+        else:
+            BENCHMARKS[name]()
@@ -0,0 +1,176 @@
+import zlib
+import struct
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+GZIP_MAGIC = '\x1f\x8b'
+BGZF_MAGIC = '\x1f\x8b\x08\x04'     #gzip magic, deflate, and the extra field flag
+BGZF_HEADER_SIZE = 12
+BGZF_MAX_BLOCK_DATA = 65280         #bgzip puts at most this much text in a block
+BGZF_EOF = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00\x1b\x00'
+            '\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+READ_SIZE = 1048576
+BLOCKS_PER_BATCH = 64
+DEFAULT_THREADS = multiprocessing.cpu_count()
+
+#the threads a bgzf file is inflated on when none are given; the worker
+#processes of cohort.map_people set it to 1, as the workers already share
+#out the cpus
+threads = DEFAULT_THREADS
+
+
+def set_threads(count):
+    '''Sets the threads bgzf files are inflated on when none are given.'''
+    global threads
+    threads = count
+
+
+def is_gzip(fileName):
+    '''True if the file starts with the gzip magic number.'''
+    with open(fileName, 'rb') as srcFile:
+        return srcFile.read(2) == GZIP_MAGIC
+
+
+def is_bgzf(fileName):
+    '''
+    True if the file is blocked gzip (as written by bgzip): a gzip file whose
+    first member has a BC extra field holding the size of the block.
+    '''
+    with open(fileName, 'rb') as srcFile:
+        header = srcFile.read(BGZF_HEADER_SIZE + 4)
+    return header.startswith(BGZF_MAGIC) and header[BGZF_HEADER_SIZE:BGZF_HEADER_SIZE + 2] == 'BC'
+
+
+def split_lines(text, remainder):
+    '''
+    Returns the complete lines in remainder + text, with their line endings,
+    and the partial line left over at the end.
+    '''
+    text = remainder + text
+    end = text.rfind('\n') + 1
+    return (text[:end].splitlines(True), text[end:])
+
+
+def iter_gzip_lines(fileName):
+    '''
+    Yields the lines of a gzip file, including files made of more than one
+    gzip member (as bgzip files are).
+    '''
+    with open(fileName, 'rb') as srcFile:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        remainder = ''
+        data = srcFile.read(READ_SIZE)
+        while (data):
+            text = decompressor.decompress(data)
+            while (decompressor.unused_data):
+                #the end of one member, the rest of the data starts the next
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                text += decompressor.decompress(data)
+            lines, remainder = split_lines(text, remainder)
+            for a_line in lines:
+                yield a_line
+            data = srcFile.read(READ_SIZE)
+        if (remainder):
+            yield remainder
+
+
+def read_block(srcFile):
+    '''
+    Reads the next bgzf block from the open file and returns its deflated data,
+    or None at the end of the file.
+    '''
+    header = srcFile.read(BGZF_HEADER_SIZE)
+    if (len(header) < BGZF_HEADER_SIZE):
+        return None
+    if (not header.startswith(BGZF_MAGIC)):
+        raise IOError('not a bgzf block at offset ' + str(srcFile.tell() - len(header)))
+    extraLength = struct.unpack('<H', header[10:12])[0]
+    extra = srcFile.read(extraLength)
+    blockSize = None
+    offset = 0
+    while (offset + 4 <= extraLength):
+        fieldLength = struct.unpack('<H', extra[offset + 2:offset + 4])[0]
+        if (extra[offset:offset + 2] == 'BC'):
+            blockSize = struct.unpack('<H', extra[offset + 4:offset + 6])[0] + 1
+        offset += 4 + fieldLength
+    if (blockSize is None):
+        raise IOError('bgzf block without a BC field')
+    rest = srcFile.read(blockSize - BGZF_HEADER_SIZE - extraLength)
+    #leave off the crc and size at the end of the block
+    return rest[:-8]
+
+
+def decompress_block(data):
+    '''Inflates the raw deflate data of one bgzf block.'''
+    return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+def iter_bgzf_lines(fileName, threadCount=None):
+    '''
+    Yields the lines of a bgzf file.  Because each block is compressed on its
+    own, we read a batch of blocks and inflate them on a pool of threadCount
+    threads (by default the module's threads), as zlib lets go of the
+    interpreter lock while it works, then split the text into lines in order.
+
+    The first block is inflated on its own in this thread, and the pool is
+    only started when a batch of more blocks is wanted, so reading just the
+    header lines doesn't start any threads.
+    '''
+    if (threadCount is None):
+        threadCount = threads
+    pool = None
+    inflate = map
+    try:
+        with open(fileName, 'rb') as srcFile:
+            remainder = ''
+            batchSize = 1
+            while (True):
+                batch = []
+                while (len(batch) < batchSize):
+                    block = read_block(srcFile)
+                    if (block is None):
+                        break
+                    batch.append(block)
+                if (not batch):
+                    break
+                if (pool is None and len(batch) > 1 and threadCount > 1):
+                    pool = ThreadPool(threadCount)
+                    inflate = pool.map
+                lines, remainder = split_lines(''.join(inflate(decompress_block, batch)), remainder)
+                for a_line in lines:
+                    yield a_line
+                batchSize = BLOCKS_PER_BATCH
+            if (remainder):
+                yield remainder
+    finally:
+        if (pool is not None):
+            pool.close()
+            pool.join()
+
+
+def iter_lines(fileName, threadCount=None):
+    '''Yields the lines of a gzip or bgzf file.'''
+    if (is_bgzf(fileName)):
+        return iter_bgzf_lines(fileName, threadCount)
+    return iter_gzip_lines(fileName)
+
+
+def write_bgzf(srcFileName, destFileName, blockDataSize=BGZF_MAX_BLOCK_DATA):
+    '''
+    Compresses a text file into bgzf blocks of up to blockDataSize bytes of
+    text, like bgzip does.
+    '''
+    with open(srcFileName, 'rb') as srcFile:
+        with open(destFileName, 'wb') as destFile:
+            text = srcFile.read(blockDataSize)
+            while (text):
+                compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+                data = compressor.compress(text) + compressor.flush()
+                blockSize = BGZF_HEADER_SIZE + 6 + len(data) + 8
+                destFile.write(BGZF_MAGIC + '\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00')
+                destFile.write(struct.pack('<H', blockSize - 1))
+                destFile.write(data)
+                destFile.write(struct.pack('<iI', zlib.crc32(text), len(text)))
+                text = srcFile.read(blockDataSize)
+            destFile.write(BGZF_EOF)
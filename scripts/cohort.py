@@ -0,0 +1,61 @@
+import collections
+import multiprocessing
+import vcffile
+import bgzf
+
+#the table object each worker process calls, set once when the worker starts
+_workerTable = None
+
+
+def _init_worker(table):
+    global _workerTable
+    _workerTable = table
+    #the workers share out the cpus, so each inflates bgzf blocks on one thread
+    bgzf.set_threads(1)
+
+
+def _call_worker(methodName, srcFileName):
+    return getattr(_workerTable, methodName)(srcFileName)
+
+
+def get_sorted_file_names(inputDir):
+    '''
+    Returns the paths of the vcf files in inputDir, sorted by person id so that
+    the tables we write come out in the same order every time.
+    '''
+    srcFileNames = vcffile.get_vcf_file_names(inputDir)
+    srcFileNames.sort(key=lambda srcFileName: vcffile.VcfFile(srcFileName).get_person_id())
+    return [inputDir + srcFileName for srcFileName in srcFileNames]
+
+
+def map_people(table, methodName, srcFileNames, workers=1, window=None):
+    '''
+    Calls table.methodName(srcFileName) for each file and yields
+    (srcFileName, result) pairs in the order of srcFileNames.
+
+    With more than one worker the calls run on a pool of worker processes.
+    The table is sent to each worker once, when it starts, and only the file
+    names go with each call.  At most window files (by default two per worker)
+    are in progress or waiting to be yielded at a time, so the memory used
+    stays bounded however many people there are.
+    '''
+    if (workers <= 1):
+        for srcFileName in srcFileNames:
+            yield (srcFileName, getattr(table, methodName)(srcFileName))
+        return
+    if (window is None):
+        window = 2 * workers
+    pool = multiprocessing.Pool(workers, _init_worker, (table,))
+    try:
+        pending = collections.deque()
+        for srcFileName in srcFileNames:
+            if (len(pending) >= window):
+                doneFileName, result = pending.popleft()
+                yield (doneFileName, result.get())
+            pending.append((srcFileName, pool.apply_async(_call_worker, (methodName, srcFileName))))
+        while (pending):
+            doneFileName, result = pending.popleft()
+            yield (doneFileName, result.get())
+    finally:
+        pool.terminate()
+        pool.join()
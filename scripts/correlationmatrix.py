@@ -1,70 +1,220 @@
 import os
 import csv
+import gzip
+import itertools
+from array import array
+import tablesink
 
 DEFAULT_DATA_DIR = '../data/'
 DEFAULT_INPUT_FILE_NAME = DEFAULT_DATA_DIR + 'dietmortcor.csv'
 DEFAULT_OUTPUT_FILE_NAME = DEFAULT_DATA_DIR + 'dietmortflat.csv'
+FIELD_ROW_NAME = 'Field'
 FIELD_A_NAME = 'A'
 FIELD_B_NAME = 'B'
 FIELD_VALUE_NAME = 'value'
+BLOCK_ROWS = 1000           #wide rows read at a time by flatten
+MAX_BLOCK_CELLS = 10000000  #cells held at a time by unflatten
+
+
+def open_table(fileName):
+    '''Opens a csv table for reading, gzip compressed if its name ends with .gz.'''
+    if (fileName.endswith('.gz')):
+        return gzip.open(fileName, 'rb')
+    return open(fileName, 'r')
+
+
+def iter_blocks(rows, blockSize):
+    '''Yields lists of up to blockSize rows at a time from an iterator of rows.'''
+    while (True):
+        block = list(itertools.islice(rows, blockSize))
+        if (not block):
+            return
+        yield block
 
 
 class CorrelationMatrix():
     '''
     CorrelationMatrix is a table of correlations.  The first column is the name
-    of the things being compared and each column is something it's being compared to. 
-    
+    of the things being compared and each column is something it's being compared to.
+
     An example correlation matrix is the correlations of the China Study dietary elements
     to causes of mortality.  Each row is a dietary element, such as meat or rice. Each column
-    is a cause of mortality, such as heart disease. Each cell contains a correlation, the 
-    correlation of meat to heart disease, for example.  
-    
+    is a cause of mortality, such as heart disease. Each cell contains a correlation, the
+    correlation of meat to heart disease, for example.
+
     Here we support the flattening of the matrix, to a tall table where there are three columns
-    field1Name, field2Name and correlation value.  This format is useful for some visualizations 
-    such as heatmap.
-    
+    field1Name, field2Name and correlation value.  This format is useful for some visualizations
+    such as heatmap.  unflatten turns a tall table back into a matrix.
+
+    Both work on blocks of rows, so a matrix of tens of thousands of rows
+    and columns (the snp by snp or person by person tables, say) is never
+    held in memory whole.
+
     @todo: allow column name args (for now we're using A and B and value as our column names)
     '''
-    
-    def __init__(self, inputFileName=DEFAULT_INPUT_FILE_NAME, outputFileName=DEFAULT_OUTPUT_FILE_NAME):
+
+    def __init__(self, inputFileName=DEFAULT_INPUT_FILE_NAME, outputFileName=DEFAULT_OUTPUT_FILE_NAME,
+                 outputFormat=tablesink.FORMAT_CSV):
         self._input_file_name = inputFileName
-        self._output_file_name = outputFileName
-        
-    def flatten(self):
+        self._output_format = outputFormat
+        self._output_file_name = tablesink.get_file_name(outputFileName, outputFormat)
+
+    def flatten(self, threshold=None, upperTriangle=False, blockSize=BLOCK_ROWS):
         '''
-        Loop through all the cells creating a 'tall' file with 3 columns from a 'wide' file.
+        Loop through all the cells creating a 'tall' file with 3 columns from a 'wide' file,
+        written in the output format (see tablesink.open_sink).  The cells
+        come out a row at a time, in the order of the columns.
+
+        With threshold, only the cells whose absolute value is at least
+        threshold are written.  With upperTriangle, only the cells on or
+        above the diagonal of a matrix whose rows and columns are the same
+        things are written, each pair once; a row whose name isn't a column
+        keeps all its cells.
+
+        The wide file is read blockSize rows at a time.  The values of each
+        block are read into an array of floats for the threshold test, and
+        the block's cells are written all at once, as columns (see
+        tablesink.open_sink), without making a row for each cell.
         '''
-        
+
         if (os.path.exists(self._output_file_name)):
             os.remove(self._output_file_name)
-        
+
         #open input file
-        with open(self._input_file_name, 'r') as inputFile:
-            reader = csv.DictReader(inputFile)
-            with open(self._output_file_name, 'w') as outputFile:
-                colnames = [FIELD_A_NAME, FIELD_B_NAME, FIELD_VALUE_NAME]
-                writer = csv.DictWriter(outputFile, fieldnames = colnames, lineterminator='\n')
-                writer.writeheader()
-                    
+        with open_table(self._input_file_name) as inputFile:
+            reader = csv.reader(inputFile)
+            fieldNames = reader.next()[1:]
+            columnIndex = dict((fieldNames[column], column) for column in range(len(fieldNames) - 1, -1, -1))
+            colnames = [FIELD_A_NAME, FIELD_B_NAME, FIELD_VALUE_NAME]
+            coltypes = [tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_FLOAT]
+            with tablesink.open_sink(self._output_file_name, colnames, coltypes, self._output_format) as sink:
                 #count the number of rows we write
                 countOfRowsWritten = 0
-                #loop through the rows in the input file
-                for rowIn in reader:
-                    #read the field name and then remove it from the row
-                    colAName = rowIn['Field']
-                    del rowIn['Field']
-                    
-                    rowOut = {FIELD_A_NAME:0, FIELD_B_NAME:0, FIELD_VALUE_NAME:0}
-                    for field in rowIn:
-                        value = rowIn[field]
-                        rowOut[FIELD_A_NAME] = colAName
-                        rowOut[FIELD_B_NAME] = field
-                        rowOut[FIELD_VALUE_NAME] = value
-                        writer.writerow(rowOut)
-                        countOfRowsWritten += 1
+                for block in iter_blocks(reader, blockSize):
+                    columnA = []
+                    columnB = []
+                    columnValues = []
+                    for rowIn in block:
+                        colAName = rowIn[0]
+                        values = rowIn[1:len(fieldNames) + 1]
+                        names = fieldNames[:len(values)]
+                        if (upperTriangle and colAName in columnIndex):
+                            first = columnIndex[colAName]
+                            values = values[first:]
+                            names = names[first:]
+                        if (threshold is not None):
+                            floats = array('d', map(tablesink.to_float, values))
+                            keep = [abs(value) >= threshold for value in floats]
+                            values = list(itertools.compress(values, keep))
+                            names = list(itertools.compress(names, keep))
+                        columnA.extend([colAName] * len(values))
+                        columnB.extend(names)
+                        columnValues.extend(values)
+                    sink.write_column_block([columnA, columnB, columnValues])
+                    countOfRowsWritten += len(columnA)
         print "wrote " + str(countOfRowsWritten) + " rows to " + self._output_file_name
-            
-        
+
+    def get_tall_names(self, tallFileName, symmetric):
+        '''
+        Reads a tall table and returns the names of the rows and columns of
+        its matrix, in the order they're first seen, and whether each row's
+        cells all come together.  If symmetric, the rows and columns are the
+        same names.
+        '''
+        rowNames = []
+        rowSet = set()
+        columnNames = []
+        columnSet = set()
+        isGrouped = True
+        lastName = None
+        with open_table(tallFileName) as tallFile:
+            reader = csv.reader(tallFile)
+            reader.next()
+            for nameA, nameB, value in reader:
+                if (nameA != lastName):
+                    if (nameA in rowSet):
+                        isGrouped = False
+                    else:
+                        rowNames.append(nameA)
+                        rowSet.add(nameA)
+                    lastName = nameA
+                if (nameB not in columnSet):
+                    columnNames.append(nameB)
+                    columnSet.add(nameB)
+        if (symmetric):
+            rowNames.extend([name for name in columnNames if name not in rowSet])
+            columnNames = rowNames
+        return (rowNames, columnNames, isGrouped)
+
+    def unflatten(self, wideFileName, tallFileName=None, symmetric=False, maxBlockCells=MAX_BLOCK_CELLS):
+        '''
+        Turns a tall table (A, B, value), the output file by default, back into
+        a wide csv matrix in wideFileName, the inverse of flatten.  The rows
+        and columns come in the order their names are first seen, and cells
+        that aren't in the tall table are blank.  With symmetric, each cell
+        (A, B) also fills (B, A), rebuilding the whole matrix from the upper
+        triangle flatten writes.
+
+        The wide rows are made a block at a time, as many rows as fit in
+        maxBlockCells cells, with one pass over the tall table for each block.
+        A tall table whose rows come grouped by A, as flatten writes them, is
+        done in a single pass unless it's symmetric.
+        '''
+        if (tallFileName is None):
+            tallFileName = self._output_file_name
+        rowNames, columnNames, isGrouped = self.get_tall_names(tallFileName, symmetric)
+        columnIndex = dict((columnNames[column], column) for column in range(len(columnNames)))
+        fieldNames = [FIELD_ROW_NAME] + columnNames
+        fieldTypes = [tablesink.TYPE_STR] + [tablesink.TYPE_FLOAT] * len(columnNames)
+        blockRows = max(1, maxBlockCells // max(1, len(columnNames)))
+        with tablesink.open_sink(wideFileName, fieldNames, fieldTypes) as sink:
+            if (isGrouped and not symmetric):
+                self.unflatten_grouped(tallFileName, columnNames, columnIndex, blockRows, sink)
+            else:
+                for first in range(0, len(rowNames), blockRows):
+                    self.unflatten_block(tallFileName, rowNames[first:first + blockRows], columnIndex,
+                                         symmetric, sink)
+        print "wrote " + str(len(rowNames)) + " rows to " + wideFileName
+
+    def unflatten_grouped(self, tallFileName, columnNames, columnIndex, blockRows, sink):
+        '''Writes the wide rows of a tall table grouped by A in one pass, blockRows at a time.'''
+        with open_table(tallFileName) as tallFile:
+            reader = csv.reader(tallFile)
+            reader.next()
+            rowsOut = []
+            for nameA, cells in itertools.groupby(reader, lambda cell: cell[0]):
+                namesA, namesB, values = zip(*cells)
+                if (list(namesB) == columnNames):
+                    #every column, in order, as flatten writes them
+                    rowOut = [nameA] + list(values)
+                else:
+                    rowOut = [nameA] + [''] * len(columnNames)
+                    for column in range(len(namesB)):
+                        rowOut[columnIndex[namesB[column]] + 1] = values[column]
+                rowsOut.append(rowOut)
+                if (len(rowsOut) >= blockRows):
+                    sink.write_rows(rowsOut)
+                    rowsOut = []
+            sink.write_rows(rowsOut)
+
+    def unflatten_block(self, tallFileName, blockNames, columnIndex, symmetric, sink):
+        '''Writes the wide rows for blockNames, filled from one pass over the tall table.'''
+        blockIndex = dict((blockNames[row], row) for row in range(len(blockNames)))
+        rowsOut = [[name] + [''] * len(columnIndex) for name in blockNames]
+        with open_table(tallFileName) as tallFile:
+            reader = csv.reader(tallFile)
+            reader.next()
+            for nameA, nameB, value in reader:
+                row = blockIndex.get(nameA)
+                if (row is not None):
+                    rowsOut[row][columnIndex[nameB] + 1] = value
+                if (symmetric):
+                    row = blockIndex.get(nameB)
+                    if (row is not None):
+                        rowsOut[row][columnIndex[nameA] + 1] = value
+        sink.write_rows(rowsOut)
+
+
 if __name__ == '__main__':
     destObj = CorrelationMatrix()
     destObj.flatten()
@@ -0,0 +1,79 @@
+QUOTE_CHARS = ',"\n'
+LINE_TERMINATOR = '\n'
+BUFFER_SIZE = 1048576
+
+
+def format_field(value):
+    '''
+    Returns one value as csv.writer writes it with the default (excel) dialect:
+    None is empty, floats use repr, and a field with a comma, a quote or a
+    newline is quoted with its quotes doubled.
+    '''
+    if (value is None):
+        text = ''
+    elif (isinstance(value, float)):
+        text = repr(value)
+    else:
+        text = str(value)
+    for quoteChar in QUOTE_CHARS:
+        if (quoteChar in text):
+            return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def format_column(values):
+    '''
+    Returns a column of values formatted with format_field.  A column of
+    plain strings with nothing to quote, or of whole numbers, is done all at
+    once.
+    '''
+    types = set(map(type, values))
+    if (types == set([str])):
+        text = '\t'.join(values)
+        for quoteChar in QUOTE_CHARS:
+            if (quoteChar in text):
+                #only a few values need quoting, like alleles A,G
+                return [format_field(value) if (',' in value or '"' in value or '\n' in value) else value
+                        for value in values]
+        return values
+    if (types <= set([int, long])):
+        return map(str, values)
+    return map(format_field, values)
+
+
+def format_rows(rows):
+    '''
+    Returns the text csv.writer would write for these rows, with '\n' line
+    endings, as one string.
+
+    When the rows are all the same width they are formatted a column at a
+    time (see format_column) and joined back into lines, rather than looking
+    at each field on its own.
+    '''
+    if (not rows):
+        return ''
+    width = len(rows[0])
+    if (width > 1 and all(len(row) == width for row in rows)):
+        return format_columns(zip(*rows))
+    else:
+        lines = []
+        for row in rows:
+            fields = [format_field(value) for value in row]
+            if (fields == ['']):
+                #csv.writer quotes a row of one empty field so it isn't a blank line
+                fields = ['""']
+            lines.append(','.join(fields))
+    return LINE_TERMINATOR.join(lines) + LINE_TERMINATOR
+
+
+def format_columns(columns):
+    '''
+    Returns the text format_rows would write for the rows made of these
+    columns, two or more lists of values of the same length, one value from
+    each per row.
+    Formatting a table a column at a time from the start saves making rows.
+    '''
+    if (not columns or not len(columns[0])):
+        return ''
+    lines = map(','.join, zip(*[format_column(column) for column in columns]))
+    return LINE_TERMINATOR.join(lines) + LINE_TERMINATOR
@@ -1,12 +1,15 @@
 import os
+import sys
+import genomecache
 import vcffile 
+import genotypematrix
+import manifest
+import mergejoin
 import csv
 
 DEFAULT_DATA_DIR = '../data/'
 DEFAULT_OUTPUT_FILE_NAME = DEFAULT_DATA_DIR + 'diffcounts.csv'
 DEFAULT_VCFS_DIR = DEFAULT_DATA_DIR + 'vcfdata/'
-MAXSNPID ='zz'    #snpIDs begin with an 'rs' so they will always be less than this 
-MINSNPID = 'aa'
 FIELD_PERSONID = 'personId'
 
 class DifferenceCounts():
@@ -20,90 +23,131 @@ class DifferenceCounts():
         self.inputDirectory = inputDirectory
         self.filename = outputFileName
     
-    def create_file(self):
+    def create_file(self, workers=1, window=None, incremental=False):
         '''
         Loops through the snp files and creates a table where each row is a person
         and each column is a person. The cells contain the number of differences found
         between them.
+
+        Each file is read once, into a GenotypeMatrix, with workers worker
+        processes (see cohort.map_people), and the people are compared from there
+        (see GenotypeMatrix.get_difference_counts).
+
+        With incremental, the files the table was made from are kept in a
+        manifest (see manifest.Manifest).  When new files arrive, the counts
+        between the people already in the table are read back from it and
+        only the new people are compared with everyone, so adding 10 people
+        to 500 is about 10 x 500 comparisons.  The people already in the table
+        are read again to compare with (quickly, from the genome cache, see
+        genomecache.py) and keep their order; the new people go at the end.
+        If a file in the table has changed or gone, the table is made again.
         
-        Future work - change the number so that it is a measure of similarity instead
-        of a measure of difference.  
+        For a measure of similarity instead of a count of differences, see
+        similarity.SimilarityTable.
         '''
-        
-        headerFields = [FIELD_PERSONID]
-        
-        srcFileNames = os.listdir(self.inputDirectory)
+        srcFileNames = vcffile.get_vcf_file_names(self.inputDirectory)
+        srcFileNames = [self.inputDirectory + srcFileName for srcFileName in srcFileNames]
+        knownCounts = None
+        addedFileNames = srcFileNames
+        if (incremental):
+            tableManifest = manifest.Manifest(manifest.get_manifest_name(self.filename))
+            tableManifest.load()
+            newFileNames = tableManifest.get_new_files(srcFileNames, self.filename)
+            if (newFileNames is not None):
+                personIds, counts = self.read_counts()
+                knownFileNames = self.get_known_file_names(srcFileNames, newFileNames, personIds)
+                if (knownFileNames is not None and not newFileNames):
+                    print "No new files for " + self.filename
+                    return
+                if (knownFileNames is not None):
+                    knownCounts = counts
+                    srcFileNames = knownFileNames + newFileNames
+                    addedFileNames = newFileNames
+            if (knownCounts is None):
+                tableManifest.clear()
+        matrix = genotypematrix.build_allele_matrix(srcFileNames, workers, window)
+        self.write_matrix(matrix, knownCounts)
+        if (incremental):
+            tableManifest.add_files(addedFileNames)
+            tableManifest.save(self.filename)
+
+    def get_known_file_names(self, srcFileNames, newFileNames, personIds):
+        '''
+        Returns the files of the people already in the table, personIds, in
+        the order of the table, or None if they don't match the files that
+        aren't new.
+        '''
+        newFileNames = set(newFileNames)
+        personFiles = {}
         for srcFileName in srcFileNames:
-            srcFile = vcffile.VcfFile(srcFileName)
-            personId = srcFile.get_person_id()
-            headerFields.append(personId)
+            if (srcFileName not in newFileNames):
+                personFiles[vcffile.VcfFile(srcFileName).get_person_id()] = srcFileName
+        if (sorted(personIds) != sorted(personFiles)):
+            return None
+        return [personFiles[personId] for personId in personIds]
+
+    def read_counts(self):
+        '''
+        Reads the table back and returns the person ids and a list with a list
+        of counts for each person, in the order of the table.
+        '''
+        with open(self.filename, 'r') as srcFile:
+            reader = csv.DictReader(srcFile)
+            personIds = reader.fieldnames[1:]
+            counts = []
+            for row in reader:
+                counts.append([int(row[personId]) for personId in personIds])
+        return (personIds, counts)
+
+    def write_matrix(self, matrix, knownCounts=None):
+        '''
+        Writes the table of differences between each pair of people in a
+        GenotypeMatrix of alleles.  knownCounts are the counts already found
+        for the first people (see GenotypeMatrix.get_difference_counts).
+        '''
+        headerFields = [FIELD_PERSONID] + matrix.personIds
+        diffCounts = matrix.get_difference_counts(knownCounts)
         
         with open(self.filename, 'w') as destFile:
             writer = csv.DictWriter(destFile, fieldnames=headerFields, lineterminator='\n')
             writer.writeheader()
             countOfSrcFiles = 0
-            for srcFileName in srcFileNames:
-                print srcFileName
-                srcFile = vcffile.VcfFile(self.inputDirectory + srcFileName)
-                personId = srcFile.get_person_id()
+            for personIndex in range(matrix.person_count()):
+                personId = matrix.personIds[personIndex]
                 rowOut = {FIELD_PERSONID:personId}
-                snpsAndAlleles = srcFile.get_all_snps_and_alleles()
-                snpsAndAlleles = sorted(snpsAndAlleles)
-                for compareFileName in srcFileNames:
-                    compareFile = vcffile.VcfFile(self.inputDirectory + compareFileName)
-                    comparePerson = compareFile.get_person_id()
-                    if (personId == comparePerson):
-                        countDiffs = 0
-                    else:
-                        print '   ' + compareFileName
-                        compareSnpsAndAlleles = compareFile.get_all_snps_and_alleles()
-                        compareSnpsAndAlleles = sorted(compareSnpsAndAlleles)
-                        countDiffs = self.count_diffs(snpsAndAlleles, compareSnpsAndAlleles)
-                    rowOut[comparePerson] = countDiffs
+                for compareIndex in range(matrix.person_count()):
+                    rowOut[matrix.personIds[compareIndex]] = diffCounts[personIndex][compareIndex]
                 writer.writerow(rowOut)
                 countOfSrcFiles += 1
         print "Wrote " + str(countOfSrcFiles) + " to " + self.filename
-                    
-    
+
     def count_diffs(self, snpsAndAlleles, compareSnpsAndAlleles):
         '''
-        Returns the count of differences between these two people.  
+        Returns the count of differences between these two people, from their
+        [snpId, allele] pairs, by a merge join on the snps' numbers (see
+        mergejoin.join).
+        '''
+        alleleCodes = mergejoin.AlleleCodes()
+        counts = mergejoin.join(mergejoin.from_pairs(snpsAndAlleles, alleleCodes),
+                                mergejoin.from_pairs(compareSnpsAndAlleles, alleleCodes))
+        return counts.get_difference_count()
+
+    def count_diffs_to_many(self, snpsAndAlleles, others):
+        '''
+        Returns the count of differences between one person and each of a list
+        of others, all from [snpId, allele] pairs.  Each person is sorted once.
         '''
-        index = 0
-        compareIndex = 0
-        diffCount = 0
-        snpAndAllele = snpsAndAlleles[index]
-        compareSnpAndAllele = compareSnpsAndAlleles[compareIndex]
-        snp = snpAndAllele[0]
-        compareSnp = compareSnpAndAllele[0]
-        while ((snp < MAXSNPID) or (compareSnp < MAXSNPID)):
-            if (snp == compareSnp):
-                if snpAndAllele[1] != compareSnpAndAllele[1]:
-                    diffCount += 1
-                index += 1
-                compareIndex += 1
-            elif (snp < compareSnp):
-                diffCount += 1
-                index += 1
-            else:  #snp > compareSnp
-                diffCount += 1
-                compareIndex += 1
-            if (index < len(snpsAndAlleles)):
-                snpAndAllele = snpsAndAlleles[index]
-                snp = snpAndAllele[0]
-            else:
-                snp = MAXSNPID
-            if (compareIndex < len(compareSnpsAndAlleles)):
-                compareSnpAndAllele = compareSnpsAndAlleles[compareIndex]
-                compareSnp = compareSnpAndAllele[0]
-            else:
-                compareSnp = MAXSNPID
-        return diffCount
+        alleleCodes = mergejoin.AlleleCodes()
+        person = mergejoin.from_pairs(snpsAndAlleles, alleleCodes)
+        others = [mergejoin.from_pairs(other, alleleCodes) for other in others]
+        return [counts.get_difference_count() for counts in mergejoin.join_many(person, others)]
 
     
 if __name__ == '__main__':
+    if ('--no-cache' in sys.argv):
+        genomecache.set_enabled(False)
     destObj = DifferenceCounts()
-    destObj.create_file()
+    destObj.create_file(incremental=('--incremental' in sys.argv))
     
         
     
@@ -0,0 +1,311 @@
+import os
+import sys
+import errno
+import mmap
+import struct
+import hashlib
+from array import array
+import snpids
+
+DEFAULT_CACHE_DIR = '../data/cache/'
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024 * 1024
+CACHE_SUFFIX = '.genome'
+MAGIC = 'VCFGENO1'
+HEADER_FORMAT = '<8sc8I'
+COLUMN_NAMES = ['snpNumbers', 'positions', 'chromCodes', 'alleleCodes']     #the array attributes of GenomeColumns
+
+#settings for VcfFile, the scripts turn the cache off with --no-cache
+enabled = True
+cacheDir = DEFAULT_CACHE_DIR
+maxBytes = DEFAULT_MAX_BYTES
+
+
+def set_enabled(flag):
+    '''Turns the cache on or off for everything that reads vcf files.'''
+    global enabled
+    enabled = flag
+
+
+def get_cache():
+    '''Returns a GenomeCache with the current settings.'''
+    return GenomeCache(cacheDir, maxBytes)
+
+
+class GenomeColumns():
+    '''
+    GenomeColumns holds the snps of one vcf file as columns: the number of
+    each rs id, an allele code, a chromosome code and the position.  The
+    ids that aren't rs followed by a number (see snpids.parse_snp_number)
+    are kept in otherIds and stored as -1 - their index there.  The codes index the alleles and chroms lists.
+    '''
+
+    def __init__(self):
+        self.snpNumbers = array('i')
+        self.positions = array('i')
+        self.chromCodes = array('H')
+        self.alleleCodes = array('B')
+        self.alleles = []
+        self.chroms = []
+        self.otherIds = []
+
+    def __getstate__(self):
+        #arrays pickle as lists of numbers, which is slow, so send their bytes
+        state = dict(self.__dict__)
+        for name in COLUMN_NAMES:
+            state[name] = (state[name].typecode, state[name].tostring())
+        return state
+
+    def __setstate__(self, state):
+        for name in COLUMN_NAMES:
+            typecode, data = state[name]
+            state[name] = array(typecode)
+            state[name].fromstring(data)
+        self.__dict__.update(state)
+
+    def len(self):
+        '''The count of snps in the columns.'''
+        return len(self.snpNumbers)
+
+    def get_snp_id(self, index):
+        '''Returns the snp id string for the snp at index.'''
+        snpNumber = self.snpNumbers[index]
+        if (snpNumber >= 0):
+            return 'rs' + str(snpNumber)
+        return self.otherIds[-1 - snpNumber]
+
+    def get_snp_ids(self):
+        '''Returns the list of snp id strings.'''
+        otherIds = self.otherIds
+        return ['rs' + str(snpNumber) if snpNumber >= 0 else otherIds[-1 - snpNumber]
+                for snpNumber in self.snpNumbers]
+
+    def get_shared_snp_numbers(self):
+        '''
+        Returns the array of snp numbers in the numbering of snpids.get_snp_ids,
+        which the rs numbers already are; only the other ids are renumbered.
+        '''
+        if (not self.otherIds):
+            return self.snpNumbers
+        sharedNumbers = snpids.get_snp_ids().get_numbers(self.otherIds)
+        return array('i', [snpNumber if snpNumber >= 0 else sharedNumbers[-1 - snpNumber]
+                           for snpNumber in self.snpNumbers])
+
+    def get_all_snps_and_alleles(self):
+        '''Returns the [snpId, allele] pairs, as VcfFile.get_all_snps_and_alleles does.'''
+        alleles = self.alleles
+        return map(list, zip(self.get_snp_ids(), [alleles[code] for code in self.alleleCodes]))
+
+    def get_all_snps_and_locations(self):
+        '''Returns the [snpId, allele, chrom, location] lists, as VcfFile.get_all_snps_and_locations does.'''
+        alleles = self.alleles
+        chroms = [chrom if chrom.startswith('chr') else '' for chrom in self.chroms]
+        return map(list, zip(self.get_snp_ids(), [alleles[code] for code in self.alleleCodes],
+                             [chroms[code] for code in self.chromCodes], map(str, self.positions)))
+
+    def add_records(self, records):
+        '''Adds VcfRecords to the columns.'''
+        alleleIndex = dict((self.alleles[code], code) for code in range(len(self.alleles)))
+        chromIndex = dict((self.chroms[code], code) for code in range(len(self.chroms)))
+        addSnpNumber = self.snpNumbers.append
+        addPosition = self.positions.append
+        addChromCode = self.chromCodes.append
+        for record in records:
+            snpNumber = snpids.parse_snp_number(record.id)
+            if (snpNumber is not None):
+                addSnpNumber(snpNumber)
+            else:
+                #ids like rs12;rs13, or too big for the column
+                self.otherIds.append(record.id)
+                addSnpNumber(-len(self.otherIds))
+            code = alleleIndex.get(record.alt)
+            if (code is None):
+                code = len(self.alleles)
+                if (code == 256 and self.alleleCodes.typecode == 'B'):
+                    self.alleleCodes = array('H', self.alleleCodes)
+                self.alleles.append(record.alt)
+                alleleIndex[record.alt] = code
+            self.alleleCodes.append(code)
+            code = chromIndex.get(record.chrom)
+            if (code is None):
+                code = len(self.chroms)
+                self.chroms.append(record.chrom)
+                chromIndex[record.chrom] = code
+            addChromCode(code)
+            addPosition(int(record.pos))
+
+    def add_columns(self, other):
+        '''
+        Adds the snps of another GenomeColumns after these ones, recoding its
+        alleles, chromosomes and other ids into these ones' lists.
+        '''
+        alleleMap = get_code_map(self.alleles, other.alleles)
+        if (len(self.alleles) > 256 and self.alleleCodes.typecode == 'B'):
+            self.alleleCodes = array('H', self.alleleCodes)
+        if (self.alleleCodes.typecode == 'B' and other.alleleCodes.typecode == 'B'):
+            #recode a byte column all at once
+            table = ''.join([chr(code) for code in alleleMap]) + '\x00' * (256 - len(alleleMap))
+            self.alleleCodes.fromstring(other.alleleCodes.tostring().translate(table))
+        else:
+            self.alleleCodes.extend(array(self.alleleCodes.typecode, [alleleMap[code] for code in other.alleleCodes]))
+        chromMap = get_code_map(self.chroms, other.chroms)
+        if (chromMap == range(len(chromMap))):
+            self.chromCodes.extend(other.chromCodes)
+        else:
+            self.chromCodes.extend(array('H', [chromMap[code] for code in other.chromCodes]))
+        if (other.otherIds):
+            #-1 - index into otherIds, moved along by the ids already here
+            shift = len(self.otherIds)
+            self.snpNumbers.extend(array('i', [snpNumber if snpNumber >= 0 else snpNumber - shift
+                                               for snpNumber in other.snpNumbers]))
+            self.otherIds.extend(other.otherIds)
+        else:
+            self.snpNumbers.extend(other.snpNumbers)
+        self.positions.extend(other.positions)
+
+    def write(self, fileName):
+        '''
+        Writes the columns to a binary file: a header, the three string lists
+        and then each column's array.
+        '''
+        tables = [self.alleles, self.chroms, self.otherIds]
+        texts = ['\n'.join(table) for table in tables]
+        header = struct.pack(HEADER_FORMAT, MAGIC, sys.byteorder[0], self.len(), self.alleleCodes.itemsize,
+                             len(tables[0]), len(texts[0]), len(tables[1]), len(texts[1]),
+                             len(tables[2]), len(texts[2]))
+        with open(fileName, 'wb') as destFile:
+            destFile.write(header)
+            for text in texts:
+                destFile.write(text)
+            for column in [self.snpNumbers, self.positions, self.chromCodes, self.alleleCodes]:
+                column.tofile(destFile)
+
+
+def get_code_map(values, otherValues):
+    '''
+    Returns a list giving, for each code of otherValues, the code of the same
+    value in values, adding the values that aren't there yet.
+    '''
+    valueIndex = dict((values[code], code) for code in range(len(values)))
+    codeMap = []
+    for value in otherValues:
+        code = valueIndex.get(value)
+        if (code is None):
+            code = len(values)
+            values.append(value)
+            valueIndex[value] = code
+        codeMap.append(code)
+    return codeMap
+
+
+def read_columns(fileName):
+    '''
+    Memory maps a file written by GenomeColumns.write and returns the columns,
+    or None if it isn't one we can read.  Each column is copied out of the map
+    in a single block.
+    '''
+    with open(fileName, 'rb') as srcFile:
+        if (os.fstat(srcFile.fileno()).st_size < struct.calcsize(HEADER_FORMAT)):
+            return None
+        mapped = mmap.mmap(srcFile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        offset = struct.calcsize(HEADER_FORMAT)
+        header = struct.unpack_from(HEADER_FORMAT, mapped, 0)
+        magic, byteOrder, recordCount, alleleItemSize = header[:4]
+        if (magic != MAGIC or byteOrder != sys.byteorder[0]):
+            return None
+        tables = []
+        for count, length in [header[4:6], header[6:8], header[8:10]]:
+            text = mapped[offset:offset + length]
+            offset += length
+            tables.append(text.split('\n') if count else [])
+        columns = GenomeColumns()
+        columns.alleles, columns.chroms, columns.otherIds = tables
+        if (alleleItemSize == 2):
+            columns.alleleCodes = array('H')
+        for column in [columns.snpNumbers, columns.positions, columns.chromCodes, columns.alleleCodes]:
+            length = recordCount * column.itemsize
+            column.fromstring(mapped[offset:offset + length])
+            offset += length
+        return columns
+    finally:
+        mapped.close()
+
+
+class GenomeCache():
+    '''
+    GenomeCache keeps the parsed snps of vcf files as binary column files
+    (see GenomeColumns) so that reading a genome again doesn't mean splitting
+    every line of the text again.
+
+    A cache file is named for the vcf file's path, size and modification
+    time, so a changed vcf file is never read from an old cache file.  Each
+    time a cache file is used its modification time is updated, and when the
+    cache grows past maxBytes the least recently used files are removed.
+    '''
+
+    def __init__(self, cacheDirectory=DEFAULT_CACHE_DIR, maxBytes=DEFAULT_MAX_BYTES):
+        self.cacheDirectory = cacheDirectory
+        self.maxBytes = maxBytes
+
+    def get_cache_file_name(self, srcFileName):
+        '''Returns the name of the cache file for this version of the vcf file.'''
+        stat = os.stat(srcFileName)
+        key = '\t'.join([os.path.abspath(srcFileName), str(stat.st_size), repr(stat.st_mtime)])
+        return os.path.join(self.cacheDirectory, hashlib.sha1(key).hexdigest() + CACHE_SUFFIX)
+
+    def load(self, srcFileName):
+        '''Returns the cached GenomeColumns for the vcf file, or None if they aren't cached.'''
+        cacheFileName = self.get_cache_file_name(srcFileName)
+        if (not os.path.exists(cacheFileName)):
+            return None
+        #another process can evict the file at any time
+        try:
+            columns = read_columns(cacheFileName)
+            if (columns is not None):
+                os.utime(cacheFileName, None)
+        except (IOError, OSError) as error:
+            if (error.errno != errno.ENOENT):
+                raise
+            return None
+        return columns
+
+    def store(self, srcFileName, columns):
+        '''Writes GenomeColumns for the vcf file to the cache, then trims the cache.'''
+        if (not os.path.exists(self.cacheDirectory)):
+            os.makedirs(self.cacheDirectory)
+        cacheFileName = self.get_cache_file_name(srcFileName)
+        #write to a temporary name so another process never reads half a file
+        tempFileName = cacheFileName + '.' + str(os.getpid())
+        columns.write(tempFileName)
+        os.rename(tempFileName, cacheFileName)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used cache files until the cache fits in
+        maxBytes.  The worker processes of cohort.map_people store and evict
+        at the same time, so a file another process has just removed is
+        skipped.
+        '''
+        cacheFiles = []
+        totalBytes = 0
+        for fileName in os.listdir(self.cacheDirectory):
+            if (fileName.endswith(CACHE_SUFFIX)):
+                try:
+                    stat = os.stat(os.path.join(self.cacheDirectory, fileName))
+                except OSError as error:
+                    if (error.errno != errno.ENOENT):
+                        raise
+                    continue
+                cacheFiles.append((stat.st_mtime, stat.st_size, fileName))
+                totalBytes += stat.st_size
+        cacheFiles.sort()
+        for lastUsed, size, fileName in cacheFiles:
+            if (totalBytes <= self.maxBytes):
+                break
+            try:
+                os.remove(os.path.join(self.cacheDirectory, fileName))
+            except OSError as error:
+                if (error.errno != errno.ENOENT):
+                    raise
+            totalBytes -= size
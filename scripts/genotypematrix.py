@@ -0,0 +1,616 @@
+import itertools
+import operator
+from array import array
+from csv import DictReader
+from binascii import hexlify
+import vcffile
+import cohort
+import pipeline
+import snpids
+import mergejoin
+
+MISSING = 0
+RISK_CODES = ['0', '1', '2', '3', '4']  #the allele numbers from VcfFile.get_an_allele_number
+RISK_CODE = 4                           #the code of the risk allele in RISK_CODES
+DOSAGE_MISSING = vcffile.DOSAGE_MISSING
+#the risk code of each dosage byte, for translating a row of dosages at once
+DOSAGE_RISK_CODE_TABLE = ''.join([chr(RISK_CODE if dosage in [1, 2] else MISSING) for dosage in range(256)])
+#bytes that are 1 where a dosage byte is missing, and the dosage bytes with missing as 0
+DOSAGE_MISSING_TABLE = ''.join([chr(dosage == (DOSAGE_MISSING & 0xff)) for dosage in range(256)])
+DOSAGE_CALLED_TABLE = ''.join([chr(0 if dosage == (DOSAGE_MISSING & 0xff) else dosage) for dosage in range(256)])
+
+
+class GenotypeMatrix():
+    '''
+    GenotypeMatrix holds the alleles of a group of people as small integer
+    codes, one row per person and one column per snp.  Each row is an array of
+    unsigned bytes, so a person costs one byte per snp rather than a list of
+    [snpId, allele] strings.
+
+    The snps are numbered in the order they are first added and snpIndex maps
+    each snpId to its column.  numberIndex maps the snps' numbers (see
+    snpids.SnpIds) to their columns, for the people added from GenomeColumns,
+    whose snps are joined to the columns on integers.  The codes are numbered the same way: alleles[code]
+    is the allele string for a code and code 0 always means missing (the same
+    as the reference genome).  For a risk snp panel the codes are the allele
+    numbers 0 to 4 from VcfFile.get_an_allele_number.  If there are ever more
+    than 255 different alleles, the rows are widened to two bytes per snp.
+
+    Rows can be shorter than the number of snps when snps are added after the
+    person; the missing columns are read as 0.
+
+    A file can have more than one line for a snp.  The row holds the last
+    one, and the codes of the lines before it are kept in repeats, a
+    dictionary from person index to a dictionary from column to the list of
+    those codes, so the difference counts can count every line (see
+    get_difference_counts).
+    '''
+
+    def __init__(self, snpIds=None, alleles=None):
+        self.personIds = []
+        self.snpIds = []
+        self.snpIndex = {}
+        self.numberIndex = {}
+        self.alleles = []
+        self.alleleIndex = {}
+        self.rows = []
+        self.repeats = {}
+        self.typecode = 'B'
+        if (alleles is None):
+            alleles = ['0']
+        for allele in alleles:
+            self.get_allele_code(allele)
+        for snpId in (snpIds or []):
+            self.add_snp(snpId)
+
+    def person_count(self):
+        '''The count of people (rows) in the matrix.'''
+        return len(self.personIds)
+
+    def snp_count(self):
+        '''The count of snps (columns) in the matrix.'''
+        return len(self.snpIds)
+
+    def add_snp(self, snpId):
+        '''Adds a column for snpId, if there isn't one, and returns its index.'''
+        column = self.snpIndex.get(snpId)
+        if (column is None):
+            column = len(self.snpIds)
+            self.snpIds.append(snpId)
+            self.snpIndex[snpId] = column
+        return column
+
+    def add_snp_number(self, snpNumber):
+        '''Adds a column for the snp with this number (see snpids.SnpIds), if there isn't one, and returns its index.'''
+        column = self.numberIndex.get(snpNumber)
+        if (column is None):
+            column = self.add_snp(snpids.get_snp_ids().get_id(snpNumber))
+            self.numberIndex[snpNumber] = column
+        return column
+
+    def get_allele_code(self, allele):
+        '''Returns the code for this allele, giving it one if it's new.'''
+        code = self.alleleIndex.get(allele)
+        if (code is None):
+            code = len(self.alleles)
+            if (code == 256 and self.typecode == 'B'):
+                self.typecode = 'H'
+                self.rows = [array('H', row) for row in self.rows]
+            self.alleles.append(allele)
+            self.alleleIndex[allele] = code
+        return code
+
+    def add_person_codes(self, personId, codes):
+        '''Adds a row of codes, one per column, for this person.'''
+        self.personIds.append(personId)
+        self.rows.append(array(self.typecode, codes))
+
+    def add_person_alleles(self, personId, snpsAndAlleles):
+        '''
+        Adds a row for this person from [snpId, allele] pairs, such as
+        VcfFile.get_all_snps_and_alleles returns, adding columns for new snps.
+        The pairs can come from a generator.
+        '''
+        columns = []
+        codes = []
+        for snpAndAllele in snpsAndAlleles:
+            columns.append(self.add_snp(snpAndAllele[0]))
+            codes.append(self.get_allele_code(snpAndAllele[1]))
+        row = array(self.typecode, [MISSING]) * len(self.snpIds)
+        self.fill_row(row, columns, codes)
+        self.personIds.append(personId)
+        self.rows.append(row)
+
+    def fill_row(self, row, columns, codes):
+        '''
+        Sets the codes in the columns of a new person's row, the last code for
+        a column given more than once, with the ones before it going in
+        repeats for the person.
+        '''
+        if (len(set(columns)) == len(columns)):
+            for column, code in itertools.izip(columns, codes):
+                row[column] = code
+            return
+        filled = set()
+        personRepeats = {}
+        for column, code in itertools.izip(columns, codes):
+            if (column in filled and row[column] != MISSING):
+                personRepeats.setdefault(column, []).append(row[column])
+            filled.add(column)
+            row[column] = code
+        if (personRepeats):
+            self.repeats[len(self.personIds)] = personRepeats
+
+    def add_person_columns(self, personId, columns):
+        '''
+        Adds a row for this person from their GenomeColumns, adding columns
+        for new snps.  The snps are looked up by number and the alleles by
+        their codes in the GenomeColumns, so no id or allele strings are made
+        for the snps already in the matrix.
+        '''
+        snpNumbers = columns.get_shared_snp_numbers()
+        matrixColumns = map(self.numberIndex.get, snpNumbers)
+        if (None in matrixColumns):
+            matrixColumns = [column if column is not None else self.add_snp_number(snpNumber)
+                             for snpNumber, column in itertools.izip(snpNumbers, matrixColumns)]
+        codeMap = [self.get_allele_code(allele) for allele in columns.alleles]
+        row = array(self.typecode, [MISSING]) * len(self.snpIds)
+        self.fill_row(row, matrixColumns, map(codeMap.__getitem__, columns.alleleCodes))
+        self.personIds.append(personId)
+        self.rows.append(row)
+
+    def add_sample_alleles(self, sampleNames, snpsAndAlleles):
+        '''
+        Adds a row for each sample from (snpId, alleles) pairs, alleles having
+        the allele of each sample in the order of sampleNames, as
+        VcfFile.iter_sample_alleles gives them a line at a time.
+        '''
+        first = len(self.personIds)
+        for sampleName in sampleNames:
+            self.personIds.append(sampleName)
+            self.rows.append(array(self.typecode))
+        typecode = self.typecode
+        rows = self.rows[first:]
+        fileColumns = set()
+        for snpId, alleles in snpsAndAlleles:
+            column = self.add_snp(snpId)
+            if (column in fileColumns):
+                #a repeated line, keep the codes of the line before
+                for sampleIndex in range(len(rows)):
+                    code = rows[sampleIndex][column]
+                    if (code != MISSING):
+                        self.repeats.setdefault(first + sampleIndex, {}).setdefault(column, []).append(code)
+            fileColumns.add(column)
+            #look each different allele up once for the line
+            codeIndex = dict((allele, self.get_allele_code(allele)) for allele in set(alleles))
+            if (self.typecode != typecode):
+                #the rows were widened for a new code
+                typecode = self.typecode
+                rows = self.rows[first:]
+            for sampleIndex in range(len(rows)):
+                row = rows[sampleIndex]
+                if (len(row) < column):
+                    row.extend(array(typecode, [MISSING]) * (column - len(row)))
+                code = codeIndex[alleles[sampleIndex]]
+                if (len(row) == column):
+                    row.append(code)
+                else:
+                    row[column] = code
+
+    def get_row(self, personIndex):
+        '''Returns this person's row of codes with a code for every snp.'''
+        row = self.rows[personIndex]
+        if (len(row) < len(self.snpIds)):
+            row = row + array(self.typecode, [MISSING]) * (len(self.snpIds) - len(row))
+        return row
+
+    def get_code(self, personIndex, column):
+        '''Returns the code for this person and snp column.'''
+        row = self.rows[personIndex]
+        if (column < len(row)):
+            return row[column]
+        return MISSING
+
+    def get_allele(self, personIndex, snpId):
+        '''Returns the allele string this person has for snpId, '0' if missing.'''
+        column = self.snpIndex.get(snpId)
+        if (column is None):
+            return self.alleles[MISSING]
+        return self.alleles[self.get_code(personIndex, column)]
+
+    def iter_snps_and_alleles(self, personIndex):
+        '''Yields (snpId, allele) for the snps this person isn't missing, in column order.'''
+        row = self.rows[personIndex]
+        for column in range(len(row)):
+            code = row[column]
+            if (code != MISSING):
+                yield (self.snpIds[column], self.alleles[code])
+
+
+    def get_packed_row(self, personIndex):
+        '''
+        Returns this person's full row of codes packed into one (big) integer,
+        the first column in the highest bytes.  Integer operations on packed
+        rows work on every snp at once.
+        '''
+        row = self.get_row(personIndex)
+        if (len(row) == 0):
+            return 0
+        return int(hexlify(row.tostring()), 16)
+
+    def get_difference_counts(self, knownCounts=None):
+        '''
+        Returns a list with a list for each person of the count of snps where
+        they differ from each other person: one has an allele and the other is
+        missing, or they have different alleles.
+
+        Each row is packed into an integer once.  The count for a pair is the
+        number of non zero codes in the exclusive or of their packed rows, so
+        each pair is one pass over whole rows rather than a loop over the snps.
+        Only the pairs above the diagonal are counted, the others are copied.
+
+        A person with repeated snps (see repeats) has the columns with repeats
+        counted again from all their lines, the way the merge join of
+        DifferenceCounts.count_diffs counts them.
+
+        knownCounts can give the counts already found for the first people
+        (from an earlier run, say), a row for each of them with a count for
+        each of them.  Those pairs are copied rather than counted, so adding
+        a few people to many costs a few rows of comparisons.
+        '''
+        personCount = self.person_count()
+        knownCount = 0
+        if (knownCounts is not None):
+            knownCount = len(knownCounts)
+        itemSize = array(self.typecode).itemsize
+        unitMask = get_unit_mask(itemSize, self.snp_count())
+        packedRows = [self.get_packed_row(personIndex) for personIndex in range(personCount)]
+        alleleRanks = None
+        if (self.repeats):
+            alleleRanks = self.get_allele_ranks()
+        counts = [[0] * personCount for personIndex in range(personCount)]
+        for personIndex in range(knownCount):
+            counts[personIndex][:knownCount] = knownCounts[personIndex][:knownCount]
+        for personIndex in range(personCount):
+            packedRow = packedRows[personIndex]
+            personCounts = counts[personIndex]
+            for compareIndex in range(max(personIndex + 1, knownCount), personCount):
+                diffCount = count_nonzero_units(packedRow ^ packedRows[compareIndex], itemSize, unitMask)
+                if (personIndex in self.repeats or compareIndex in self.repeats):
+                    diffCount += self.get_repeat_correction(personIndex, compareIndex, alleleRanks)
+                personCounts[compareIndex] = diffCount
+                counts[compareIndex][personIndex] = diffCount
+        return counts
+
+    def get_allele_ranks(self):
+        '''Returns a list giving, for each code, the place of its allele string in sorted order.'''
+        ranks = [0] * len(self.alleles)
+        order = sorted(range(len(self.alleles)), key=self.alleles.__getitem__)
+        for rank in range(len(order)):
+            ranks[order[rank]] = rank
+        return ranks
+
+    def get_repeat_snps(self, personIndex, columns, alleleRanks):
+        '''
+        Returns mergejoin.SortedSnps of all of a person's lines for these
+        columns, numbered by column: the code in the row and any repeats.
+        The codes are the alleles' ranks (see get_allele_ranks), so a snp's
+        lines are in the order of their allele strings, as when sorting
+        [snpId, allele] pairs.
+        '''
+        personRepeats = self.repeats.get(personIndex, {})
+        snpColumns = []
+        codes = []
+        for column in columns:
+            columnCodes = personRepeats.get(column, []) + [self.get_code(personIndex, column)]
+            for code in columnCodes:
+                if (code != MISSING):
+                    snpColumns.append(column)
+                    codes.append(alleleRanks[code])
+        return mergejoin.SortedSnps(snpColumns, codes)
+
+    def get_repeat_correction(self, personIndex, compareIndex, alleleRanks):
+        '''
+        Returns what to add to the count of differences between two people from
+        their rows, one of whom has repeated snps, to count every line the way
+        a merge join of their [snpId, allele] lists does (see mergejoin.join):
+        the columns with repeats are joined and counted again.
+        '''
+        columns = set(self.repeats.get(personIndex, {})) | set(self.repeats.get(compareIndex, {}))
+        rowCount = len([column for column in columns
+                        if self.get_code(personIndex, column) != self.get_code(compareIndex, column)])
+        joinCounts = mergejoin.join(self.get_repeat_snps(personIndex, columns, alleleRanks),
+                                    self.get_repeat_snps(compareIndex, columns, alleleRanks))
+        return joinCounts.get_difference_count() - rowCount
+
+    def get_code_bitsets(self, code):
+        '''
+        Returns a list with an integer for each snp column, with bit p set if
+        person p has this code for the snp.
+        '''
+        bitsets = [0] * self.snp_count()
+        codeChar = chr(code) if code < 256 else None
+        for personIndex in range(self.person_count()):
+            row = self.rows[personIndex]
+            bit = 1 << personIndex
+            if (row.typecode == 'B'):
+                #let str.find scan the row for the code
+                rowBytes = row.tostring()
+                column = rowBytes.find(codeChar)
+                while (column >= 0):
+                    bitsets[column] |= bit
+                    column = rowBytes.find(codeChar, column + 1)
+            else:
+                for column in range(len(row)):
+                    if (row[column] == code):
+                        bitsets[column] |= bit
+        return bitsets
+
+    def get_cooccurrence_counts(self, code):
+        '''
+        Returns a list with a row for each snp column of the count of people who
+        have this code for both that snp and each other snp.  The diagonal is
+        the count of people with the code for the snp.
+
+        Each snp's people are a bitset (see get_code_bitsets), so a pair of snps
+        is one and and one popcount, however many people there are.  Only the
+        pairs on or above the diagonal are counted, the others are copied.
+        '''
+        bitsets = self.get_code_bitsets(code)
+        snpCount = len(bitsets)
+        counts = [array('l', [0]) * snpCount for column in range(snpCount)]
+        for columnA in range(snpCount):
+            bitsetA = bitsets[columnA]
+            if (bitsetA == 0):
+                continue
+            countsA = counts[columnA]
+            for columnB in range(columnA, snpCount):
+                count = popcount(bitsetA & bitsets[columnB])
+                countsA[columnB] = count
+                counts[columnB][columnA] = count
+        return counts
+
+
+class DosageMatrix():
+    '''
+    DosageMatrix holds the dosage of each risk snp's risk allele for a group
+    of people: 0, 1 or 2 copies, from their GT fields, or
+    vcffile.DOSAGE_MISSING if it wasn't called.  There is one row per person,
+    an array of signed bytes with one column per snp in the panel, so a
+    genotype costs one byte rather than an allele number string in a list.
+
+    The sums over the cohort are running totals that each row is added to
+    with map, translated first (see DOSAGE_CALLED_TABLE), so they're done in
+    C a row at a time without making a column of Python ints for each snp.  get_risk_matrix turns the
+    dosages into the 0 to 4 codes the risk snp tables use.
+    '''
+
+    def __init__(self, snpIds):
+        self.snpIds = list(snpIds)
+        self.personIds = []
+        self.rows = []
+
+    def person_count(self):
+        '''The count of people (rows) in the matrix.'''
+        return len(self.personIds)
+
+    def snp_count(self):
+        '''The count of snps (columns) in the matrix.'''
+        return len(self.snpIds)
+
+    def add_person_dosages(self, personId, dosages):
+        '''Adds a row of dosages, one per snp, for this person.'''
+        self.personIds.append(personId)
+        self.rows.append(array('b', dosages))
+
+    def get_column_sums(self, table):
+        '''Returns the sums, for each snp, of every row's bytes translated by table.'''
+        sums = [0] * self.snp_count()
+        for row in self.rows:
+            translated = array('b')
+            translated.fromstring(row.tostring().translate(table))
+            sums = map(operator.add, sums, translated)
+        return sums
+
+    def get_called_counts(self):
+        '''Returns the count of people whose dosage was called, for each snp.'''
+        personCount = self.person_count()
+        return [personCount - missingCount for missingCount in self.get_column_sums(DOSAGE_MISSING_TABLE)]
+
+    def get_dosage_sums(self):
+        '''
+        Returns the count of copies of the risk allele in the whole cohort, for
+        each snp, leaving out the people it wasn't called for.
+        '''
+        return self.get_column_sums(DOSAGE_CALLED_TABLE)
+
+    def get_person_dosage_sums(self):
+        '''Returns the count of risk alleles each person has over the called snps.'''
+        return [sum(row) + row.count(DOSAGE_MISSING) for row in self.rows]
+
+    def get_risk_matrix(self):
+        '''
+        Returns a GenotypeMatrix of the 0 to 4 codes of RISK_CODES, for the risk
+        snp tables: RISK_CODE for one or two copies of the risk allele and 0
+        for none or missing.  A dosage doesn't say which other allele a person
+        has, so the codes 1 to 3 aren't used.
+        '''
+        matrix = GenotypeMatrix(self.snpIds, RISK_CODES)
+        for personIndex in range(self.person_count()):
+            codes = array('B')
+            codes.fromstring(self.rows[personIndex].tostring().translate(DOSAGE_RISK_CODE_TABLE))
+            matrix.personIds.append(self.personIds[personIndex])
+            matrix.rows.append(codes)
+        return matrix
+
+
+def popcount(value):
+    '''Returns the number of bits set in a non negative integer.'''
+    return bin(value).count('1')
+
+
+def get_unit_mask(itemSize, unitCount):
+    '''
+    Returns an integer with the lowest bit set in each of unitCount units of
+    itemSize bytes, for count_nonzero_units.
+    '''
+    if (unitCount == 0):
+        return 0
+    return int(('0' * (2 * itemSize - 1) + '1') * unitCount, 16)
+
+
+def get_nonzero_units(value, itemSize, unitMask):
+    '''
+    Returns an integer with the lowest bit set in each unit of itemSize bytes
+    of value that isn't zero.  Each unit's bits are folded down into its
+    lowest bit and the other bits are masked off.
+    '''
+    shift = 4 * itemSize
+    while (shift > 0):
+        value |= value >> shift
+        shift //= 2
+    return value & unitMask
+
+
+def count_units(units):
+    '''Returns the count of units set in a result of get_nonzero_units, one hex digit 1 per unit.'''
+    return ('%x' % units).count('1')
+
+
+def count_nonzero_units(value, itemSize, unitMask):
+    '''Returns the count of units of itemSize bytes in value that aren't zero (see get_nonzero_units).'''
+    return count_units(get_nonzero_units(value, itemSize, unitMask))
+
+
+class RiskSnpReader():
+    '''Reads the risk snp allele numbers of the people in a file, for building a matrix on worker processes.'''
+
+    def __init__(self, riskSnps):
+        self.riskSnps = riskSnps
+
+    def read_people(self, srcFileName):
+        '''
+        Returns a list of (personId, allele numbers) for the people in the
+        file, one for a one person file and one per sample for a multi
+        sample file (see pipeline.read_risk_snps).
+        '''
+        people = []
+        genotypes = pipeline.read_risk_snps([srcFileName], self.riskSnps)
+        for personId, personGenotypes in itertools.groupby(genotypes, lambda genotype: genotype.personId):
+            people.append((personId, [int(genotype.allele) for genotype in personGenotypes]))
+        return people
+
+
+class AlleleReader():
+    '''Reads all of one person's snps and alleles, for building a matrix on worker processes.'''
+
+    def read_person(self, srcFileName):
+        '''
+        Returns (personId, GenomeColumns) for a one person file (see
+        VcfFile.get_genome_columns), or None for a multi sample file, which is
+        better read a line at a time into the matrix (see
+        add_multi_sample_file) than sent back whole.
+        '''
+        srcData = vcffile.VcfFile(srcFileName)
+        if (srcData.is_multi_sample()):
+            return None
+        return (srcData.get_person_id(), srcData.get_genome_columns())
+
+
+class DosageReader():
+    '''Reads the risk snp dosages of the people in a file, for building a matrix on worker processes.'''
+
+    def __init__(self, riskSnps):
+        self.riskSnps = riskSnps
+
+    def read_people(self, srcFileName):
+        '''
+        Returns a list of (personId, dosages) for the people in the file, one
+        for a one person file and one per sample for a multi sample file (see
+        VcfFile.get_these_risksnp_dosages).
+        '''
+        srcData = vcffile.VcfFile(srcFileName)
+        dosages = srcData.get_these_risksnp_dosages(self.riskSnps)
+        if (srcData.is_multi_sample()):
+            return zip(srcData.get_sample_names(), dosages)
+        return [(srcData.get_person_id(), dosages[0])]
+
+
+def build_risk_snp_matrix(srcFileNames, riskSnps, workers=1, window=None):
+    '''
+    Returns a GenotypeMatrix with one row per person and one column per risk
+    snp, holding the allele numbers (0 to 4) of get_these_risksnps.  A multi
+    sample file adds a row for each of its samples.
+
+    The people come from the pipeline.read_risk_snps source, read in this
+    process with one worker or on a pool of workers (see cohort.map_people).
+    '''
+    matrix = GenotypeMatrix(riskSnps.snps, RISK_CODES)
+    #a snp listed twice in the panel gets one column, filled from its first listing
+    panelIndexes = [riskSnps.snpIndex[snpId] for snpId in matrix.snpIds]
+    reader = RiskSnpReader(riskSnps)
+    for srcFileName, people in cohort.map_people(reader, 'read_people', srcFileNames, workers, window):
+        for personId, codes in people:
+            matrix.add_person_codes(personId, [codes[index] for index in panelIndexes])
+    return matrix
+
+
+def build_dosage_matrix(srcFileNames, riskSnps, workers=1, window=None):
+    '''
+    Returns a DosageMatrix with one row per person (a row for each sample of
+    a multi sample file) and one column per risk snp, read in this process
+    with one worker or on a pool of workers (see cohort.map_people).
+    '''
+    matrix = DosageMatrix(riskSnps.snps)
+    reader = DosageReader(riskSnps)
+    for srcFileName, people in cohort.map_people(reader, 'read_people', srcFileNames, workers, window):
+        for personId, dosages in people:
+            matrix.add_person_dosages(personId, dosages)
+    return matrix
+
+
+def add_multi_sample_file(matrix, srcData):
+    '''Adds a row for each sample in a multi sample VcfFile, reading it a line at a time.'''
+    snpsAndAlleles = ((record.id, alleles) for record, alleles in srcData.iter_sample_alleles())
+    matrix.add_sample_alleles(srcData.get_sample_names(), snpsAndAlleles)
+
+
+def build_allele_matrix(srcFileNames, workers=1, window=None):
+    '''
+    Returns a GenotypeMatrix with one row per person and a column for every
+    snp found in any of the files, holding the alleles.  Each file is read
+    once.  A multi sample file adds a row for each of its samples.
+
+    Each person's snps come as GenomeColumns and are joined to the matrix's
+    columns on their snp numbers (see GenotypeMatrix.add_person_columns).
+    With more than one worker the files are read on a pool of workers (see
+    cohort.map_people).  Multi sample files are always read in this process,
+    a line at a time (see add_multi_sample_file).
+    '''
+    matrix = GenotypeMatrix()
+    for srcFileName, person in cohort.map_people(AlleleReader(), 'read_person', srcFileNames, workers, window):
+        if (person is None):
+            add_multi_sample_file(matrix, vcffile.VcfFile(srcFileName))
+        else:
+            matrix.add_person_columns(person[0], person[1])
+    return matrix
+
+
+def read_risk_snp_table(fileName, personField):
+    '''
+    Returns a GenotypeMatrix of allele numbers read from a csv file with one
+    row per person and one column per risk snp, such as RiskSnpTable writes.
+    The normalization rows that RiskSnpTable.add_normalization_data adds are
+    left out.
+    '''
+    with open(fileName, 'r') as srcFile:
+        reader = DictReader(srcFile)
+        snpIds = reader.fieldnames[1:]
+        matrix = GenotypeMatrix(snpIds, RISK_CODES)
+        for row in reader:
+            personId = row[personField]
+            #don't count the normalization lines
+            if (len(personId) > 2):
+                codes = [matrix.get_allele_code(row[snpId]) for snpId in matrix.snpIds]
+                matrix.add_person_codes(personId, codes)
+    return matrix
@@ -0,0 +1,133 @@
+import os
+import hashlib
+
+MANIFEST_SUFFIX = '.manifest'
+MANIFEST_HEADER = '##manifest'
+HASH_READ_SIZE = 1048576
+
+
+def get_manifest_name(outputFileName):
+    '''Returns the name of the manifest kept next to an output file.'''
+    return outputFileName + MANIFEST_SUFFIX
+
+
+def get_file_state(fileName):
+    '''Returns the file's size and modification time as they're stored.'''
+    stat = os.stat(fileName)
+    return [str(stat.st_size), repr(stat.st_mtime)]
+
+
+def get_file_hash(srcFileName):
+    '''Returns the sha1 of the file's contents, as hex.'''
+    fileHash = hashlib.sha1()
+    with open(srcFileName, 'rb') as srcFile:
+        data = srcFile.read(HASH_READ_SIZE)
+        while (data):
+            fileHash.update(data)
+            data = srcFile.read(HASH_READ_SIZE)
+    return fileHash.hexdigest()
+
+
+class Manifest():
+    '''
+    Manifest is a list of the vcf files an output table was made from, kept
+    in a text file next to the table, so that when more files arrive we can
+    add just them.
+
+    The first line holds the table's key, a string that says what else the
+    table depends on (the risk snp panel, say); if the key changes nothing
+    in the table can be kept.  It also holds the size and modification time
+    of the table when the manifest was saved, after the table was written:
+    if the table has changed since, a run was stopped between writing the
+    table and saving the manifest (or while writing the table), and the
+    table may have rows the manifest doesn't list, so it's made again rather
+    than added to.  Then there is one line per file: its path,
+    size, modification time and sha1.  A file whose size and modification
+    time haven't changed is taken as unchanged without reading it.  If they
+    have, it's hashed, and it's only changed if the hash is different.
+    '''
+
+    def __init__(self, fileName, key=''):
+        self.fileName = fileName
+        self.key = key
+        self.entries = {}
+        self.tableState = ['', '']
+        self.isLoaded = False
+
+    def load(self):
+        '''
+        Reads the manifest file.  Returns False if there isn't one or it was
+        written for a different key.
+        '''
+        self.entries = {}
+        self.isLoaded = False
+        if (not os.path.exists(self.fileName)):
+            return False
+        with open(self.fileName, 'rb') as srcFile:
+            header = srcFile.readline().rstrip('\n').split('\t')
+            if (len(header) != 4 or header[0] != MANIFEST_HEADER or header[1] != self.key):
+                return False
+            self.tableState = header[2:]
+            for a_line in srcFile:
+                path, size, mtime, fileHash = a_line.rstrip('\n').split('\t')
+                self.entries[path] = [size, mtime, fileHash]
+        self.isLoaded = True
+        return True
+
+    def save(self, tableFileName):
+        '''
+        Writes the manifest file, with the state of the table as it is now, to
+        a temporary name first so a stopped run never leaves half of it.
+        '''
+        self.tableState = get_file_state(tableFileName)
+        tempFileName = self.fileName + '.' + str(os.getpid())
+        with open(tempFileName, 'wb') as destFile:
+            destFile.write('\t'.join([MANIFEST_HEADER, self.key] + self.tableState) + '\n')
+            for path in sorted(self.entries):
+                destFile.write('\t'.join([path] + self.entries[path]) + '\n')
+        os.rename(tempFileName, self.fileName)
+
+    def clear(self):
+        '''Forgets all the files, for when the table is made again from scratch.'''
+        self.entries = {}
+
+    def add_files(self, srcFileNames):
+        '''Records these files as they are now.'''
+        for srcFileName in srcFileNames:
+            self.entries[os.path.abspath(srcFileName)] = get_file_state(srcFileName) + [get_file_hash(srcFileName)]
+
+    def is_unchanged(self, srcFileName):
+        '''True if the file is in the manifest and hasn't changed since.'''
+        entry = self.entries.get(os.path.abspath(srcFileName))
+        if (entry is None):
+            return False
+        fileState = get_file_state(srcFileName)
+        if (entry[:2] == fileState):
+            return True
+        if (get_file_hash(srcFileName) != entry[2]):
+            return False
+        #touched but the same, remember the new time so we don't hash it again
+        entry[:2] = fileState
+        return True
+
+    def get_new_files(self, srcFileNames, tableFileName):
+        '''
+        Returns the files in srcFileNames that aren't in the manifest, in the
+        same order.  Returns None if the table, tableFileName, can't just have
+        them added: the manifest wasn't loaded, the table has gone or changed
+        since the manifest was saved, or a file in it has changed or gone.
+        '''
+        if (not self.isLoaded or not os.path.exists(tableFileName) or
+                get_file_state(tableFileName) != self.tableState):
+            return None
+        paths = set([os.path.abspath(srcFileName) for srcFileName in srcFileNames])
+        for path in self.entries:
+            if (path not in paths):
+                return None
+        newFileNames = []
+        for srcFileName in srcFileNames:
+            if (os.path.abspath(srcFileName) not in self.entries):
+                newFileNames.append(srcFileName)
+            elif (not self.is_unchanged(srcFileName)):
+                return None
+        return newFileNames
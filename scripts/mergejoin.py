@@ -0,0 +1,229 @@
+import bisect
+import itertools
+import operator
+from array import array
+import snpids
+
+CODE_BITS = 24    #allele codes are packed below the snp number, see SortedSnps
+CODE_MASK = (1 << CODE_BITS) - 1
+
+#A join compares two people's snps sorted by snp number (see snpids.SnpIds).
+#Rather than stepping both lists one snp at a time, it jumps: where one
+#person's next snps are all before the other's next snp, a galloping search
+#(looking 1, 2, 4, 8... ahead, then bisecting) finds the end of that run in a
+#few comparisons and the whole run is counted at once.  Where the two people
+#have the same snps, which is most of a genome, the matching run is found the
+#same way, comparing longer and longer runs of the two arrays as bytes (a
+#memcmp), and the alleles of the run are then compared all together.
+
+
+class AlleleCodes(dict):
+    '''
+    The codes of allele strings, given out in the order they're first asked
+    for, so every SortedSnps made with the same AlleleCodes can be compared
+    by code.
+    '''
+
+    def __missing__(self, allele):
+        code = len(self)
+        self[allele] = code
+        return code
+
+
+class SortedSnps():
+    '''
+    One person's snps sorted by number: snpNumbers, an array of int32s, and
+    codes, an array of the codes of their alleles (see AlleleCodes), in the
+    same order.  A person is sorted once and can then be joined with any
+    number of others.
+    '''
+
+    def __init__(self, snpNumbers, codes):
+        #sort each number and code packed into one integer, which is much
+        #quicker than sorting pairs
+        packed = map(operator.or_, map(operator.lshift, snpNumbers, itertools.repeat(CODE_BITS, len(codes))), codes)
+        packed.sort()
+        self.snpNumbers = array('i', [value >> CODE_BITS for value in packed])
+        self.codes = array('i', [value & CODE_MASK for value in packed])
+
+    def len(self):
+        '''The count of snps.'''
+        return len(self.snpNumbers)
+
+
+def from_pairs(snpsAndAlleles, alleleCodes):
+    '''Returns SortedSnps for [snpId, allele] pairs, such as VcfFile.get_all_snps_and_alleles returns.'''
+    snpIds = snpids.get_snp_ids()
+    return SortedSnps(snpIds.get_numbers([pair[0] for pair in snpsAndAlleles]),
+                      [alleleCodes[pair[1]] for pair in snpsAndAlleles])
+
+
+def from_columns(columns, alleleCodes):
+    '''Returns SortedSnps for a person's GenomeColumns.'''
+    codeMap = [alleleCodes[allele] for allele in columns.alleles]
+    return SortedSnps(columns.get_shared_snp_numbers(), map(codeMap.__getitem__, columns.alleleCodes))
+
+
+class JoinCounts(object):
+    '''
+    The counts from joining two people: the snps they both have with the
+    same allele and with different alleles, and the snps only the left or
+    only the right person has.
+    '''
+
+    __slots__ = ('same', 'different', 'leftOnly', 'rightOnly')
+
+    def __init__(self, same=0, different=0, leftOnly=0, rightOnly=0):
+        self.same = same
+        self.different = different
+        self.leftOnly = leftOnly
+        self.rightOnly = rightOnly
+
+    def get_difference_count(self):
+        '''The count of snps where the two differ: different alleles, or only one of them has it.'''
+        return self.different + self.leftOnly + self.rightOnly
+
+    def get_jaccard(self):
+        '''
+        The Jaccard similarity of the two people's (snp, allele) pairs: the
+        pairs they share over the pairs either has, or None if neither has any.
+        '''
+        either = self.same + 2 * self.different + self.leftOnly + self.rightOnly
+        if (either == 0):
+            return None
+        return float(self.same) / either
+
+    def get_identity_by_state(self):
+        '''
+        The share of the snps both people have where they have the same
+        allele, or None if they have none in common.
+        '''
+        both = self.same + self.different
+        if (both == 0):
+            return None
+        return float(self.same) / both
+
+    def __eq__(self, other):
+        return self.as_tuple() == other.as_tuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def as_tuple(self):
+        '''Returns (same, different, leftOnly, rightOnly).'''
+        return (self.same, self.different, self.leftOnly, self.rightOnly)
+
+    def __repr__(self):
+        return 'JoinCounts(%r, %r, %r, %r)' % self.as_tuple()
+
+
+def gallop(values, target, start):
+    '''
+    Returns the first index at or after start where values isn't less than
+    target, looking 1, 2, 4... places ahead until it's passed and then
+    bisecting the last step.  A short run costs a couple of comparisons and
+    a long one the log of its length.
+    '''
+    end = len(values)
+    low = start
+    step = 1
+    while (start + step < end and values[start + step] < target):
+        low = start + step
+        step *= 2
+    return bisect.bisect_left(values, target, low, min(start + step, end))
+
+
+def is_same_run(left, leftStart, right, rightStart, count):
+    '''
+    True if the count values of two arrays of the same type from leftStart
+    and rightStart are the same.  They are compared as bytes through buffers
+    on the arrays, which is a memcmp, without copying them.
+    '''
+    itemSize = left.itemsize
+    return (buffer(left, leftStart * itemSize, count * itemSize) ==
+            buffer(right, rightStart * itemSize, count * itemSize))
+
+
+def get_matching_length(left, leftStart, right, rightStart):
+    '''
+    Returns the length of the run of the same values in the arrays left from
+    leftStart and right from rightStart, comparing runs twice as long each
+    time until they differ and then bisecting the length.
+    '''
+    limit = min(len(left) - leftStart, len(right) - rightStart)
+    length = 0
+    step = 1
+    #grow the run while whole steps match
+    while (length < limit):
+        step = min(step, limit - length)
+        if (not is_same_run(left, leftStart + length, right, rightStart + length, step)):
+            break
+        length += step
+        step *= 2
+    else:
+        return length
+    #the mismatch is within the step after length
+    low = 0
+    high = step - 1
+    while (low < high):
+        middle = (low + high + 1) // 2
+        if (is_same_run(left, leftStart + length, right, rightStart + length, middle)):
+            low = middle
+        else:
+            high = middle - 1
+    return length + low
+
+
+def count_different(left, leftStart, right, rightStart, length):
+    '''
+    Returns the count of places in the length values from leftStart and
+    rightStart where the arrays left and right differ.  A run that's the same
+    throughout is one memcmp (see is_same_run); otherwise the values are
+    compared a pair at a time, in C, by imap.
+    '''
+    if (is_same_run(left, leftStart, right, rightStart, length)):
+        return 0
+    return length - sum(itertools.imap(operator.eq, left[leftStart:leftStart + length],
+                                       right[rightStart:rightStart + length]))
+
+
+def join(left, right):
+    '''
+    Returns the JoinCounts of two SortedSnps, in one pass over both.
+    '''
+    counts = JoinCounts()
+    leftNumbers = left.snpNumbers
+    rightNumbers = right.snpNumbers
+    leftIndex = 0
+    rightIndex = 0
+    leftEnd = len(leftNumbers)
+    rightEnd = len(rightNumbers)
+    while (leftIndex < leftEnd and rightIndex < rightEnd):
+        leftNumber = leftNumbers[leftIndex]
+        rightNumber = rightNumbers[rightIndex]
+        if (leftNumber < rightNumber):
+            nextIndex = gallop(leftNumbers, rightNumber, leftIndex)
+            counts.leftOnly += nextIndex - leftIndex
+            leftIndex = nextIndex
+        elif (rightNumber < leftNumber):
+            nextIndex = gallop(rightNumbers, leftNumber, rightIndex)
+            counts.rightOnly += nextIndex - rightIndex
+            rightIndex = nextIndex
+        else:
+            length = get_matching_length(leftNumbers, leftIndex, rightNumbers, rightIndex)
+            different = count_different(left.codes, leftIndex, right.codes, rightIndex, length)
+            counts.same += length - different
+            counts.different += different
+            leftIndex += length
+            rightIndex += length
+    counts.leftOnly += leftEnd - leftIndex
+    counts.rightOnly += rightEnd - rightIndex
+    return counts
+
+
+def join_many(left, rights):
+    '''
+    Returns the JoinCounts of one person's SortedSnps with each of a list of
+    others, sorting no one again.
+    '''
+    return [join(left, right) for right in rights]
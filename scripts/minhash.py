@@ -0,0 +1,386 @@
+import os
+import sys
+import bisect
+import collections
+import itertools
+import operator
+from zlib import crc32
+from array import array
+from binascii import hexlify, unhexlify
+import genomecache
+import vcffile
+import cohort
+import genotypematrix
+import mergejoin
+import snpids
+import tablesink
+
+DEFAULT_DATA_DIR = '../data/'
+DEFAULT_OUTPUT_FILE_NAME = DEFAULT_DATA_DIR + 'relatives.csv'
+DEFAULT_SKETCH_FILE_NAME = DEFAULT_DATA_DIR + 'cache/sketches.txt'
+DEFAULT_VCFS_DIR = DEFAULT_DATA_DIR + 'vcfdata/'
+DEFAULT_THRESHOLD = 0.9         #Jaccard similarity of the pairs written, duplicates and close relatives
+SKETCH_SIZE = 128               #minimum hashes in each person's sketch
+RECALL_MARGIN = 0.1             #the banding threshold is at least this far below the threshold, see choose_bands
+ESTIMATE_MARGIN = 0.15          #candidates whose sketches estimate this far below the threshold aren't counted
+SKETCHES_HEADER = '##sketches'
+HASH_BITS = 64
+HASH_MASK = 2 ** HASH_BITS - 1
+HASH_SEED = 0x9e3779b97f4a7c15  #the constants of splitmix64, see mix
+HASH_MULTIPLIERS = [0xbf58476d1ce4e5b9, 0x94d049bb133111eb]
+DENSIFY_STEP = 0x9e3779b9       #added for each bin an empty bin borrows across, see sketch_keys
+OTHER_ID_BASE = 2 ** 31         #the element numbers of ids that aren't rs numbers start here
+FIELD_A_NAME = 'A'
+FIELD_B_NAME = 'B'
+FIELD_ESTIMATE = 'estimate'
+FIELD_JACCARD = 'jaccard'
+FIELD_SAME = 'same'
+FIELD_DIFFERENCES = 'differences'
+
+#A MinHash sketch stands for a set: a person's (snp, allele) pairs.  Each pair
+#is hashed, and the chance that two sets have the same smallest hash is their
+#Jaccard similarity, so the share of places two sketches agree estimates it.
+#Rather than hash every pair SKETCH_SIZE times, each pair is hashed once and
+#the hashes are split into SKETCH_SIZE bins by value, keeping the smallest in
+#each (one permutation hashing); a bin with no hashes borrows from the next
+#bin that has one (densification).  The elements are numbered without
+#snpids.SnpIds, whose numbers for ids that aren't rs numbers come from its
+#file, so a sketch depends only on the person and stays right in a sketch
+#file kept longer than the snp id file.
+
+
+def get_other_number(snpId):
+    '''Returns the element number of a snp id that isn't an rs number, from its crc.'''
+    return OTHER_ID_BASE + (crc32(snpId) & 0x7fffffff)
+
+
+def get_allele_hash(allele):
+    '''Returns the 32 bit hash of an allele string.'''
+    return crc32(allele) & 0xffffffff
+
+
+def get_keys(snpNumbers, alleleHashes):
+    '''Returns the element of each snp: its number in the high 32 bits and the hash of its allele in the low.'''
+    return map(operator.or_, map(operator.lshift, snpNumbers, itertools.repeat(32, len(snpNumbers))), alleleHashes)
+
+
+def get_bin_starts(sketchSize):
+    '''Returns the smallest hash in each bin, and the end of the last.'''
+    return [-((-sketchBin << HASH_BITS) // sketchSize) for sketchBin in range(sketchSize)] + [HASH_MASK + 1]
+
+
+def mix(keys):
+    '''
+    Returns the 64 bit hashes of a list of integers, from the finaliser of
+    splitmix64: xors of shifts and multiplies, a step at a time over the
+    whole list with map, so the loops are in C.  A simple multiply and add
+    would leave the hashes of snps numbered one after another in step.
+    '''
+    count = len(keys)
+    values = map(operator.and_, map(operator.add, keys, itertools.repeat(HASH_SEED, count)),
+                 itertools.repeat(HASH_MASK, count))
+    for shift, multiplier in zip([30, 27], HASH_MULTIPLIERS):
+        values = map(operator.xor, values, map(operator.rshift, values, itertools.repeat(shift, count)))
+        values = map(operator.and_, map(operator.mul, values, itertools.repeat(multiplier, count)),
+                     itertools.repeat(HASH_MASK, count))
+    return map(operator.xor, values, map(operator.rshift, values, itertools.repeat(31, count)))
+
+
+def sketch_keys(keys, sketchSize=SKETCH_SIZE):
+    '''
+    Returns the sketch of a list of elements, an array of sketchSize 32 bit
+    minimum hashes.  The hashes are worked out and sorted in C (see mix) and
+    the smallest in each bin is found by bisecting.
+    '''
+    keyCount = len(keys)
+    hashes = mix(keys)
+    hashes.sort()
+    binStarts = get_bin_starts(sketchSize)
+    minimums = [None] * sketchSize
+    for sketchBin in range(sketchSize):
+        index = bisect.bisect_left(hashes, binStarts[sketchBin])
+        if (index < keyCount and hashes[index] < binStarts[sketchBin + 1]):
+            minimums[sketchBin] = hashes[index] & 0xffffffff
+    sketch = array('I', [0]) * sketchSize
+    if (not keyCount):
+        return sketch
+    for sketchBin in range(sketchSize):
+        distance = 0
+        while (minimums[(sketchBin + distance) % sketchSize] is None):
+            distance += 1
+        sketch[sketchBin] = (minimums[(sketchBin + distance) % sketchSize] + distance * DENSIFY_STEP) & 0xffffffff
+    return sketch
+
+
+def sketch_pairs(snpsAndAlleles, sketchSize=SKETCH_SIZE):
+    '''Returns the sketch of [snpId, allele] pairs, such as VcfFile.get_all_snps_and_alleles returns.'''
+    snpNumbers = []
+    for snpId, allele in snpsAndAlleles:
+        snpNumber = snpids.parse_snp_number(snpId)
+        snpNumbers.append(get_other_number(snpId) if snpNumber is None else snpNumber)
+    return sketch_keys(get_keys(snpNumbers, [get_allele_hash(pair[1]) for pair in snpsAndAlleles]), sketchSize)
+
+
+def sketch_columns(columns, sketchSize=SKETCH_SIZE):
+    '''Returns the sketch of a person's GenomeColumns, the same as sketch_pairs of their pairs.'''
+    snpNumbers = columns.snpNumbers
+    if (columns.otherIds):
+        otherNumbers = map(get_other_number, columns.otherIds)
+        snpNumbers = [snpNumber if snpNumber >= 0 else otherNumbers[-1 - snpNumber] for snpNumber in snpNumbers]
+    alleleHashes = map(get_allele_hash, columns.alleles)
+    return sketch_keys(get_keys(snpNumbers, map(alleleHashes.__getitem__, columns.alleleCodes)), sketchSize)
+
+
+def estimate_similarity(sketch, compareSketch):
+    '''Returns the share of places two sketches agree, an estimate of the Jaccard similarity of their sets.'''
+    return sum(itertools.imap(operator.eq, sketch, compareSketch)) / float(len(sketch))
+
+
+def choose_bands(sketchSize, threshold):
+    '''
+    Returns the count of bands to cut sketches into for get_candidate_pairs.
+    With bands of rows places each, two sets of similarity s share a band
+    with a chance of 1 - (1 - s ** rows) ** bands, which rises steeply
+    around (1 / bands) ** (1 / rows).  The bands are chosen so that point is
+    at least RECALL_MARGIN below threshold, missing few pairs above it, but
+    as high as it can be, so few pairs below it are candidates.
+    '''
+    bestBands = sketchSize
+    bestPoint = 0.0
+    for bands in range(1, sketchSize + 1):
+        if (sketchSize % bands == 0):
+            point = (1.0 / bands) ** (float(bands) / sketchSize)
+            if (bestPoint < point <= threshold - RECALL_MARGIN):
+                bestBands = bands
+                bestPoint = point
+    return bestBands
+
+
+def get_candidate_pairs(sketches, bands):
+    '''
+    Returns the sorted (index, index) pairs of sketches that are the same in
+    at least one of bands bands (locality sensitive hashing).  Each band of
+    each sketch goes in a dictionary once, so this is about linear in the
+    count of people, rather than comparing every pair.
+    '''
+    if (not sketches):
+        return []
+    rows = len(sketches[0]) // bands
+    pairs = set()
+    for band in range(bands):
+        buckets = collections.defaultdict(list)
+        for personIndex in range(len(sketches)):
+            buckets[sketches[personIndex][band * rows:(band + 1) * rows].tostring()].append(personIndex)
+        for bucket in buckets.itervalues():
+            if (len(bucket) > 1):
+                pairs.update(itertools.combinations(bucket, 2))
+    return sorted(pairs)
+
+
+def read_people_pairs(srcData):
+    '''Returns (personId, [snpId, allele] pairs) for each sample of a multi sample VcfFile.'''
+    matrix = genotypematrix.GenotypeMatrix()
+    genotypematrix.add_multi_sample_file(matrix, srcData)
+    return [(matrix.personIds[personIndex], map(list, matrix.iter_snps_and_alleles(personIndex)))
+            for personIndex in range(matrix.person_count())]
+
+
+def read_sorted_people(srcFileName, alleleCodes):
+    '''Returns (personId, mergejoin.SortedSnps) for each person in a file.'''
+    srcData = vcffile.VcfFile(srcFileName)
+    if (srcData.is_multi_sample()):
+        return [(personId, mergejoin.from_pairs(pairs, alleleCodes)) for personId, pairs in read_people_pairs(srcData)]
+    return [(srcData.get_person_id(), mergejoin.from_columns(srcData.get_genome_columns(), alleleCodes))]
+
+
+class SketchReader():
+    '''Sketches the people in a file, for sketching on worker processes.'''
+
+    def __init__(self, sketchSize=SKETCH_SIZE):
+        self.sketchSize = sketchSize
+
+    def read_people(self, srcFileName):
+        '''Returns a list of (personId, sketch), one for a one person file and one per sample for a multi sample file.'''
+        srcData = vcffile.VcfFile(srcFileName)
+        if (srcData.is_multi_sample()):
+            return [(personId, sketch_pairs(pairs, self.sketchSize)) for personId, pairs in read_people_pairs(srcData)]
+        return [(srcData.get_person_id(), sketch_columns(srcData.get_genome_columns(), self.sketchSize))]
+
+
+class SketchStore():
+    '''
+    SketchStore keeps the sketches of the people in vcf files in a text file,
+    so each file is only sketched once.  The first line holds the sketch
+    size and hash constants; sketches made with others are thrown away.  Then
+    there is a line per person: the file's path, size and modification time,
+    the person id and the sketch in hex.  A file whose size or modification
+    time has changed is sketched again.
+    '''
+
+    def __init__(self, fileName=DEFAULT_SKETCH_FILE_NAME, sketchSize=SKETCH_SIZE):
+        self.fileName = fileName
+        self.sketchSize = sketchSize
+        self.key = ' '.join(['minhash', str(sketchSize), str(HASH_SEED)])
+        self.entries = {}
+
+    def load(self):
+        '''Reads the sketch file, if there is one for this key.'''
+        self.entries = {}
+        if (not os.path.exists(self.fileName)):
+            return
+        with open(self.fileName, 'rb') as srcFile:
+            header = srcFile.readline().rstrip('\n').split('\t', 1)
+            if (header[0] != SKETCHES_HEADER or header[1:] != [self.key]):
+                return
+            for a_line in srcFile:
+                path, size, mtime, personId, hexSketch = a_line.rstrip('\n').split('\t')
+                sketch = array('I')
+                sketch.fromstring(unhexlify(hexSketch))
+                self.entries.setdefault(path, [size, mtime, []])[2].append((personId, sketch))
+
+    def save(self):
+        '''Writes the sketch file, to a temporary name first so another process never reads half of it.'''
+        directory = os.path.dirname(self.fileName)
+        if (directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+        tempFileName = self.fileName + '.' + str(os.getpid())
+        with open(tempFileName, 'wb') as destFile:
+            destFile.write(SKETCHES_HEADER + '\t' + self.key + '\n')
+            for path in sorted(self.entries):
+                size, mtime, people = self.entries[path]
+                for personId, sketch in people:
+                    destFile.write('\t'.join([path, size, mtime, personId, hexlify(sketch.tostring())]) + '\n')
+        os.rename(tempFileName, self.fileName)
+
+    def get_file_state(self, srcFileName):
+        '''Returns the file's size and modification time as they're stored.'''
+        stat = os.stat(srcFileName)
+        return [str(stat.st_size), repr(stat.st_mtime)]
+
+    def is_unchanged(self, srcFileName):
+        '''True if the file's people are stored and it hasn't changed since.'''
+        entry = self.entries.get(os.path.abspath(srcFileName))
+        return entry is not None and entry[:2] == self.get_file_state(srcFileName)
+
+    def add_people(self, srcFileName, people):
+        '''Stores the (personId, sketch) of the people in a file as it is now.'''
+        self.entries[os.path.abspath(srcFileName)] = self.get_file_state(srcFileName) + [people]
+
+    def get_people(self, srcFileNames):
+        '''Returns (srcFileName, personId, sketch) for the people in the files, in the order of the files.'''
+        people = []
+        for srcFileName in srcFileNames:
+            for personId, sketch in self.entries[os.path.abspath(srcFileName)][2]:
+                people.append((srcFileName, personId, sketch))
+        return people
+
+
+class RelatedPeople():
+    '''
+    RelatedPeople finds the pairs of people whose genomes are nearly the
+    same (duplicate samples, sample swaps, close relatives) without comparing
+    everyone with everyone, as DifferenceCounts and similarity.SimilarityTable
+    do.  Each person is sketched once (see sketch_columns) and the sketches
+    are kept (see SketchStore), so adding people costs only their sketching.
+    Pairs whose sketches agree on a band are candidates (see
+    get_candidate_pairs), and only the candidates are counted exactly, by a
+    merge join of their snps (see mergejoin.join).
+
+    The table has a row for each pair whose Jaccard similarity, the (snp,
+    allele) pairs they share over the pairs either has, is at least
+    threshold: the two person ids, the estimate from their sketches, the
+    Jaccard similarity, and the counts of snps with the same allele and of
+    differences (as DifferenceCounts counts them).  A pair a little above
+    threshold can be missed, with a small chance (see choose_bands).
+    '''
+
+    def __init__(self, inputDirectory=DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME,
+                 threshold=DEFAULT_THRESHOLD, sketchFileName=DEFAULT_SKETCH_FILE_NAME,
+                 sketchSize=SKETCH_SIZE, outputFormat=tablesink.FORMAT_CSV):
+        self.inputDirectory = inputDirectory
+        self.threshold = threshold
+        self.outputFormat = outputFormat
+        self.filename = tablesink.get_file_name(outputFileName, outputFormat)
+        self.store = SketchStore(sketchFileName, sketchSize)
+
+    def create_file(self, workers=1, window=None):
+        '''
+        Sketches the files that are new or have changed, with workers worker
+        processes (see cohort.map_people), finds the candidate pairs, counts
+        them and writes the pairs at or above threshold.
+        '''
+        srcFileNames = cohort.get_sorted_file_names(self.inputDirectory)
+        self.update_sketches(srcFileNames, workers, window)
+        people = self.store.get_people(srcFileNames)
+        sketches = [person[2] for person in people]
+        bands = choose_bands(self.store.sketchSize, self.threshold)
+        candidates = [(personIndex, compareIndex) for personIndex, compareIndex in get_candidate_pairs(sketches, bands)
+                      if estimate_similarity(sketches[personIndex], sketches[compareIndex]) >=
+                      self.threshold - ESTIMATE_MARGIN]
+        print "Counting " + str(len(candidates)) + " candidate pairs of " + str(len(people)) + " people"
+        self.write_pairs(people, self.count_pairs(people, candidates))
+
+    def update_sketches(self, srcFileNames, workers=1, window=None):
+        '''
+        Sketches the files that aren't in the sketch file or have changed
+        since, drops the files that have gone, and saves the sketch file.
+        Returns the files sketched.
+        '''
+        self.store.load()
+        newFileNames = [srcFileName for srcFileName in srcFileNames if not self.store.is_unchanged(srcFileName)]
+        paths = set([os.path.abspath(srcFileName) for srcFileName in srcFileNames])
+        for path in self.store.entries.keys():
+            if (path not in paths):
+                del self.store.entries[path]
+        reader = SketchReader(self.store.sketchSize)
+        for srcFileName, people in cohort.map_people(reader, 'read_people', newFileNames, workers, window):
+            self.store.add_people(srcFileName, people)
+        self.store.save()
+        return newFileNames
+
+    def count_pairs(self, people, candidates):
+        '''
+        Returns (personIndex, compareIndex, JoinCounts) for the candidate pairs
+        of people.  The files of the people in any candidate pair are read
+        once each (from the genome cache, see genomecache.py) and their snps
+        sorted once each and kept while the pairs are joined.
+        '''
+        wanted = set(itertools.chain(*candidates))
+        personIndexes = dict(((people[personIndex][0], people[personIndex][1]), personIndex)
+                             for personIndex in wanted)
+        alleleCodes = mergejoin.AlleleCodes()
+        sortedPeople = {}
+        for srcFileName in sorted(set([people[personIndex][0] for personIndex in wanted])):
+            for personId, sortedSnps in read_sorted_people(srcFileName, alleleCodes):
+                personIndex = personIndexes.get((srcFileName, personId))
+                if (personIndex is not None):
+                    sortedPeople[personIndex] = sortedSnps
+        return [(personIndex, compareIndex, mergejoin.join(sortedPeople[personIndex], sortedPeople[compareIndex]))
+                for personIndex, compareIndex in candidates]
+
+    def write_pairs(self, people, pairCounts):
+        '''Writes a row for each counted pair at or above threshold.'''
+        fieldNames = [FIELD_A_NAME, FIELD_B_NAME, FIELD_ESTIMATE, FIELD_JACCARD, FIELD_SAME, FIELD_DIFFERENCES]
+        fieldTypes = [tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_FLOAT, tablesink.TYPE_FLOAT,
+                      tablesink.TYPE_INT, tablesink.TYPE_INT]
+        rowsOut = []
+        for personIndex, compareIndex, counts in pairCounts:
+            jaccard = counts.get_jaccard()
+            if (jaccard is not None and jaccard >= self.threshold):
+                rowsOut.append([people[personIndex][1], people[compareIndex][1],
+                                estimate_similarity(people[personIndex][2], people[compareIndex][2]),
+                                jaccard, counts.same, counts.get_difference_count()])
+        if (os.path.exists(self.filename)):
+            os.remove(self.filename)
+        with tablesink.open_sink(self.filename, fieldNames, fieldTypes, self.outputFormat) as sink:
+            sink.write_rows(rowsOut)
+        print "Wrote " + str(len(rowsOut)) + " pairs to " + self.filename
+
+
+if __name__ == '__main__':
+    #usage: python minhash.py [threshold] [--no-cache]
+    if ('--no-cache' in sys.argv):
+        genomecache.set_enabled(False)
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    destObj = RelatedPeople(threshold=float(args[0]) if args else DEFAULT_THRESHOLD)
+    destObj.create_file()
@@ -0,0 +1,177 @@
+import errno
+import vcffile
+import cohort
+
+BLOCK_SIZE = 10000      #rows handed to a sink at a time
+
+#A pipeline is a chain of generators: a source yields Genotypes, each stage
+#takes the stream from the one before and yields what it passes on, and a
+#sink at the end writes it.  Nothing is read until the sink asks for it and
+#each stage holds one record at a time, so the memory used doesn't grow with
+#the size of the genomes.  For example, the tall table of everyone's risk
+#snps is
+#
+#    genotypes = read_cohort(srcFileNames)
+#    genotypes = restrict_to_panel(genotypes, riskSnps)
+#    genotypes = encode_alleles(genotypes, riskSnps)
+#    genotypes = drop_missing(genotypes)
+#    write_rows(to_rows(genotypes, make_row), sink)
+
+
+class Genotype(object):
+    '''
+    One person's allele for one snp, the record that flows through a
+    pipeline.  index is the snp's place in a risk snp panel, once a stage
+    has looked it up, and None before.
+    '''
+
+    __slots__ = ('personId', 'snpId', 'allele', 'index')
+
+    def __init__(self, personId, snpId, allele, index=None):
+        self.personId = personId
+        self.snpId = snpId
+        self.allele = allele
+        self.index = index
+
+    def __repr__(self):
+        return 'Genotype(%r, %r, %r, %r)' % (self.personId, self.snpId, self.allele, self.index)
+
+
+def select_people(srcFileNames, personIds):
+    '''
+    Yields the names of the files of the people in personIds, in the order
+    of personIds, so that the other people's files aren't read at all.
+    Raises IOError, before any file is yielded, naming the person ids that
+    have no file.
+    '''
+    personFiles = {}
+    for srcFileName in srcFileNames:
+        personFiles.setdefault(vcffile.VcfFile(srcFileName).get_person_id(), srcFileName)
+    missingIds = [personId for personId in personIds if personId not in personFiles]
+    if (missingIds):
+        raise IOError(errno.ENOENT, 'no vcf file for ' + ', '.join(missingIds))
+    for personId in personIds:
+        yield personFiles[personId]
+
+
+def read_cohort(srcFileNames):
+    '''
+    Yields a Genotype for each snp of each file, one file after another (see
+    VcfFile.iter_snps_and_alleles).  A multi sample file gives a Genotype
+    for each of its samples on each line, so its people come interleaved,
+    line by line, rather than one after another.
+    '''
+    for srcFileName in srcFileNames:
+        srcData = vcffile.VcfFile(srcFileName)
+        if (srcData.is_multi_sample()):
+            sampleNames = srcData.get_sample_names()
+            for record, alleles in srcData.iter_sample_alleles():
+                snpId = record.id
+                for sampleIndex in range(len(sampleNames)):
+                    yield Genotype(sampleNames[sampleIndex], snpId, alleles[sampleIndex])
+            continue
+        personId = srcData.get_person_id()
+        for snpId, allele in srcData.iter_snps_and_alleles():
+            yield Genotype(personId, snpId, allele)
+
+
+def read_risk_snps(srcFileNames, riskSnps):
+    '''
+    Yields a Genotype for each risk snp of each person, in panel order, with
+    the allele numbers VcfFile.get_these_risksnps finds.  This is
+    read_cohort, restrict_to_panel and encode_alleles in one, using the vcf
+    file's index (see VcfIndex) when it has one rather than reading every line.
+    The samples of a multi sample file come one after another, from one
+    pass over the file (see VcfFile.get_these_risksnps_by_sample).
+    '''
+    for srcFileName in srcFileNames:
+        srcData = vcffile.VcfFile(srcFileName)
+        if (srcData.is_multi_sample()):
+            people = zip(srcData.get_sample_names(), srcData.get_these_risksnps_by_sample(riskSnps))
+        else:
+            people = [(srcData.get_person_id(), srcData.get_these_risksnps(riskSnps))]
+        for personId, alleleNumbers in people:
+            for index in range(len(alleleNumbers)):
+                yield Genotype(personId, riskSnps.snps[index], alleleNumbers[index], index)
+
+
+def restrict_to_panel(genotypes, riskSnps):
+    '''Passes on only the risk snps, with their index in the panel.'''
+    for genotype in genotypes:
+        index = riskSnps.get_index(genotype.snpId)
+        if (index >= 0):
+            genotype.index = index
+            yield genotype
+
+
+def encode_alleles(genotypes, riskSnps):
+    '''
+    Replaces the alleles of risk snps (after restrict_to_panel) with their
+    allele numbers from VcfFile.get_an_allele_number.
+    '''
+    riskAlleles = riskSnps.alleleCodes
+    for genotype in genotypes:
+        genotype.allele = vcffile.get_allele_number(genotype.allele, riskAlleles[genotype.index])
+        yield genotype
+
+
+def drop_missing(genotypes):
+    '''Passes on only the genotypes whose allele isn't '0'.'''
+    for genotype in genotypes:
+        if (genotype.allele != '0'):
+            yield genotype
+
+
+def to_rows(genotypes, make_row):
+    '''Yields make_row(genotype) for each genotype, the rows for a sink.'''
+    for genotype in genotypes:
+        yield make_row(genotype)
+
+
+def file_rows(srcFileNames, get_genotypes, make_row):
+    '''
+    Yields (srcFileName, rows) for each file, rows being a generator of
+    make_row(genotype) for the genotypes of get_genotypes([srcFileName]).
+    Each file's rows have to be used up before asking for the next file.
+    '''
+    for srcFileName in srcFileNames:
+        yield (srcFileName, to_rows(get_genotypes([srcFileName]), make_row))
+
+
+def map_file_rows(table, srcFileNames, workers=1, window=None):
+    '''
+    Yields (srcFileName, rows) for each file, the rows of a table such as
+    TallTable from its get_genotypes and get_genotype_row.  With one worker
+    this is file_rows.  With more, a one person file's rows come from the
+    same pipeline on a pool of worker processes, by table.read_person_rows,
+    and are sent back as a list (see cohort.map_people).  A multi sample
+    file is always streamed from this process, as with one worker, rather
+    than read whole on a worker and sent back.
+    '''
+    if (workers <= 1):
+        for srcFileName, rows in file_rows(srcFileNames, table.get_genotypes, table.get_genotype_row):
+            yield (srcFileName, rows)
+        return
+    for srcFileName, rows in cohort.map_people(table, 'read_person_rows', srcFileNames, workers, window):
+        if (rows is None):
+            rows = to_rows(table.get_genotypes([srcFileName]), table.get_genotype_row)
+        yield (srcFileName, rows)
+
+
+def write_rows(rows, sink, blockSize=BLOCK_SIZE):
+    '''
+    Writes the rows to a sink (see tablesink.open_sink), blockSize rows at a
+    time, and returns the count of rows written.
+    '''
+    rowCount = 0
+    block = []
+    for row in rows:
+        block.append(row)
+        if (len(block) >= blockSize):
+            sink.write_rows(block)
+            rowCount += len(block)
+            block = []
+    if (block):
+        sink.write_rows(block)
+        rowCount += len(block)
+    return rowCount
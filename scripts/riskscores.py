@@ -0,0 +1,200 @@
+import os
+import sys
+import math
+import itertools
+from array import array
+import genomecache
+import risksnps
+import cohort
+import genotypematrix
+import tablesink
+
+DEFAULT_DATA_DIR = '../data/'
+DEFAULT_VCFS_DIR = DEFAULT_DATA_DIR + 'vcfdata/'
+DEFAULT_SCORES_FILE_NAME = DEFAULT_DATA_DIR + 'riskscores.csv'
+FIELD_PERSONID = 'PersonId'
+SCORE_SUFFIX = '_score'
+CALLED_SUFFIX = '_called'
+#bytes that are 1 where a dosage byte is 1, 2 or missing, for translating
+#a person's row of dosages into selectors at once
+ONE_COPY_TABLE = ''.join(['\x01' if code == 1 else '\x00' for code in range(256)])
+TWO_COPIES_TABLE = ''.join(['\x01' if code == 2 else '\x00' for code in range(256)])
+MISSING_TABLE = ''.join(['\x01' if code == 255 else '\x00' for code in range(256)])
+
+
+def get_weight(oddsRatio):
+    '''Returns the log of an odds ratio, a number or a string, or None if it isn't a positive number.'''
+    try:
+        oddsRatio = float(oddsRatio)
+    except (TypeError, ValueError):
+        return None
+    if (not oddsRatio > 0 or math.isinf(oddsRatio)):
+        return None
+    return math.log(oddsRatio)
+
+
+def get_panel_name(panelFileName):
+    '''Returns the name a panel's columns are given in the score table, its file name without .csv.'''
+    name = os.path.basename(panelFileName)
+    if (name.endswith('.csv')):
+        name = name[:-len('.csv')]
+    return name
+
+
+class RiskScorer():
+    '''
+    RiskScorer gives people polygenic risk scores for one or more panels of
+    risk snps: the sum over a panel's snps of the dosage of the risk allele
+    (see VcfFile.get_these_risksnp_dosages) times the log of its odds ratio
+    (from RiskSnps.oddsRatios).
+    Snps that weren't called count for nothing, and the count of snps that
+    were called is kept with each score so it can be judged.
+
+    The panels are merged, on snp numbers (see snpids.SnpIds), into one
+    panel of the different (snp, risk allele) pairs, self.riskSnps, so
+    everyone's genotypes are read once whatever the number of panels.  Each panel has a weight for each snp in
+    the merged panel, 0 for the ones that aren't in it, worked out once.  A
+    person's score for a panel is then the dot product of their row of
+    dosages with the panel's weights.  As a dosage is 0, 1 or 2 that's done
+    as the sum of the weights where they have one copy plus twice the sum
+    where they have two, picked out with itertools.compress, so there's no
+    multiplying and the snps where they have none are skipped in C.
+    Snps without a usable odds ratio (blank, NA or not above 0) are left out.
+    '''
+
+    def __init__(self, panels):
+        '''panels is a list of (name, RiskSnps) pairs.'''
+        self.panelNames = [name for name, panel in panels]
+        self.weights = []
+        self.masks = []
+        self.panelSizes = []
+        columns = {}
+        snps = []
+        alleles = []
+        panelColumns = []
+        for name, panel in panels:
+            used = []
+            for index in range(panel.len()):
+                snpId = panel.snps[index]
+                #a snp listed twice in a panel counts once, as RiskSnps does
+                if (panel.snpIndex.get(snpId) != index or index >= len(panel.oddsRatios)):
+                    continue
+                weight = get_weight(panel.oddsRatios[index])
+                if (weight is None):
+                    continue
+                key = (panel.snpNumbers[index], panel.alleles[index])
+                column = columns.get(key)
+                if (column is None):
+                    column = len(snps)
+                    columns[key] = column
+                    snps.append(snpId)
+                    alleles.append(key[1])
+                used.append((column, weight))
+            panelColumns.append(used)
+        self.riskSnps = risksnps.RiskSnps(snps, alleles)
+        for used in panelColumns:
+            weights = array('d', [0.0]) * len(snps)
+            mask = array('b', [0]) * len(snps)
+            for column, weight in used:
+                weights[column] = weight
+                mask[column] = 1
+            self.weights.append(weights)
+            self.masks.append(mask)
+            self.panelSizes.append(len(used))
+
+    def get_field_names(self):
+        '''Returns the columns of the score table: the person, then each panel's scores and called counts.'''
+        return ([FIELD_PERSONID] + [name + SCORE_SUFFIX for name in self.panelNames] +
+                [name + CALLED_SUFFIX for name in self.panelNames])
+
+    def get_field_types(self):
+        '''Returns the tablesink types of get_field_names.'''
+        panelCount = len(self.panelNames)
+        return [tablesink.TYPE_STR] + [tablesink.TYPE_FLOAT] * panelCount + [tablesink.TYPE_INT] * panelCount
+
+    def score_dosages(self, dosages):
+        '''
+        Returns (scores, called counts) for one person's array of dosages, in
+        the order of self.riskSnps, with a score and a count for each panel.
+        '''
+        dosageBytes = dosages.tostring()
+        oneCopy = array('b')
+        oneCopy.fromstring(dosageBytes.translate(ONE_COPY_TABLE))
+        twoCopies = array('b')
+        twoCopies.fromstring(dosageBytes.translate(TWO_COPIES_TABLE))
+        missing = array('b')
+        missing.fromstring(dosageBytes.translate(MISSING_TABLE))
+        scores = [sum(itertools.compress(weights, oneCopy)) + 2 * sum(itertools.compress(weights, twoCopies))
+                  for weights in self.weights]
+        calledCounts = [self.panelSizes[panelIndex] - sum(itertools.compress(self.masks[panelIndex], missing))
+                        for panelIndex in range(len(self.masks))]
+        return (scores, calledCounts)
+
+    def get_score_row(self, personId, dosages):
+        '''Returns the score table row for one person (see get_field_names).'''
+        scores, calledCounts = self.score_dosages(dosages)
+        return [personId] + scores + calledCounts
+
+    def score_matrix(self, matrix):
+        '''
+        Returns the score table rows for each person in a DosageMatrix made
+        from self.riskSnps (see genotypematrix.build_dosage_matrix).
+        '''
+        return [self.get_score_row(matrix.personIds[personIndex], matrix.rows[personIndex])
+                for personIndex in range(matrix.person_count())]
+
+
+class RiskScoreTable():
+    '''
+    RiskScoreTable is the table of everyone's polygenic risk scores (see
+    RiskScorer), one row per person with a score and a called snp count for
+    each panel.  The panels are odds ratio files read by RiskSnps, named in
+    the table for their file names.
+
+    Each person's dosages are scored as their file is read, so the whole
+    cohort's genotypes are never held at once.
+    '''
+
+    def __init__(self, inputDirectoryName=DEFAULT_VCFS_DIR, outputFileName=DEFAULT_SCORES_FILE_NAME,
+                 panelFileNames=None, outputFormat=tablesink.FORMAT_CSV):
+        self.inputDir = inputDirectoryName
+        self.outputFormat = outputFormat
+        self.filename = tablesink.get_file_name(outputFileName, outputFormat)
+        self.panelFileNames = panelFileNames or [risksnps.DEFAULTFILENAME]
+        self.panels = None
+
+    def get_panels(self):
+        '''Reads the panel files, once, and returns the (name, RiskSnps) pairs.'''
+        if (self.panels is None):
+            self.panels = []
+            for panelFileName in self.panelFileNames:
+                panel = risksnps.read_from_file(panelFileName)
+                self.panels.append((get_panel_name(panelFileName), panel))
+        return self.panels
+
+    def add_all(self, workers=1, window=None):
+        '''
+        Scores everyone in inputDir, in order of person id, and writes the
+        table.  With more than one worker the files are read on a pool of
+        worker processes, at most window of them at a time (see
+        cohort.map_people).
+        '''
+        scorer = RiskScorer(self.get_panels())
+        srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        reader = genotypematrix.DosageReader(scorer.riskSnps)
+        rowCount = 0
+        with tablesink.open_sink(self.filename, scorer.get_field_names(), scorer.get_field_types(),
+                                 self.outputFormat) as sink:
+            for srcFileName, people in cohort.map_people(reader, 'read_people', srcFileNames, workers, window):
+                sink.write_rows([scorer.get_score_row(personId, dosages) for personId, dosages in people])
+                rowCount += len(people)
+        print "Wrote " + str(rowCount) + " rows to " + self.filename
+
+
+if __name__ == '__main__':
+    #usage: python riskscores.py [panel files] [--no-cache]
+    if ('--no-cache' in sys.argv):
+        genomecache.set_enabled(False)
+    panelFileNames = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    destObj = RiskScoreTable(panelFileNames=panelFileNames)
+    destObj.add_all()
@@ -1,10 +1,73 @@
+import os
 import csv
+import hashlib
+from array import array
+import snpids
+import tablesink
 
 DEFAULTDATADIR = '../data/'
 DEFAULTFILENAME = DEFAULTDATADIR + 'oddsratio.csv'
 FIELD_SNP_ID = 'dbSNP ID'
 FIELD_ODDS_RATIO = 'OddsRatio'
 FIELD_ALLELE = 'Risk Allele'
+FIELD_CHROM = 'Chr'
+FIELD_POSITION = 'Position'
+ALLELE_CODES = {'A': 1, 'C': 2, 'G': 3, 'T': 4}     #the codes in alleleCodes, 0 for anything else
+
+#the panels read by read_from_file, by file, so a file is only parsed once
+_panels = {}
+
+
+def get_file_key(sourceFileName):
+    '''Returns the path, size and modification time of a panel file, which change if it does.'''
+    stat = os.stat(sourceFileName)
+    return (os.path.abspath(sourceFileName), stat.st_size, stat.st_mtime)
+
+
+def read_from_file(sourceFileName = DEFAULTFILENAME):
+    '''
+    Returns the RiskSnps in the file, maintaining the sort order in the file.
+    If this version of the file has been read before, the panel read then
+    is returned.  Raises IOError if the file can't be read.
+    '''
+    try:
+        fileKey = get_file_key(sourceFileName)
+    except OSError as error:
+        raise IOError(error.errno, error.strerror, sourceFileName)
+    panel = _panels.get(fileKey)
+    if (panel is None):
+        panel = parse_file(sourceFileName)
+        _panels[fileKey] = panel
+    return panel
+
+
+def parse_file(sourceFileName):
+    '''
+    Reads the snps from the file, maintaining the sort order in the file.
+    '''
+    snps = []
+    alleles = []
+    oddsratio = []
+    chroms = []
+    positions = []
+    #count the number of records we read
+    countOfRecordsRead = 0
+    with open(sourceFileName, 'r') as srcfile:
+        reader = csv.DictReader(srcfile)
+        hasLocations = (FIELD_CHROM in reader.fieldnames and FIELD_POSITION in reader.fieldnames)
+
+        for row in reader:
+            snps.append(row[FIELD_SNP_ID])
+            alleles.append(row[FIELD_ALLELE])
+            oddsratio.append(row[FIELD_ODDS_RATIO])
+            if (hasLocations):
+                chroms.append(row[FIELD_CHROM])
+                positions.append(row[FIELD_POSITION])
+            countOfRecordsRead += 1
+
+    print "read " + str(countOfRecordsRead) + " records from " + sourceFileName
+    return RiskSnps(snps, alleles, oddsratio, chroms, positions)
+
 
 class RiskSnps():
     '''
@@ -17,44 +80,123 @@ class RiskSnps():
 
     The sort order of the file is maintained. In the sample file used here,
     oddsRatio.csv I have the snps sorted in order of oddsRatio, low to high.
+
+    So that a vcf file can be matched against a large panel one line at a time,
+    we also keep a dictionary from snpId to its index in the list and one from
+    snpId to its (risk allele, odds ratio) pair.
+
+    A RiskSnps is read only: its lists are tuples and setting an attribute
+    raises AttributeError.  The set_ methods return a new RiskSnps, with its
+    own index, rather than changing this one.
+
+    If the file has Chr and Position columns we keep those too, so that the
+    snps can be found in a sorted vcf file by seeking rather than reading.
+
+    Alongside the lists of strings, build_index keeps typed columns for
+    code that works on the whole panel: alleleCodes, an array of bytes
+    (see ALLELE_CODES), which the allele numbers are looked up by (see
+    vcffile.get_allele_numbers), oddsRatios, an array of doubles (NaN where
+    the odds ratio is blank), which risk scores are weighted by (see
+    riskscores.RiskScorer), and snpNumbers, the snps' numbers with
+    numberIndex to join on them.  An id that isn't an rs number is numbered
+    in memory (see snpids.get_local_numbers), so making a panel never writes
+    to the shared snp id file.  The snp ids are
+    interned, so the panel's dictionaries and every table made from it share
+    one copy of each.
+
+    A panel read from a file (see read_from_file) is parsed once per process
+    and kept by the file's path, size and modification time; reading it
+    again, from another table say, returns the same RiskSnps, which none of
+    its readers can change.
+    The worker processes of cohort.map_people are sent a table, and so its
+    panel, once when they start, not with each file.
     '''
 
 
-    def __init__(self):
-        self.snps = []
-        self.alleles = []        
-    
-    def read_from_file(self, sourceFileName = DEFAULTFILENAME):
+    def __init__(self, snps=(), alleles=(), oddsratio=(), chroms=(), positions=()):
+        fields = self.__dict__
+        fields['snps'] = tuple([intern(snpId) for snpId in snps])
+        fields['alleles'] = tuple(alleles)
+        fields['oddsratio'] = tuple(oddsratio)
+        fields['chroms'] = tuple(chroms)
+        fields['positions'] = tuple(positions)
+        self.build_index()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RiskSnps is read only, its set_ methods return a new one: ' + name)
+
+    def build_index(self):
         '''
-        Reads the snps from the file, maintaining the sort order in the file.
+        Builds the snpId to index, snp number to index and snpId to (allele,
+        odds ratio) dictionaries and the typed columns.  If a snp is listed more than once, the first
+        one is used.
         '''
-        self.snps = []
-        self.alleles = []
-        self.oddsratio = []
-        #count the number of records we read
-        countOfRecordsRead = 0
-        with open(sourceFileName, 'r') as srcfile:
-            reader = csv.DictReader(srcfile)
-            
-            for row in reader:
-                self.snps.append(row[FIELD_SNP_ID])
-                self.alleles.append(row[FIELD_ALLELE])
-                self.oddsratio.append(row[FIELD_ODDS_RATIO])
-                countOfRecordsRead += 1
-            
-        print "read " + str(countOfRecordsRead) + " records from " + sourceFileName
+        snpIndex = {}
+        riskAlleleMap = {}
+        numberIndex = {}
+        snpNumbers = snpids.get_local_numbers(self.snps)
+        for index in range(len(self.snps) - 1, -1, -1):
+            numberIndex[snpNumbers[index]] = index
+            snpId = self.snps[index]
+            snpIndex[snpId] = index
+            allele = None
+            oddsRatio = None
+            if (index < len(self.alleles)):
+                allele = self.alleles[index]
+            if (index < len(self.oddsratio)):
+                oddsRatio = self.oddsratio[index]
+            riskAlleleMap[snpId] = (allele, oddsRatio)
+        self.__dict__.update(snpIndex=snpIndex, riskAlleleMap=riskAlleleMap, numberIndex=numberIndex,
+                             snpNumbers=snpNumbers,
+                             alleleCodes=array('B', [ALLELE_CODES.get(allele, 0) for allele in self.alleles]),
+                             oddsRatios=array('d', map(tablesink.to_float, self.oddsratio)))
+
+    def get_index(self, snpId):
+        '''Return the index of this snp id, or -1 if it isn't in the collection.'''
+        return self.snpIndex.get(snpId, -1)
+
+    def get_number_index(self, snpNumber):
+        '''Return the index of the snp with this number (see snpids.get_local_number), or -1 if it isn't in the collection.'''
+        return self.numberIndex.get(snpNumber, -1)
 
     def len(self):
         '''The count of snps in the collection.'''
         return len(self.snps)
     
-    def set_snps(self,snps):
-        '''Puts this list of snps into the collection.'''
-        self.snps = snps
+    def set_snps(self, snps):
+        '''Returns a RiskSnps with this list of snps in place of these.'''
+        return RiskSnps(snps, self.alleles, self.oddsratio, self.chroms, self.positions)
 
     def set_alleles(self, alleles):
-        '''Puts this list of alleles into the collection.'''
-        self.alleles = alleles
+        '''Returns a RiskSnps with this list of alleles in place of these.'''
+        return RiskSnps(self.snps, alleles, self.oddsratio, self.chroms, self.positions)
+
+    def set_odds_ratios(self, oddsratio):
+        '''Returns a RiskSnps with this list of odds ratios in place of these.'''
+        return RiskSnps(self.snps, self.alleles, oddsratio, self.chroms, self.positions)
+
+    def set_locations(self, chroms, positions):
+        '''Returns a RiskSnps with these lists of chromosomes and positions in place of these.'''
+        return RiskSnps(self.snps, self.alleles, self.oddsratio, chroms, positions)
+
+    def has_locations(self):
+        '''True if every snp in the collection has a chromosome and position.'''
+        if (len(self.snps) == 0 or len(self.chroms) != len(self.snps) or
+                len(self.positions) != len(self.snps)):
+            return False
+        for index in range(len(self.snps)):
+            if (not self.chroms[index] or not self.positions[index]):
+                return False
+        return True
+
+    def get_key(self):
+        '''
+        Returns a hash of the snps, alleles and odds ratios, which changes if
+        any of them do.  Tables made from the panel use it to tell whether the
+        panel is the one they were made with (see manifest.Manifest).
+        '''
+        panel = [list(self.snps), list(self.alleles), list(self.oddsratio)]
+        return hashlib.sha1(repr(panel)).hexdigest()
 
     def get_snp(self,index):
         '''Return the snp id at this index.'''
@@ -66,7 +208,6 @@ class RiskSnps():
 
 if __name__ == '__main__':
 
-    destObj = RiskSnps()
-    destObj.read_from_file()
+    destObj = read_from_file()
     
     
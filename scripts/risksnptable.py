@@ -1,8 +1,12 @@
 import os
+import sys
+import genomecache
 import vcffile
 import risksnps
-from csv import DictWriter
-from csv import DictReader
+import cohort
+import genotypematrix
+import tablesink
+import manifest
 
 DEFAULT_DATA_DIR = '../data/'
 DEFAULT_SNPTABLE_FILE_NAME = DEFAULT_DATA_DIR + 'risksnptable.csv'
@@ -24,34 +28,71 @@ class RiskSnpTable():
     with a significant association with the disease.
 
     The data for each person is stored in a vcf file, so we loop through the
-    directory adding a row at a time.
+    directory reading each person's risk snps into a GenotypeMatrix, then
+    write the matrix out as the table.  The matrix is kept in self.matrix so
+    that RiskSnpCompare can use it without reading the table back.
     
     '''
 
-    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_SNPTABLE_FILE_NAME):
-        self.filename = outputFileName
+    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_SNPTABLE_FILE_NAME,
+                 outputFormat=tablesink.FORMAT_CSV):
+        self.outputFormat = outputFormat
+        self.filename = tablesink.get_file_name(outputFileName, outputFormat)
         self.riskSnps = risksnps.RiskSnps()
         self.inputDir = inputDirectoryName
+        self.matrix = None
 
-    def add_all(self):
+    def add_all(self, workers=1, window=None, incremental=False):
         '''
         Loops through all the files in inputDir directory, adding one row per file/person,
         one column per risk snp.
+
+        The rows are added in order of person id.  With more than one worker,
+        the files are read on a pool of worker processes, at most window of
+        them at a time (see cohort.map_people).
+
+        With incremental, only the people whose files are new since the table
+        was made (see manifest.Manifest) are read, and their rows are added to
+        the end of the table.  Then self.matrix holds just the new people.
         '''
 
+        #read the risk snps for everyone in the directory
+        self.get_file_header()
+        srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        append = False
+        if (incremental):
+            tableManifest = manifest.Manifest(manifest.get_manifest_name(self.filename), self.riskSnps.get_key())
+            tableManifest.load()
+            newFileNames = tableManifest.get_new_files(srcFileNames, self.filename)
+            if (newFileNames is not None and tablesink.can_append(self.outputFormat)):
+                srcFileNames = newFileNames
+                append = True
+            else:
+                tableManifest.clear()
+        self.matrix = genotypematrix.build_risk_snp_matrix(srcFileNames, self.riskSnps, workers, window)
+        self.write_matrix(self.matrix, append)
+        if (incremental):
+            tableManifest.add_files(srcFileNames)
+            tableManifest.save(self.filename)
+
+    def write_matrix(self, matrix, append=False):
+        '''
+        Writes a GenotypeMatrix of risk snp allele numbers to the output file,
+        one row per person, in outputFormat (see tablesink.open_sink).  With
+        append the rows are added to the end of the table already there.
+        '''
         #open the destination file and write the header line
         headerFields = self.get_file_header()
-        with open(self.filename, 'w') as destFile:
+        headerTypes = [tablesink.TYPE_STR] + [tablesink.TYPE_INT] * self.riskSnps.len()
+        with tablesink.open_sink(self.filename, headerFields, headerTypes, self.outputFormat, append) as sink:
             print "created " + self.filename + "\n"
-            writer = DictWriter(destFile, headerFields, lineterminator='\n')
-            writer.writeheader()
 
-            #loop through the files in the directory and add a column for each
-            srcFileNames = os.listdir(self.inputDir)
             fileCount = 0
-            for srcFileName in srcFileNames:
-                rowOut = self.get_one_person_from_file(self.inputDir + srcFileName)
-                writer.writerow(rowOut)
+            for personIndex in range(matrix.person_count()):
+                rowOut = [matrix.personIds[personIndex]]
+                for riskSnp in self.riskSnps.snps:
+                    rowOut.append(matrix.get_allele(personIndex, riskSnp))
+                sink.write_rows([rowOut])
                 fileCount += 1
             if (fileCount == 1):
                 print ("You ran this on one snp file. For the entire dataset go to " +
@@ -77,7 +118,7 @@ class RiskSnpTable():
         return rowOut
 
     def get_risk_snps(self):
-        self.riskSnps.read_from_file()
+        self.riskSnps = risksnps.read_from_file()
         
     def get_file_header(self):
         '''
@@ -123,14 +164,21 @@ class RiskSnpCompare():
     
     We create two formats, one that is a wide table where each row is snp and each
     column is a snp, and another where each row has three values snpId, snpId, samecount.
+
+    The people's risk alleles come from a GenotypeMatrix, such as the one
+    RiskSnpTable.add_all leaves in its matrix.  If we aren't given one, we read
+    the table RiskSnpTable wrote.
     '''
 
     def __init__(self, inputFileName = DEFAULT_SNPTABLE_FILE_NAME, 
-                 outputDiffsName=DEFAULT_OUTPUT_DIFFS_NAME, outputTallName=DEFAULT_OUTPUT_DIFFS_TALL_NAME):
-        self.diffsFileName = outputDiffsName
-        self.diffsTallName = outputTallName
+                 outputDiffsName=DEFAULT_OUTPUT_DIFFS_NAME, outputTallName=DEFAULT_OUTPUT_DIFFS_TALL_NAME,
+                 matrix=None, outputFormat=tablesink.FORMAT_CSV):
+        self.outputFormat = outputFormat
+        self.diffsFileName = tablesink.get_file_name(outputDiffsName, outputFormat)
+        self.diffsTallName = tablesink.get_file_name(outputTallName, outputFormat)
         self.riskSnps = risksnps.RiskSnps()
         self.inputFileName = inputFileName
+        self.matrix = matrix
 
     def write_tall_and_wide_compares(self):
         '''
@@ -139,55 +187,51 @@ class RiskSnpCompare():
         we use to compare is the count of alleles that are the 
         '''
         
-        sameCounts = self.getSameCounts()
-        self.writeDiffsTallTable(sameCounts)
-        self.writeDiffsWideTable(sameCounts)
+        snpIds, sameCounts = self.getSameCountMatrix()
+        self.writeDiffsTallTable(snpIds, sameCounts)
+        self.writeDiffsWideTable(snpIds, sameCounts)
         
-    def writeDiffsTallTable(self, sameCounts):                
+    def writeDiffsTallTable(self, snpIds, sameCounts):                
+        '''
+        Writes the same counts from getSameCountMatrix as a tall table, one row
+        per pair of snps that have a count.
+        '''
         #open the destination tall file and write the header line
         headerFields = [FIELD_SNPIDA, FIELD_SNPIDB, FIELD_SAMEALLELECOUNT]
-        with open(self.diffsTallName, 'w') as destTallFile:
-            writer = DictWriter(destTallFile, headerFields, lineterminator='\n')
+        headerTypes = [tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_INT]
+        with tablesink.open_sink(self.diffsTallName, headerFields, headerTypes, self.outputFormat) as sink:
             print 'created ' + self.diffsTallName + '    '
-            writer.writeheader()
             #loop through the counts and write them out
             recordsWritten = 0
-            row = {}
-            for key in sameCounts:
-                counts = sameCounts[key]
-                for k in counts:
-                    count = sameCounts[key][k]
+            for indexA in range(len(snpIds)):
+                key = snpIds[indexA]
+                counts = sameCounts[indexA]
+                rows = []
+                for indexB in range(len(snpIds)):
+                    k = snpIds[indexB]
+                    count = counts[indexB]
                     if (key.startswith('rs') and k.startswith('rs') and count > 0):
-                        row[FIELD_SNPIDA] = key
-                        row[FIELD_SNPIDB] = k
-                        row[FIELD_SAMEALLELECOUNT] = count
-                        writer.writerow(row)
-                        recordsWritten += 1
+                        rows.append([key, k, count])
+                sink.write_rows(rows)
+                recordsWritten += len(rows)
             print 'wrote ' + str(recordsWritten) + ' records \n'
 
-    def writeDiffsWideTable(self, sameCounts):
-        #collect all the column snps
-        headerFields = [FIELD_SNPID]
-        for snpIdA in sameCounts:
-            for snpIdB in sameCounts[snpIdA]:
-                if snpIdB not in headerFields:
-                    headerFields.append(snpIdB)
+    def writeDiffsWideTable(self, snpIds, sameCounts):
+        '''
+        Writes the same counts from getSameCountMatrix as a wide table, one row
+        and one column per snp.
+        '''
+        headerFields = [FIELD_SNPID] + snpIds
+        headerTypes = [tablesink.TYPE_STR] + [tablesink.TYPE_INT] * len(snpIds)
 
-        with open(self.diffsFileName, 'w') as destFile:
+        with tablesink.open_sink(self.diffsFileName, headerFields, headerTypes, self.outputFormat) as sink:
             print 'create ' + self.diffsFileName + '    '
-            writer = DictWriter(destFile, headerFields, lineterminator='\n')
-            writer.writeheader()
             #loop through counts and write them out
             recordsWritten = 0
-            for snpIdA in sameCounts:
-                rowOut = {FIELD_SNPID:snpIdA}
-                snpIdBs = sameCounts[snpIdA]
-                for snpIdB in snpIdBs:
-                    count = snpIdBs[snpIdB]
-                    assert snpIdA.startswith('rs')
-                    assert snpIdB.startswith('rs')
-                    rowOut[snpIdB] = count
-                writer.writerow(rowOut)
+            for indexA in range(len(snpIds)):
+                snpIdA = snpIds[indexA]
+                assert snpIdA.startswith('rs')
+                sink.write_rows([[snpIdA] + list(sameCounts[indexA])])
                 recordsWritten += 1
         print 'wrote ' + str(recordsWritten) + ' records \n'
             
@@ -196,41 +240,33 @@ class RiskSnpCompare():
         '''
         Gets a two dimensional array of counts. The counts are the number of rows in 
         which both snps have the risk allele. 
+
+        This is getSameCountMatrix as a dictionary of dictionaries keyed by snpId.
         '''
-        with open(self.inputFileName, 'r') as srcFile:
-            reader = DictReader(srcFile)
-            colHeaders = reader.fieldnames
-            #remove the first col header, the person Id column header to get the snpIds
-            snpIds = colHeaders[1:]
-            
-            #initialize our dictionary of same counts
-            sameCounts = {}
-            for snpIdA in snpIds:
-                bDict = {} 
-                for snpIdB in snpIds:
-                    bDict[snpIdB] = 0
-                sameCounts[snpIdA] = bDict
-
-            #loop through the rows incrementing our counts 
-            for row in reader:
-                #read and remove the personId so that we can loop over all the snps
-                personId = row[FIELD_PERSONID]
-                del(row[FIELD_PERSONID])
-                #don't count the normalization lines
-                if (len(personId) > 2):
-                    for snpIdA in row:
-                        alleleA = row[snpIdA]
-                        for snpIdB in row:
-                            alleleB = row[snpIdB]
-                            if (alleleA == '4' and alleleB == '4'):
-                                sameCounts[snpIdA][snpIdB] += 1
-
-            return sameCounts
+        snpIds, counts = self.getSameCountMatrix()
+        sameCounts = {}
+        for indexA in range(len(snpIds)):
+            sameCounts[snpIds[indexA]] = dict(zip(snpIds, counts[indexA]))
+        return sameCounts
+
+    def getSameCountMatrix(self):
+        '''
+        Returns the risk snp ids and a list of rows of counts, one row and one
+        column per snp.  The counts are the number of people who have the risk
+        allele for both snps (see GenotypeMatrix.get_cooccurrence_counts).
+        '''
+        matrix = self.matrix
+        if (matrix is None):
+            matrix = genotypematrix.read_risk_snp_table(self.inputFileName, FIELD_PERSONID)
+        riskCode = matrix.alleleIndex['4']
+        return (matrix.snpIds, matrix.get_cooccurrence_counts(riskCode))
 
                 
 if __name__ == '__main__':
+    if ('--no-cache' in sys.argv):
+        genomecache.set_enabled(False)
     #destObj = RiskSnpTable()
-    #destObj.add_all()
+    #destObj.add_all(incremental=('--incremental' in sys.argv))
     #destObj.add_normalization_data()
     destObj = RiskSnpCompare()
     destObj.write_tall_and_wide_compares()
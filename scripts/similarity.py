@@ -0,0 +1,246 @@
+import os
+import sys
+import multiprocessing
+from multiprocessing import sharedctypes
+from binascii import hexlify
+from array import array
+import genomecache
+import cohort
+import genotypematrix
+import tablesink
+import correlationmatrix
+import mergejoin
+
+DEFAULT_DATA_DIR = '../data/'
+DEFAULT_OUTPUT_FILE_NAME = DEFAULT_DATA_DIR + 'similarity.csv'
+DEFAULT_VCFS_DIR = DEFAULT_DATA_DIR + 'vcfdata/'
+FIELD_PERSONID = 'personId'
+METRIC_HAMMING = 'hamming'      #the count of snps where two people differ, as DifferenceCounts counts
+METRIC_JACCARD = 'jaccard'      #shared (snp, allele) pairs over all the pairs either has
+METRIC_IBS = 'ibs'              #identity by state: the share of the snps called for both that match
+METRICS = [METRIC_HAMMING, METRIC_JACCARD, METRIC_IBS]
+BLOCK_PEOPLE = 32               #people on each side of a block of the person by person matrix
+
+#the rows being compared, set in each worker process when it starts: the
+#bytes of every row one after another, the length of a row in bytes, the
+#size of a code and the unit mask (see genotypematrix.get_unit_mask)
+_rows = None
+
+
+def _init_worker(rowData, rowBytes, itemSize, unitMask):
+    global _rows
+    _rows = (rowData, rowBytes, itemSize, unitMask)
+
+
+def get_packed_rows(start, end):
+    '''Returns the rows from start to end packed into integers, as GenotypeMatrix.get_packed_row does.'''
+    rowData, rowBytes, itemSize, unitMask = _rows
+    packedRows = []
+    for index in range(start, end):
+        data = rowData[index * rowBytes:(index + 1) * rowBytes]
+        packedRows.append(int(hexlify(data), 16) if data else 0)
+    return packedRows
+
+
+def count_block(block):
+    '''
+    Counts the pairs of people in one block, (rowStart, rowEnd, colStart,
+    colEnd), of the person by person matrix, in a worker process.  Only the
+    pairs above the diagonal are counted.  Returns the block with the
+    counts of the snps where each pair has the same allele and where both
+    have an allele (see PairCounts), each a list with an array for each row
+    of the block.
+    '''
+    rowStart, rowEnd, colStart, colEnd = block
+    rowData, rowBytes, itemSize, unitMask = _rows
+    rows = get_packed_rows(rowStart, rowEnd)
+    if (colStart == rowStart):
+        cols = rows
+    else:
+        cols = get_packed_rows(colStart, colEnd)
+    calledRows = [genotypematrix.get_nonzero_units(row, itemSize, unitMask) for row in rows]
+    calledCols = [genotypematrix.get_nonzero_units(col, itemSize, unitMask) for col in cols]
+    sameCounts = []
+    bothCounts = []
+    for rowIndex in range(rowEnd - rowStart):
+        row = rows[rowIndex]
+        calledRow = calledRows[rowIndex]
+        same = array('l', [0]) * (colEnd - colStart)
+        both = array('l', [0]) * (colEnd - colStart)
+        for colIndex in range(max(0, rowStart + rowIndex + 1 - colStart), colEnd - colStart):
+            differentUnits = genotypematrix.get_nonzero_units(row ^ cols[colIndex], itemSize, unitMask)
+            bothUnits = calledRow & calledCols[colIndex]
+            both[colIndex] = genotypematrix.count_units(bothUnits)
+            same[colIndex] = both[colIndex] - genotypematrix.count_units(differentUnits & bothUnits)
+        sameCounts.append(same)
+        bothCounts.append(both)
+    return (block, sameCounts, bothCounts)
+
+
+def get_blocks(personCount, blockSize):
+    '''Returns the blocks on and above the diagonal of the person by person matrix.'''
+    starts = range(0, personCount, blockSize)
+    return [(rowStart, min(personCount, rowStart + blockSize), colStart, min(personCount, colStart + blockSize))
+            for rowStart in starts for colStart in starts if colStart >= rowStart]
+
+
+class PairCounts():
+    '''
+    PairCounts holds, for each pair of people in a GenotypeMatrix of alleles,
+    the count of snps where they have the same allele (same) and where both
+    have an allele (both), and each person's count of snps with an allele
+    (called).  A pair's counts are the same JoinCounts
+    that mergejoin.join gives for the two people's snps, and each metric is
+    one of its methods, so a metric is written once for both ways of
+    counting.
+    '''
+
+    def __init__(self, personIds, called):
+        self.personIds = personIds
+        self.called = called
+        personCount = len(personIds)
+        self.same = [array('l', [0]) * personCount for personIndex in range(personCount)]
+        self.both = [array('l', [0]) * personCount for personIndex in range(personCount)]
+        for personIndex in range(personCount):
+            self.same[personIndex][personIndex] = called[personIndex]
+            self.both[personIndex][personIndex] = called[personIndex]
+
+    def add_block(self, block, sameCounts, bothCounts):
+        '''Copies the counts of a block (see count_block) in, and to the pairs below the diagonal.'''
+        rowStart, rowEnd, colStart, colEnd = block
+        for rowIndex in range(rowEnd - rowStart):
+            personIndex = rowStart + rowIndex
+            for colIndex in range(max(0, personIndex + 1 - colStart), colEnd - colStart):
+                compareIndex = colStart + colIndex
+                for counts, blockCounts in [(self.same, sameCounts), (self.both, bothCounts)]:
+                    counts[personIndex][compareIndex] = blockCounts[rowIndex][colIndex]
+                    counts[compareIndex][personIndex] = blockCounts[rowIndex][colIndex]
+
+    def get_join_counts(self, personIndex, compareIndex):
+        '''Returns the counts for a pair of people as the mergejoin.JoinCounts a join of their snps gives.'''
+        same = self.same[personIndex][compareIndex]
+        both = self.both[personIndex][compareIndex]
+        return mergejoin.JoinCounts(same, both - same, self.called[personIndex] - both,
+                                    self.called[compareIndex] - both)
+
+    def get_value(self, metric, personIndex, compareIndex):
+        '''Returns the metric for a pair of people, None if it has no value (no snps to compare).'''
+        counts = self.get_join_counts(personIndex, compareIndex)
+        if (metric == METRIC_HAMMING):
+            return counts.get_difference_count()
+        if (metric == METRIC_JACCARD):
+            return counts.get_jaccard()
+        if (metric == METRIC_IBS):
+            return counts.get_identity_by_state()
+        raise ValueError('unknown metric ' + str(metric))
+
+    def get_row(self, metric, personIndex):
+        '''Returns the metric for one person and each person.'''
+        return [self.get_value(metric, personIndex, compareIndex) for compareIndex in range(len(self.personIds))]
+
+
+def get_pair_counts(matrix, workers=1, blockSize=BLOCK_PEOPLE):
+    '''
+    Returns the PairCounts of a GenotypeMatrix of alleles.
+
+    The person by person matrix is cut into blocks of blockSize people on a
+    side and only the blocks on and above the diagonal are counted.  With
+    more than one worker the blocks are counted on a pool of worker
+    processes.  The rows are put once in shared memory, which the workers
+    map when they start, so only the block bounds go with each task.  Each
+    pair is a few operations on whole packed rows (see
+    genotypematrix.get_nonzero_units), not a loop over the snps.
+
+    The pairs aren't joined with mergejoin.join, which is for people's own
+    sorted lists of snps.  Here everyone's rows are already lined up on the
+    matrix's columns, and a packed row pair is about five times quicker
+    than a join of the same snps (see benchmarks.py similarity and join).
+    The counts come out the same (see PairCounts.get_join_counts).
+    '''
+    personCount = matrix.person_count()
+    itemSize = array(matrix.typecode).itemsize
+    unitMask = genotypematrix.get_unit_mask(itemSize, matrix.snp_count())
+    called = [matrix.snp_count() - matrix.get_row(personIndex).count(genotypematrix.MISSING)
+              for personIndex in range(personCount)]
+    counts = PairCounts(matrix.personIds, called)
+    rowData = ''.join([matrix.get_row(personIndex).tostring() for personIndex in range(personCount)])
+    rowBytes = itemSize * matrix.snp_count()
+    blocks = get_blocks(personCount, blockSize)
+    if (workers <= 1 or len(blocks) <= 1):
+        _init_worker(rowData, rowBytes, itemSize, unitMask)
+        for block in blocks:
+            counts.add_block(*count_block(block))
+        return counts
+    sharedData = sharedctypes.RawArray('c', len(rowData))
+    sharedData.raw = rowData
+    del rowData
+    pool = multiprocessing.Pool(min(workers, len(blocks)), _init_worker, (sharedData, rowBytes, itemSize, unitMask))
+    try:
+        for result in pool.imap_unordered(count_block, blocks):
+            counts.add_block(*result)
+    finally:
+        pool.terminate()
+        pool.join()
+    return counts
+
+
+class SimilarityTable():
+    '''
+    SimilarityTable is a table comparing people by one of METRICS: one row
+    and one column per person, the same shape as the table DifferenceCounts
+    writes, with the metric for the pair in each cell.  METRIC_HAMMING gives
+    the same counts as DifferenceCounts; METRIC_JACCARD and METRIC_IBS are
+    measures of similarity, 1 for people with the same alleles.
+
+    The alleles are the ALT alleles of the vcf files, one per snp, so IBS
+    here is the share of the snps both people have where they have the same
+    one, rather than the 0, 1 or 2 alleles shared of diploid genotypes.
+    '''
+
+    def __init__(self, inputDirectory=DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME,
+                 metric=METRIC_JACCARD, outputFormat=tablesink.FORMAT_CSV):
+        if (metric not in METRICS):
+            raise ValueError('unknown metric ' + str(metric))
+        self.inputDirectory = inputDirectory
+        self.metric = metric
+        self.outputFormat = outputFormat
+        self.filename = tablesink.get_file_name(outputFileName, outputFormat)
+
+    def create_file(self, workers=1, window=None, tallFileName=None):
+        '''
+        Reads everyone's alleles into a GenotypeMatrix, in order of person id,
+        and writes the table of the metric for each pair, counting the pairs
+        with workers worker processes (see get_pair_counts).  With
+        tallFileName, a csv table is also flattened into a tall table of
+        (personId, personId, value) rows (see CorrelationMatrix.flatten),
+        which can only be done from a csv table.
+        '''
+        if (tallFileName is not None and self.outputFormat != tablesink.FORMAT_CSV):
+            raise ValueError('a tall table is flattened from a csv table, not ' + str(self.outputFormat))
+        srcFileNames = cohort.get_sorted_file_names(self.inputDirectory)
+        matrix = genotypematrix.build_allele_matrix(srcFileNames, workers, window)
+        counts = get_pair_counts(matrix, workers)
+        self.write_values(counts)
+        if (tallFileName is not None):
+            correlationmatrix.CorrelationMatrix(self.filename, tallFileName).flatten()
+
+    def write_values(self, counts):
+        '''Writes the metric for each pair of people in PairCounts, working out each row as it's written.'''
+        fieldNames = [FIELD_PERSONID] + counts.personIds
+        valueType = tablesink.TYPE_INT if self.metric == METRIC_HAMMING else tablesink.TYPE_FLOAT
+        fieldTypes = [tablesink.TYPE_STR] + [valueType] * len(counts.personIds)
+        if (os.path.exists(self.filename)):
+            os.remove(self.filename)
+        with tablesink.open_sink(self.filename, fieldNames, fieldTypes, self.outputFormat) as sink:
+            for personIndex in range(len(counts.personIds)):
+                sink.write_rows([[counts.personIds[personIndex]] + counts.get_row(self.metric, personIndex)])
+        print "Wrote " + str(len(counts.personIds)) + " rows to " + self.filename
+
+
+if __name__ == '__main__':
+    #usage: python similarity.py [hamming|jaccard|ibs] [--no-cache]
+    if ('--no-cache' in sys.argv):
+        genomecache.set_enabled(False)
+    metrics = [arg for arg in sys.argv[1:] if arg in METRICS]
+    destObj = SimilarityTable(metric=(metrics or [METRIC_JACCARD])[0])
+    destObj.create_file()
@@ -0,0 +1,188 @@
+import os
+import fcntl
+from array import array
+
+DEFAULT_DATA_DIR = '../data/'
+DEFAULT_FILE_NAME = DEFAULT_DATA_DIR + 'cache/snpids.txt'
+MAX_SNP_NUMBER = 2 ** 31 - 1
+LOCAL_NUMBER_BASE = -2 ** 31    #the first of the numbers given out in memory, see get_local_numbers
+LOCAL_NUMBER_LIMIT = -2 ** 30   #the file's numbers are all above this
+
+#settings for get_snp_ids, tests point fileName somewhere else
+fileName = DEFAULT_FILE_NAME
+
+#the SnpIds of this process, see get_snp_ids
+_snpIds = None
+
+#the other ids numbered in this process only, see get_local_numbers
+_localIds = []
+_localIndex = {}
+
+
+def parse_snp_number(snpId):
+    '''
+    Returns the number of an rs id, rs followed by the digits of a number
+    that fits in an int32 (without leading zeros, so it's the only id with
+    that number), or None for any other id.
+    '''
+    digits = snpId[2:]
+    if (snpId.startswith('rs') and digits.isdigit() and digits[0] != '0' and
+            (len(digits) < 10 or int(digits) <= MAX_SNP_NUMBER)):
+        return int(digits)
+    return None
+
+
+def get_local_number(snpId):
+    '''
+    Returns the number of a snp id, numbering an id that isn't an rs number
+    in this process only, without reading or writing the file, from
+    LOCAL_NUMBER_BASE up.  These numbers only match each other, so they're
+    for things like panels that are joined in memory, not with the numbers
+    of genomes.
+    '''
+    number = parse_snp_number(snpId)
+    if (number is not None):
+        return number
+    index = _localIndex.get(snpId)
+    if (index is None):
+        index = len(_localIds)
+        _localIds.append(snpId)
+        _localIndex[snpId] = index
+    return LOCAL_NUMBER_BASE + index
+
+
+def get_local_numbers(snpIds):
+    '''Returns an array of the numbers of a list of snp ids, as get_local_number gives them.'''
+    return array('i', map(get_local_number, snpIds))
+
+
+def get_snp_ids():
+    '''Returns the SnpIds shared by everything in this process, loaded from fileName the first time.'''
+    global _snpIds
+    if (_snpIds is None or _snpIds.fileName != fileName):
+        _snpIds = SnpIds(fileName)
+        _snpIds.load()
+    return _snpIds
+
+
+class SnpIds():
+    '''
+    SnpIds numbers snp ids as int32s, so tables can be joined, sorted and
+    merged on integers and the id strings are only made again for output.
+
+    An rs id is its own number, rs12028261 is 12028261, so most ids are
+    numbered without looking anything up.  Any other id (rs12;rs13, or a
+    chr1:1234 style id) is -1 - its line in a text file, one id per line,
+    that is only ever added to.  A new id is numbered with the file locked:
+    the lines other processes have added since it was last read are read
+    first, and then the id is added to the end and numbered by its line.  So
+    every process, and every run, gives an id the same number.  get_id and
+    get_ids also name the numbers given out in memory by get_local_numbers.
+    '''
+
+    def __init__(self, fileName=DEFAULT_FILE_NAME):
+        self.fileName = fileName
+        self.otherIds = []
+        self.otherIndex = {}
+        self.readBytes = 0
+
+    def load(self):
+        '''Reads the other ids in the file, if there is one.'''
+        self.otherIds = []
+        self.otherIndex = {}
+        self.readBytes = 0
+        if (os.path.exists(self.fileName)):
+            with open(self.fileName, 'r') as srcFile:
+                self.read_new_ids(srcFile)
+
+    def read_new_ids(self, srcFile):
+        '''Reads the ids added to the open file since it was last read.'''
+        srcFile.seek(self.readBytes)
+        data = srcFile.read()
+        #only whole lines, a line is always written whole under the lock
+        data = data[:data.rfind('\n') + 1]
+        for snpId in data.splitlines():
+            if (snpId not in self.otherIndex):
+                self.otherIndex[snpId] = len(self.otherIds)
+            self.otherIds.append(snpId)
+        self.readBytes += len(data)
+
+    def add_other_ids(self, snpIds):
+        '''
+        Numbers the ids, which aren't rs numbers, that aren't numbered yet,
+        all under one lock of the file.
+        '''
+        directory = os.path.dirname(self.fileName)
+        if (directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+        with open(self.fileName, 'a+') as destFile:
+            fcntl.lockf(destFile, fcntl.LOCK_EX)
+            try:
+                self.read_new_ids(destFile)
+                newIds = []
+                for snpId in snpIds:
+                    if (snpId not in self.otherIndex):
+                        self.otherIndex[snpId] = len(self.otherIds)
+                        self.otherIds.append(snpId)
+                        newIds.append(snpId)
+                data = ''.join([snpId + '\n' for snpId in newIds])
+                destFile.seek(0, os.SEEK_END)
+                destFile.write(data)
+                destFile.flush()
+                self.readBytes += len(data)
+            finally:
+                fcntl.lockf(destFile, fcntl.LOCK_UN)
+
+    def add_other_id(self, snpId):
+        '''Returns the number of an id that isn't an rs number, giving it one if it's new.'''
+        if (snpId not in self.otherIndex):
+            self.add_other_ids([snpId])
+        return -1 - self.otherIndex[snpId]
+
+    def get_number(self, snpId):
+        '''Returns the number of a snp id.'''
+        number = parse_snp_number(snpId)
+        if (number is None):
+            return self.add_other_id(snpId)
+        return number
+
+    def get_numbers(self, snpIds):
+        '''
+        Returns an array of the numbers of a list of snp ids.  A list of only
+        rs numbers, the usual case, is checked and converted all at once;
+        otherwise the new other ids are numbered under one lock.
+        '''
+        prefixes = ''.join([snpId[:2] for snpId in snpIds])
+        digits = [snpId[2:] for snpId in snpIds]
+        if (prefixes == 'rs' * len(snpIds) and ''.join(digits).isdigit() and '' not in digits and
+                max(map(len, digits) or [0]) < 10 and '0' not in [text[0] for text in digits]):
+            return array('i', map(int, digits))
+        newIds = [snpId for snpId in snpIds if snpId not in self.otherIndex and parse_snp_number(snpId) is None]
+        if (newIds):
+            self.add_other_ids(newIds)
+        return array('i', map(self.get_number, snpIds))
+
+    def refresh(self):
+        '''Reads the ids other processes have added to the file since it was last read.'''
+        if (os.path.exists(self.fileName)):
+            with open(self.fileName, 'r') as srcFile:
+                self.read_new_ids(srcFile)
+
+    def get_id(self, number):
+        '''Returns the snp id string of a number, which may have been given out by another process.'''
+        if (number >= 0):
+            return 'rs' + str(number)
+        if (number < LOCAL_NUMBER_LIMIT):
+            return _localIds[number - LOCAL_NUMBER_BASE]
+        if (-1 - number >= len(self.otherIds)):
+            self.refresh()
+        return self.otherIds[-1 - number]
+
+    def get_ids(self, numbers):
+        '''Returns the list of snp id strings of a list or array of numbers.'''
+        if (len(numbers) and LOCAL_NUMBER_LIMIT <= min(numbers) < -len(self.otherIds)):
+            self.refresh()
+        otherIds = self.otherIds
+        return ['rs' + str(number) if number >= 0 else
+                otherIds[-1 - number] if number >= LOCAL_NUMBER_LIMIT else _localIds[number - LOCAL_NUMBER_BASE]
+                for number in numbers]
@@ -0,0 +1,388 @@
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import zipfile
+import struct
+import ast
+import itertools
+from array import array
+import csvrows
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+FORMAT_CSV = 'csv'
+FORMAT_CSV_GZIP = 'csv.gz'
+FORMAT_NPZ = 'npz'
+FORMAT_ARROW = 'arrow'
+FORMAT_COLUMNS = 'columns'      #arrow if pyarrow is installed, npz if not
+FORMAT_SUFFIXES = {FORMAT_CSV: '.csv', FORMAT_CSV_GZIP: '.csv.gz', FORMAT_NPZ: '.npz', FORMAT_ARROW: '.arrow'}
+TYPE_STR = 'str'
+TYPE_INT = 'int'
+TYPE_FLOAT = 'float'
+DICTIONARY_SUFFIX = '.dictionary'
+NPY_MAGIC = '\x93NUMPY\x01\x00'
+READ_BLOCK_ROWS = 65536         #rows of a column read back from its spill file at a time
+
+
+def to_float(value):
+    '''Returns a value as a float, NaN if it's None, blank or not a number (NA, say).'''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def get_format(outputFormat):
+    '''Returns the format a sink is written in, choosing arrow or npz for FORMAT_COLUMNS.'''
+    if (outputFormat == FORMAT_COLUMNS):
+        if (pyarrow is None):
+            return FORMAT_NPZ
+        return FORMAT_ARROW
+    if (outputFormat not in FORMAT_SUFFIXES):
+        raise ValueError('unknown output format ' + str(outputFormat))
+    return outputFormat
+
+
+def get_file_name(fileName, outputFormat):
+    '''
+    Returns fileName with the suffix of the output format in place of .csv,
+    so talltable.csv is written as talltable.npz.  A csv file keeps its name.
+    '''
+    if (get_format(outputFormat) == FORMAT_CSV):
+        return fileName
+    if (fileName.endswith('.csv')):
+        fileName = fileName[:-len('.csv')]
+    suffix = FORMAT_SUFFIXES[get_format(outputFormat)]
+    if (fileName.endswith(suffix)):
+        return fileName
+    return fileName + suffix
+
+
+def can_append(outputFormat):
+    '''True if rows can be added to the end of a table already written in this format.'''
+    return get_format(outputFormat) in [FORMAT_CSV, FORMAT_CSV_GZIP]
+
+
+def open_sink(fileName, fieldNames, fieldTypes=None, outputFormat=FORMAT_CSV, append=False):
+    '''
+    Returns a sink that writes a table with these columns to fileName.  The
+    rows given to its write_rows are lists of values in the order of
+    fieldNames, or write_column_block takes the same block as a list of
+    columns.  fieldTypes (TYPE_STR, TYPE_INT or TYPE_FLOAT for each field,
+    all TYPE_STR if not given) are used by the column formats; csv is
+    written the same whatever the types.
+
+    With append, the rows are added to the end of the table in fileName
+    (see can_append for the formats that allow it).
+    '''
+    outputFormat = get_format(outputFormat)
+    if (fieldTypes is None):
+        fieldTypes = [TYPE_STR] * len(fieldNames)
+    if (append and not can_append(outputFormat)):
+        raise ValueError("can't append to a table in " + outputFormat + ' format')
+    if (outputFormat == FORMAT_CSV):
+        return CsvSink(fileName, fieldNames, append)
+    if (outputFormat == FORMAT_CSV_GZIP):
+        return GzipCsvSink(fileName, fieldNames, append)
+    if (outputFormat == FORMAT_NPZ):
+        return NpzSink(fileName, fieldNames, fieldTypes)
+    return ArrowSink(fileName, fieldNames, fieldTypes)
+
+
+class CsvSink():
+    '''
+    CsvSink writes a table as csv text, with a header line, the same text
+    csv.DictWriter writes (see csvrows.format_rows).  When appending to a
+    table the header is already there.
+    '''
+
+    def __init__(self, fileName, fieldNames, append=False):
+        self.fileName = fileName
+        self.fieldNames = fieldNames
+        self.rowCount = 0
+        self.destFile = self.open_file('a' if append else 'w')
+        if (not append):
+            self.destFile.write(csvrows.format_rows([fieldNames]))
+
+    def open_file(self, mode):
+        return open(self.fileName, mode, csvrows.BUFFER_SIZE)
+
+    def write_rows(self, rows):
+        '''Writes a block of rows.'''
+        self.destFile.write(csvrows.format_rows(rows))
+        self.rowCount += len(rows)
+
+    def write_column_block(self, columns):
+        '''Writes a block of rows given as columns, a list of values for each field.'''
+        self.destFile.write(csvrows.format_columns(columns))
+        self.rowCount += len(columns[0])
+
+    def close(self):
+        self.destFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+class GzipCsvSink(CsvSink):
+    '''
+    GzipCsvSink writes the same text as CsvSink, gzip compressed.  Appended
+    rows go in a new gzip member, which gzip readers read straight on from
+    the one before.
+    '''
+
+    def open_file(self, mode):
+        return gzip.open(self.fileName, mode + 'b')
+
+
+class Column():
+    '''
+    Column holds the values of one column for the column sinks.  Numbers go
+    in an array; strings are dictionary encoded, an array of codes into the
+    list of the different values, so a person or snp id is stored once.
+
+    Each block of values is written straight on to a temporary spill file,
+    so only the dictionary is kept in memory however long the table is, and
+    the values are read back a block at a time (see iter_blocks) when the
+    sink is closed.
+    '''
+
+    def __init__(self, name, fieldType):
+        self.name = name
+        self.fieldType = fieldType
+        self.dictionary = None
+        if (fieldType == TYPE_INT):
+            self.typecode = 'l'
+        elif (fieldType == TYPE_FLOAT):
+            self.typecode = 'd'
+        else:
+            self.typecode = 'i'
+            self.dictionary = []
+            self.dictionaryIndex = {}
+        self.itemSize = array(self.typecode).itemsize
+        self.length = 0
+        self.spillFile = tempfile.TemporaryFile()
+
+    def extend(self, values):
+        '''Adds a block of values to the end of the spill file.'''
+        if (self.fieldType == TYPE_INT):
+            values = array('l', [int(value) for value in values])
+        elif (self.fieldType == TYPE_FLOAT):
+            #blank and non numeric values are missing
+            values = array('d', map(to_float, values))
+        else:
+            codes = []
+            for value in values:
+                value = str(value)
+                code = self.dictionaryIndex.get(value)
+                if (code is None):
+                    code = len(self.dictionary)
+                    self.dictionary.append(value)
+                    self.dictionaryIndex[value] = code
+                codes.append(code)
+            values = array('i', codes)
+        values.tofile(self.spillFile)
+        self.length += len(values)
+
+    def iter_blocks(self, blockRows=READ_BLOCK_ROWS):
+        '''Yields the values written so far as arrays of at most blockRows values, in order.'''
+        self.spillFile.flush()
+        self.spillFile.seek(0)
+        remaining = self.length
+        while (remaining > 0):
+            values = array(self.typecode)
+            values.fromfile(self.spillFile, min(blockRows, remaining))
+            remaining -= len(values)
+            yield values
+        self.spillFile.seek(0, os.SEEK_END)
+
+    def close(self):
+        '''Removes the spill file.'''
+        self.spillFile.close()
+
+
+class ColumnSink():
+    '''
+    ColumnSink collects the rows of a table into typed columns (see Column)
+    and writes them all when it's closed.  NpzSink and ArrowSink say how.
+    Each block of rows goes on to the columns' spill files as it comes, so
+    the memory used doesn't grow with the length of the table.
+    '''
+
+    def __init__(self, fileName, fieldNames, fieldTypes):
+        self.fileName = fileName
+        self.fieldNames = fieldNames
+        self.rowCount = 0
+        self.columns = [Column(fieldNames[index], fieldTypes[index]) for index in range(len(fieldNames))]
+
+    def write_rows(self, rows):
+        '''Adds a block of rows.'''
+        if (not rows):
+            return
+        for index, values in enumerate(zip(*rows)):
+            self.columns[index].extend(values)
+        self.rowCount += len(rows)
+
+    def write_column_block(self, columns):
+        '''Adds a block of rows given as columns, a list of values for each field.'''
+        for index in range(len(columns)):
+            self.columns[index].extend(columns[index])
+        self.rowCount += len(columns[0])
+
+    def close(self):
+        try:
+            self.write_columns()
+        finally:
+            self.remove_spill_files()
+
+    def remove_spill_files(self):
+        for column in self.columns:
+            column.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if (excType is None):
+            self.close()
+        else:
+            self.remove_spill_files()
+
+
+def get_npy_header(descr, shape):
+    '''Returns the header of a .npy file (numpy's format for one array) of shape items of type descr.'''
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, shape)
+    #the header is padded with spaces so the data starts on a multiple of 64 bytes
+    padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header += ' ' * (padding % 64) + '\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+def get_npy(values, descr, shape):
+    '''Returns the bytes of a .npy file holding values, a string of packed items of type descr.'''
+    return get_npy_header(descr, shape) + values
+
+
+def get_array_descr(typecode):
+    '''Returns the numpy type of an array typecode, such as <i8 for 'l'.'''
+    byteOrder = '<' if sys.byteorder == 'little' else '>'
+    kind = 'f' if typecode == 'd' else 'i'
+    return byteOrder + kind + str(array(typecode).itemsize)
+
+
+class NpzSink(ColumnSink):
+    '''
+    NpzSink writes the columns as an .npz file, the zip of .npy arrays that
+    numpy.load reads, without needing numpy.  Each column is an array named
+    for its field.  A dictionary encoded column's array holds the codes and
+    its values are in a fixed width string array named field + .dictionary.
+
+    zipfile only streams a member from a named file, so each column's .npy
+    is put together in a temporary file from its spill file and then added.
+    '''
+
+    def write_columns(self):
+        with zipfile.ZipFile(self.fileName, 'w', zipfile.ZIP_DEFLATED, True) as destFile:
+            for column in self.columns:
+                handle, npyFileName = tempfile.mkstemp('.npy')
+                try:
+                    with os.fdopen(handle, 'wb') as npyFile:
+                        npyFile.write(get_npy_header(get_array_descr(column.typecode), column.length))
+                        column.spillFile.flush()
+                        column.spillFile.seek(0)
+                        shutil.copyfileobj(column.spillFile, npyFile)
+                    destFile.write(npyFileName, column.name + '.npy')
+                finally:
+                    os.remove(npyFileName)
+                if (column.dictionary is not None):
+                    width = max([len(value) for value in column.dictionary] + [1])
+                    values = ''.join([value.ljust(width, '\x00') for value in column.dictionary])
+                    destFile.writestr(column.name + DICTIONARY_SUFFIX + '.npy',
+                                      get_npy(values, '|S' + str(width), len(column.dictionary)))
+
+
+class ArrowSink(ColumnSink):
+    '''
+    ArrowSink writes the columns as an Arrow IPC (feather) file with pyarrow,
+    the string columns as dictionary arrays.  The columns are read back from
+    their spill files READ_BLOCK_ROWS rows at a time and each block is
+    written as a record batch.  The dictionaries are complete by then, so
+    every batch shares the same ones.
+    '''
+
+    def write_columns(self):
+        types = []
+        dictionaries = []
+        for column in self.columns:
+            if (column.dictionary is not None):
+                types.append(pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+                dictionaries.append(pyarrow.array(column.dictionary, pyarrow.string()))
+            else:
+                types.append(pyarrow.int64() if column.fieldType == TYPE_INT else pyarrow.float64())
+                dictionaries.append(None)
+        schema = pyarrow.schema([pyarrow.field(self.fieldNames[index], types[index])
+                                 for index in range(len(self.columns))])
+        writer = pyarrow.ipc.new_file(self.fileName, schema)
+        try:
+            for blocks in itertools.izip(*[column.iter_blocks() for column in self.columns]):
+                arrays = []
+                for index in range(len(blocks)):
+                    if (dictionaries[index] is not None):
+                        arrays.append(pyarrow.DictionaryArray.from_arrays(
+                            pyarrow.array(blocks[index], pyarrow.int32()), dictionaries[index]))
+                    else:
+                        arrays.append(pyarrow.array(blocks[index], types[index]))
+                writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        finally:
+            writer.close()
+
+
+def read_npy(data):
+    '''Returns the values of a .npy file written by get_npy, as an array or a list of strings.'''
+    headerLength = struct.unpack('<H', data[len(NPY_MAGIC):len(NPY_MAGIC) + 2])[0]
+    start = len(NPY_MAGIC) + 2
+    header = ast.literal_eval(data[start:start + headerLength])
+    values = data[start + headerLength:]
+    descr = header['descr']
+    if (descr.startswith('|S')):
+        width = int(descr[2:])
+        return [values[index:index + width].rstrip('\x00') for index in range(0, len(values), width)]
+    if (descr[1] == 'f'):
+        column = array('d')
+    else:
+        column = array('l' if descr[2:] == str(array('l').itemsize) else 'i')
+    column.fromstring(values)
+    if ((descr[0] == '<') != (sys.byteorder == 'little')):
+        column.byteswap()
+    return column
+
+
+def read_npz(fileName):
+    '''
+    Returns a dictionary of the columns in an .npz file written by NpzSink,
+    with the dictionary encoded columns decoded back to lists of strings.
+    '''
+    arrays = {}
+    with zipfile.ZipFile(fileName, 'r') as srcFile:
+        for name in srcFile.namelist():
+            arrays[name[:-len('.npy')]] = read_npy(srcFile.read(name))
+    columns = {}
+    for name in arrays:
+        if (name.endswith(DICTIONARY_SUFFIX)):
+            continue
+        dictionary = arrays.get(name + DICTIONARY_SUFFIX)
+        if (dictionary is None):
+            columns[name] = arrays[name]
+        else:
+            columns[name] = [dictionary[code] for code in arrays[name]]
+    return columns
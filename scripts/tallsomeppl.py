@@ -1,8 +1,9 @@
 from talltable import TallTable
 from talltable import DEFAULT_DATA_DIR
 from talltable import DEFAULT_VCFS_DIR
-from vcffile import VcfFile
-from csv import DictWriter
+import cohort
+import pipeline
+import tablesink
 
 DEFAULT_OUTPUT_FILE_NAME = DEFAULT_DATA_DIR + 'tallsomeppl.csv'
 FIELD_PERSONID = 'personid'
@@ -14,32 +15,27 @@ class TallSomePeople(TallTable):
     TallSomePeople is a tall table that does not contain all the people.  
     '''
     
-    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME):
-        TallTable.__init__(self, inputDirectoryName, outputFileName)
+    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME,
+                 outputFormat=tablesink.FORMAT_CSV):
+        TallTable.__init__(self, inputDirectoryName, outputFileName, outputFormat)
 
-    def add_some(self, personIds):
+    def add_some(self, personIds, workers=1, window=None):
         '''
         Loops through the files that contain the data for the people identified in personIds.
         Creates a file similar to add_all except that not all the people are added.  
+        Raises IOError if any of the people has no file (see pipeline.select_people).
         '''
         
         #open the destination file and write the header line
-        with open(self.filename, 'w') as destFile:
+        headerFields = [FIELD_PERSONID, FIELD_SNPID, FIELD_ALLELE]
+        with tablesink.open_sink(self.filename, headerFields, self.get_column_types(), self.outputFormat) as sink:
             print "created " + self.filename + "\n"
-            headerFields = [FIELD_PERSONID, FIELD_SNPID, FIELD_ALLELE]
-            writer = DictWriter(destFile, headerFields, lineterminator='\n')
-            writer.writeheader()
 
-            #loop through the files in the directory and add a column for each
-            srcFileNames = []
-            inputFile = VcfFile()
-            for personId in personIds:
-                srcFileName = inputFile.get_persons_file_name(personId)
-                srcFileNames.append(srcFileName)
-            
+            #read just the files of these people
+            srcFileNames = pipeline.select_people(cohort.get_sorted_file_names(self.inputDir), personIds)
             fileCount = 0
-            for srcFileName in srcFileNames:
-                self.write_one_person_to_file(self.inputDir + srcFileName, writer)
+            for srcFileName, rows in pipeline.map_file_rows(self, srcFileNames, workers, window):
+                self.write_rows_to_file(srcFileName, rows, sink)
                 fileCount += 1
     
 if __name__ == '__main__':
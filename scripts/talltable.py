@@ -1,8 +1,12 @@
 import os
-import vcffile
+import sys
+import genomecache
 import risksnps
-import snpcounts
-import csv
+import cohort
+import tablesink
+import pipeline
+import manifest
+import vcffile
 
 DEFAULT_DATA_DIR = '../data/'
 DEFAULT_OUTPUT_FILE_NAME = DEFAULT_DATA_DIR + 'talltable.csv'
@@ -24,30 +28,71 @@ class TallTable():
     
     '''
     
-    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME):
-        self.filename = outputFileName
+    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME,
+                 outputFormat=tablesink.FORMAT_CSV):
+        self.outputFormat = outputFormat
+        self.filename = tablesink.get_file_name(outputFileName, outputFormat)
         self.inputDir = inputDirectoryName
         self._recordCount = 0
 
         
-    def add_all(self):
+    def add_all(self, workers=1, window=None, matrix=None, incremental=False):
         '''
         Loops through all the files in inputDir directory, adding a column of personIds,
         a column of snpIds and a column of alleles
+
+        The rows come from the pipeline of get_genotypes, a record at a time.
+        A multi sample vcf file adds all its people, snp by snp for the
+        tall table of everything and person by person for the risk snps.
+        The files are added in order of person id.  With more than one worker,
+        the files are read on a pool of worker processes, at most window of
+        them at a time (see pipeline.map_file_rows).
+
+        If a GenotypeMatrix that has already been read is given, the table is
+        written from it instead of the files, with each person's snps in the
+        order of the matrix columns.
+
+        The table is written in outputFormat (see tablesink.open_sink).
+
+        With incremental, the files the table was made from are kept in a
+        manifest (see manifest.Manifest) and only the people whose files are
+        new since then are read and their rows added to the end of the table.
+        If any of the files already in it has changed or gone, or the table
+        can't be appended to, the whole table is made again.
         '''
+        srcFileNames = None
+        if (matrix is None):
+            srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        tableManifest = None
+        append = False
+        if (incremental and matrix is None):
+            self.prepare()
+            tableManifest = manifest.Manifest(manifest.get_manifest_name(self.filename), self.get_manifest_key())
+            tableManifest.load()
+            newFileNames = tableManifest.get_new_files(srcFileNames, self.filename)
+            if (newFileNames is not None and tablesink.can_append(self.outputFormat)):
+                srcFileNames = newFileNames
+                append = True
+            else:
+                tableManifest.clear()
                     
         #open the destination file and write the header line
-        with open(self.filename, 'w') as destFile:
-            colNames = self.get_column_names()
-            writer = csv.DictWriter(destFile, fieldnames=colNames, lineterminator='\n')
-            print "created " + self.filename + "\n"
-            writer.writeheader()
+        with tablesink.open_sink(self.filename, self.get_column_names(), self.get_column_types(),
+                                 self.outputFormat, append) as sink:
+            if (append):
+                print "adding " + str(len(srcFileNames)) + " new files to " + self.filename + "\n"
+            else:
+                print "created " + self.filename + "\n"
+            self.prepare()
             
             #loop through the files in the directory and add a column for each
-            srcFileNames = os.listdir(self.inputDir)
+            if (matrix is not None):
+                people = self.iter_matrix_rows(matrix)
+            else:
+                people = pipeline.map_file_rows(self, srcFileNames, workers, window)
             fileCount = 0
-            for srcFileName in srcFileNames:
-                self.write_one_person_to_file(self.inputDir + srcFileName, writer)
+            for srcFileName, rows in people:
+                self.write_rows_to_file(srcFileName, rows, sink)
                 fileCount += 1
             
             
@@ -56,30 +101,95 @@ class TallTable():
                         "https://genomeinterpretation.org/content/crohns-disease-2012 \n")
             else:
                 print "Read " + str(fileCount) + " files from " + self.inputDir
+        if (tableManifest is not None):
+            tableManifest.add_files(srcFileNames)
+            tableManifest.save(self.filename)
+
+    def get_manifest_key(self):
+        '''
+        Returns the key of the table's manifest, what the table depends on
+        other than the vcf files.  The plain tall table depends on nothing else.
+        '''
+        return ''
                 
     def get_column_names(self):
         colnames=[FIELD_PERSONID, FIELD_SNPID, FIELD_ALLELE]
         return colnames
+
+    def get_column_types(self):
+        '''The types of the columns, for the column output formats.'''
+        return [tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_STR]
+
+    def prepare(self):
+        '''
+        Reads anything the table needs before the people are added, so that it's
+        read once rather than once per worker.
+        '''
+        pass
         
-    def write_one_person_to_file(self, srcFileName, writer):
-        '''
-        Gets the alleles for the snps from srcFile and writes them to the output file
-        '''
-
-        srcData = vcffile.VcfFile(srcFileName)
-        personId = srcData.get_person_id()
-        snpsAndAlleles = srcData.get_all_snps_and_alleles()
-        recordCount = 0
-        rowOut = {FIELD_PERSONID:personId, FIELD_SNPID:0, FIELD_ALLELE:0}
-        for snpAndAllele in snpsAndAlleles:
-            if (snpAndAllele[1] != '0'):
-                rowOut[FIELD_SNPID] = snpAndAllele[0]
-                rowOut[FIELD_ALLELE] = snpAndAllele[1]
-                writer.writerow(rowOut)
-                #lineOut = personId + ',' + snpAndAllele[0] + ',' + snpAndAllele[1] + '\n'
-                #destFile.write(lineOut)
-            recordCount += 1
-        print srcFileName + ' wrote ' + str(recordCount) + ' records to ' + self.filename
+    def write_one_person_to_file(self, srcFileName, sink):
+        '''
+        Gets the alleles for the snps from srcFile and writes them to the output sink
+        '''
+        self.prepare()
+        rows = self.get_one_person_rows(srcFileName)
+        self.write_rows_to_file(srcFileName, rows, sink)
+
+    def get_genotypes(self, srcFileNames):
+        '''
+        Returns the pipeline (see pipeline.py) of the genotypes that go in the
+        table: every snp of each person that isn't '0'.
+        '''
+        return pipeline.drop_missing(pipeline.read_cohort(srcFileNames))
+
+    def get_genotype_row(self, genotype):
+        '''Returns the output row for one genotype, a list of values in the order of get_column_names.'''
+        return [genotype.personId, genotype.snpId, genotype.allele]
+
+    def get_one_person_rows(self, srcFileName):
+        '''
+        Returns the output rows for the person in srcFile, each a list of values
+        in the order of get_column_names.
+        '''
+        return list(pipeline.to_rows(self.get_genotypes([srcFileName]), self.get_genotype_row))
+
+    def read_person_rows(self, srcFileName):
+        '''
+        Returns get_one_person_rows for a one person file, on a worker process
+        (see pipeline.map_file_rows), or None for a multi sample file, which is
+        better read a line at a time by the process writing the table than
+        sent back whole.
+        '''
+        if (vcffile.VcfFile(srcFileName).is_multi_sample()):
+            return None
+        return self.get_one_person_rows(srcFileName)
+
+    def iter_matrix_rows(self, matrix):
+        '''
+        Yields (personId, rows) for each person in a GenotypeMatrix, the rows
+        being the same as get_one_person_rows would return.
+        '''
+        for personIndex in range(matrix.person_count()):
+            personId = matrix.personIds[personIndex]
+            rows = []
+            for snpId, allele in matrix.iter_snps_and_alleles(personIndex):
+                rows.append(self.get_matrix_row(personId, snpId, allele))
+            yield (personId, rows)
+
+    def get_matrix_row(self, personId, snpId, allele):
+        '''Returns one output row for a person's snp from a GenotypeMatrix.'''
+        return [personId, snpId, allele]
+
+    def write_rows_to_file(self, srcFileName, rows, sink):
+        '''
+        Writes one person's rows, a list or a generator, to the output sink in
+        blocks (see pipeline.write_rows).  For csv each block is formatted at
+        once (see csvrows.format_rows), the same text csv.DictWriter would
+        write a row at a time.
+        '''
+        rowCount = pipeline.write_rows(rows, sink)
+        self._recordCount += rowCount
+        print srcFileName + ' wrote ' + str(rowCount) + ' records to ' + self.filename
 
         
 class RiskSnpTallTable(TallTable):
@@ -94,45 +204,54 @@ class RiskSnpTallTable(TallTable):
 
     '''
 
-    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME):
-        TallTable.__init__(self, inputDirectoryName, outputFileName)
+    def __init__(self, inputDirectoryName = DEFAULT_VCFS_DIR, outputFileName=DEFAULT_OUTPUT_FILE_NAME,
+                 outputFormat=tablesink.FORMAT_CSV):
+        TallTable.__init__(self, inputDirectoryName, outputFileName, outputFormat)
         self.riskSnps = risksnps.RiskSnps()
 
     def get_column_names(self):
         colnames=[FIELD_INDEX, FIELD_PERSONID, FIELD_SNPID, FIELD_ALLELE, FIELD_ODDSRATIO]
         return colnames
 
-    def write_one_person_to_file(self, srcFileName, writer):
+    def get_column_types(self):
+        '''The types of the columns, for the column output formats.'''
+        return [tablesink.TYPE_INT, tablesink.TYPE_STR, tablesink.TYPE_STR, tablesink.TYPE_INT, tablesink.TYPE_FLOAT]
+
+    def prepare(self):
         '''
-        Gets the alleles for the risk snps from srcFile and writes them to the output file
+        Reads the risk snps, if they haven't been read already.
         '''
-
         if (self.riskSnps.len() == 0):
-            self.riskSnps.read_from_file()
-        
-        srcData = vcffile.VcfFile(srcFileName)
-        personId = srcData.get_person_id()
-        riskAlleles = srcData.get_these_risksnps(self.riskSnps)
-        rowOut = {FIELD_INDEX:0, FIELD_PERSONID:personId, FIELD_SNPID:0, FIELD_ALLELE:0, FIELD_ODDSRATIO:0}
-        index = 0
-        riskSnpsThisPerson = 0
-        for allele in riskAlleles:
-            if (allele != '0'):
-                rowOut[FIELD_INDEX] = index
-                rowOut[FIELD_SNPID] = self.riskSnps.snps[index]
-                rowOut[FIELD_ALLELE] = allele
-                rowOut[FIELD_ODDSRATIO] = self.riskSnps.oddsratio[index]
-                writer.writerow(rowOut)
-                self._recordCount += 1
-                riskSnpsThisPerson += 1
-            index += 1
-        print srcFileName + '  ' + str(riskSnpsThisPerson) + ' risk snps'
+            self.riskSnps = risksnps.read_from_file()
+
+    def get_manifest_key(self):
+        '''The risk snp table depends on the risk snps, so they're its manifest key.'''
+        return self.riskSnps.get_key()
+
+    def get_genotypes(self, srcFileNames):
+        '''
+        Returns the pipeline of the risk snps each person has: their allele
+        numbers in panel order, leaving out the '0's.
+        '''
+        return pipeline.drop_missing(pipeline.read_risk_snps(srcFileNames, self.riskSnps))
+
+    def get_genotype_row(self, genotype):
+        '''Returns the output row for one risk snp genotype.'''
+        return [genotype.index, genotype.personId, genotype.snpId, genotype.allele,
+                self.riskSnps.oddsratio[genotype.index]]
+
+    def get_matrix_row(self, personId, snpId, allele):
+        '''Returns one output row for a person's risk snp from a GenotypeMatrix of allele numbers.'''
+        index = self.riskSnps.get_index(snpId)
+        return [index, personId, snpId, allele, self.riskSnps.oddsratio[index]]
 
 if __name__ == '__main__':
+    if ('--no-cache' in sys.argv):
+        genomecache.set_enabled(False)
     #destObj = TallTable()
     #destObj.add_all()
     destObj = RiskSnpTallTable(outputFileName='../data/risksnptalltable.csv')
-    destObj.add_all()
+    destObj.add_all(incremental=('--incremental' in sys.argv))
     
     
         
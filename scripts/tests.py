@@ -2,12 +2,139 @@ import unittest
 import risksnps
 import os
 import vcffile
+import vcfindex
+import vcfshards
+import bgzf
+import gzip
 import risksnptable
+import talltable
+import differencecounts
+import genotypematrix
+import cohort
+import tempfile
+import shutil
+import csv
+import random
+import genomecache
+import csvrows
+import tablesink
+import pipeline
+import tallsomeppl
+import riskscores
+import correlationmatrix
+import snpids
+import mergejoin
+import similarity
+import minhash
+import manifest
+import math
+import time
+import benchmarks
+import StringIO
+import atexit
+import threading
+from array import array
 
 TESTDATADIR = '../data/'
 VCFDATADIR = TESTDATADIR + 'vcfdata/'
 SOURCEFILENAMEDEFAULT = TESTDATADIR + 'oddsRatio.csv';
 SAMPLEFILENAME = TESTDATADIR + 'A0024_hg19.gatk.flt.vcf'
+SYNTHETICLINES = ['##fileformat=VCFv4.1',
+                  '##contig=<ID=chr1,length=249250621>',
+                  '##contig=<ID=chr2,length=243199373>',
+                  '##contig=<ID=chrX,length=155270560>',
+                  '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA9001',
+                  'chr1\t10583\trs58108140\tG\tA\t50.0\tPASS\tDP=10\tGT\t0/1',
+                  'chr1\t69511\trs75062661\tA\tG\t50.0\tPASS\tDP=10\tGT\t1/1',
+                  'chr1\t71000\t.\tC\tT\t50.0\tPASS\tDP=10\tGT\t0/1',
+                  'chr2\t12000\trs102275\tT\tC\t50.0\tPASS\tDP=10\tGT\t0/1',
+                  'chr2\t15000\trs3764147\tA\tG\t50.0\tPASS\tDP=10\tGT\t1/1',
+                  'chrX\t20000\trs7927997\tC\tT\t50.0\tPASS\tDP=10\tGT\t0/1']
+
+MULTISAMPLENAMES = ['A9101', 'A9102', 'A9103']
+MULTISAMPLELINES = SYNTHETICLINES[:4] + [
+    '\t'.join(SYNTHETICLINES[4].split('\t')[:9] + MULTISAMPLENAMES),
+    'chr1\t10583\trs58108140\tG\tA\t50.0\tPASS\tDP=10\tGT:DP\t0/1:5\t1|1:7\t./.:0',
+    'chr1\t71000\t.\tC\tT\t50.0\tPASS\tDP=10\tGT:DP\t0/1:5\t0/1:5\t0/1:5',
+    'chr2\t12000\trs102275\tT\tC,G\t50.0\tPASS\tDP=10\tGT:DP\t1/2:5\t0/0:5\t2/2:5',
+    'chr2\t15000\trs3764147\tA\tG\t50.0\tPASS\tDP=10\tDP:GT\t5:1/1\t5:0/0\t5',
+    'chrX\t20000\trs7927997\tC\tT\t50.0\tPASS\tDP=10\tGT\t0|1\t1\t0/0']
+
+#the tests write their vcf files to temporary directories, keep them out of the cache
+genomecache.set_enabled(False)
+#and number the snp ids that aren't rs numbers in a file of their own
+SNPIDSDIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, SNPIDSDIR, True)
+snpids.fileName = os.path.join(SNPIDSDIR, 'snpids.txt')
+
+
+def write_synthetic_vcf(directory, personId='A9001', lines=SYNTHETICLINES):
+    '''Writes a small vcf file for personId into directory and returns its name.'''
+    fileName = os.path.join(directory, personId + '_hg19.gatk.flt.vcf')
+    with open(fileName, 'w') as destFile:
+        destFile.write('\n'.join(lines) + '\n')
+    return fileName
+
+
+def write_multi_sample_vcf(directory):
+    '''Writes a small vcf file with the samples MULTISAMPLENAMES into directory and returns its name.'''
+    return write_synthetic_vcf(directory, 'A9100', MULTISAMPLELINES)
+
+
+def write_synthetic_cohort(directory, personCount=3):
+    '''
+    Writes personCount small vcf files into directory, each person missing a
+    different snp and with some different alleles.  Returns the person ids.
+    '''
+    personIds = []
+    header = SYNTHETICLINES[:5]
+    dataLines = SYNTHETICLINES[5:]
+    for personNumber in range(personCount):
+        personId = 'A90' + str(personNumber + 10)
+        lines = []
+        for lineNumber in range(len(dataLines)):
+            split = dataLines[lineNumber].split('\t')
+            if (lineNumber == personNumber):
+                continue
+            if ((lineNumber + personNumber) % 3 == 0):
+                split[4] = 'C'
+            lines.append('\t'.join(split))
+        write_synthetic_vcf(directory, personId, header + lines)
+        personIds.append(personId)
+    return personIds
+
+
+def read_file(fileName):
+    '''Returns the contents of a file.'''
+    with open(fileName, 'rb') as srcFile:
+        return srcFile.read()
+
+
+def count_diffs_by_merge(snpsAndAlleles, compareSnpsAndAlleles):
+    '''
+    The merge DifferenceCounts.count_diffs did on two people's sorted
+    [snpId, allele] lists, stepping both one line at a time, the reference
+    for counting people with repeated snps.
+    '''
+    diffCount = 0
+    index = 0
+    compareIndex = 0
+    while (index < len(snpsAndAlleles) or compareIndex < len(compareSnpsAndAlleles)):
+        snp = snpsAndAlleles[index][0] if index < len(snpsAndAlleles) else 'zz'
+        compareSnp = compareSnpsAndAlleles[compareIndex][0] if compareIndex < len(compareSnpsAndAlleles) else 'zz'
+        if (snp == compareSnp):
+            if (snpsAndAlleles[index][1] != compareSnpsAndAlleles[compareIndex][1]):
+                diffCount += 1
+            index += 1
+            compareIndex += 1
+        elif (snp < compareSnp):
+            diffCount += 1
+            index += 1
+        else:
+            diffCount += 1
+            compareIndex += 1
+    return diffCount
+
 
 class TestVcfFile(unittest.TestCase):
     '''
@@ -50,6 +177,36 @@ class TestVcfFile(unittest.TestCase):
         alleleNumber = inputfile.get_an_allele_number('G', 'G')
         self.assertEqual('4', alleleNumber)
 
+    def test_allele_numbers(self):
+        '''
+        The allele number table should give the same numbers as the per call
+        dictionary did (benchmarks.get_allele_number_per_call), one at a time
+        and a list at a time, and a list at a time should be the faster
+        (benchmarks.py alleles times them).
+        '''
+        inputfile = vcffile.VcfFile(SAMPLEFILENAME)
+        rand = random.Random(3)
+        choices = ['A', 'C', 'G', 'T', 'A,G', '', 'AT']
+        alleles = [rand.choice(choices) for index in range(100000)]
+        riskAlleles = [rand.choice(choices[:4] + ['N']) for index in range(100000)]
+        expected = [benchmarks.get_allele_number_per_call(alleles[index], riskAlleles[index])
+                    for index in range(len(alleles))]
+        self.assertEqual(expected, [inputfile.get_an_allele_number(alleles[index], riskAlleles[index])
+                                    for index in range(len(alleles))])
+        self.assertEqual(expected, vcffile.get_allele_numbers(alleles, riskAlleles))
+        #the best of a few runs of each, so a busy machine doesn't fail the test
+        perCallSeconds = []
+        listSeconds = []
+        for run in range(3):
+            start = time.time()
+            [benchmarks.get_allele_number_per_call(alleles[index], riskAlleles[index]) for index in range(len(alleles))]
+            perCallSeconds.append(time.time() - start)
+            start = time.time()
+            vcffile.get_allele_numbers(alleles, riskAlleles)
+            listSeconds.append(time.time() - start)
+        self.assertTrue(min(listSeconds) < min(perCallSeconds),
+                        'a list at a time took %.3f s, per call %.3f s' % (min(listSeconds), min(perCallSeconds)))
+
     def test_get_these_risksnps(self):
         '''
         VcfFile.get_these_risksnps should return a list of allele numbers.
@@ -58,15 +215,275 @@ class TestVcfFile(unittest.TestCase):
         from the reference genome, and it is for one of the risk snps,
         it is usually, but not always the risk allele. 
         '''
-        riskSnps = risksnps.RiskSnps()
-        riskSnps.set_snps(['rs102275', 'rs3764147', 'rs7927997', 'rs415890', 'rs4077515', 'rs3810936', 'rs2476601', 'rs3792109'])
-        riskSnps.set_alleles(['C','G','T','C','T','C','G','A'])
+        riskSnps = risksnps.RiskSnps(['rs102275', 'rs3764147', 'rs7927997', 'rs415890', 'rs4077515', 'rs3810936', 'rs2476601', 'rs3792109'], ['C','G','T','C','T','C','G','A'])
         inputfile = vcffile.VcfFile(SAMPLEFILENAME)
         alleleNumbers = inputfile.get_these_risksnps(riskSnps)
         self.assertEqual(riskSnps.len(), len(alleleNumbers))
         self.assertEqual('4', alleleNumbers[0])
         self.assertEqual('4', alleleNumbers[1])
 
+    def test_iter_records(self):
+        '''
+        VcfFile.iter_records should skip the header lines and return one record
+        per data line, iter_snp_records only the ones with an rs id.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputfile = vcffile.VcfFile(write_synthetic_vcf(tempDir))
+            records = list(inputfile.iter_records())
+            self.assertEqual(6, len(records))
+            self.assertEqual('chr1', records[0].chrom)
+            self.assertEqual('10583', records[0].pos)
+            self.assertEqual('rs58108140', records[0].id)
+            self.assertEqual('G', records[0].ref)
+            self.assertEqual('A', records[0].alt)
+            snpRecords = list(inputfile.iter_snp_records())
+            self.assertEqual(5, len(snpRecords))
+            self.assertEqual(['rs58108140', 'A', 'chr1', '10583'],
+                             inputfile.get_all_snps_and_locations()[0])
+            self.assertEqual(['rs7927997', 'T'], inputfile.get_all_snps_and_alleles()[-1])
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_seek_these_risksnps(self):
+        '''
+        VcfFile.get_these_risksnps should find the same alleles by seeking to the
+        snps' positions as it does by reading the file.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputfile = vcffile.VcfFile(write_synthetic_vcf(tempDir))
+            riskSnps = risksnps.RiskSnps(['rs7927997', 'rs102275', 'rsnotinfile', 'rs58108140', 'rs3764147'], ['T', 'C', 'G', 'G', 'A'])
+            scanned = inputfile.get_these_risksnps(riskSnps)
+            self.assertEqual(['4', '4', '0', '1', '3'], scanned)
+            riskSnps = riskSnps.set_locations(['chrX', '2', '1', 'chr1', 'chr2'],
+                                              ['20000', '12000', '500', '10583', '15000'])
+            self.assertTrue(riskSnps.has_locations())
+            self.assertEqual({'chr1': 0, 'chr2': 1, 'chrX': 2}, inputfile.get_contig_order())
+            #bisect all the way down rather than reading forward from the first line
+            inputfile.seekScanBytes = 1
+            self.assertEqual(scanned, inputfile.get_these_risksnps(riskSnps))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_duplicate_risksnp_lines(self):
+        '''
+        VcfFile.get_these_risksnps should take a snp from the first of the
+        lines with its id, whether it reads, seeks or uses the index.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            lines = list(SYNTHETICLINES)
+            lines.insert(lines.index(SYNTHETICLINES[5]) + 1, 'chr1\t10583\trs58108140\tG\tC\t50.0\tPASS\tDP=10\tGT\t0/1')
+            lines.insert(lines.index(SYNTHETICLINES[8]) + 1, 'chr2\t12000\trs102275\tT\tG\t50.0\tPASS\tDP=10\tGT\t0/1')
+            fileName = write_synthetic_vcf(tempDir, lines=lines)
+            inputfile = vcffile.VcfFile(fileName)
+            riskSnps = risksnps.RiskSnps(['rs7927997', 'rs102275', 'rsnotinfile', 'rs58108140', 'rs3764147'], ['T', 'C', 'G', 'G', 'A'])
+            expected = ['4', '4', '0', '1', '3']
+            self.assertEqual(expected, inputfile.scan_these_risksnps(riskSnps))
+            riskSnps = riskSnps.set_locations(['chrX', '2', '1', 'chr1', 'chr2'],
+                                              ['20000', '12000', '500', '10583', '15000'])
+            self.assertEqual(expected, inputfile.seek_these_risksnps(riskSnps, inputfile.get_contig_order()))
+            index = vcfindex.VcfIndex(fileName)
+            index.build()
+            self.assertTrue(index.load())
+            self.assertEqual(expected, inputfile.index_these_risksnps(riskSnps, index))
+            multiLines = MULTISAMPLELINES + ['chrX\t20000\trs7927997\tC\tA\t50.0\tPASS\tDP=10\tGT\t1/1\t1/1\t1/1']
+            multiFile = vcffile.VcfFile(write_synthetic_vcf(tempDir, 'A9100', multiLines))
+            riskSnps = risksnps.RiskSnps(['rs7927997'], ['T'])
+            self.assertEqual([['4'], ['4'], ['0']], multiFile.get_these_risksnps_by_sample(riskSnps))
+            self.assertEqual([[1], [1], [0]], map(list, multiFile.get_these_risksnp_dosages(riskSnps)))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_risksnp_fallback(self):
+        '''
+        VcfFile.get_these_risksnps should find the same snps whether it reads,
+        seeks or uses the index: a snp that isn't at its panel position or
+        where a stale index points is found by reading, and ids that don't
+        start with rs aren't looked for.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            lines = SYNTHETICLINES + ['chrX\t30000\tesv3\tC\tT\t50.0\tPASS\tDP=10\tGT\t0/1']
+            fileName = write_synthetic_vcf(tempDir, lines=lines)
+            os.utime(fileName, (1000000000, 1000000000))
+            inputfile = vcffile.VcfFile(fileName)
+            riskSnps = risksnps.RiskSnps(['rs7927997', 'rs102275', 'esv3', 'rs58108140'], ['T', 'C', 'T', 'G'])
+            expected = ['4', '4', '0', '1']
+            self.assertEqual(expected, inputfile.scan_these_risksnps(riskSnps))
+            #rs102275 is at 12000 in the file
+            riskSnps = riskSnps.set_locations(['chrX', '2', 'chrX', 'chr1'], ['20000', '13000', '30000', '10583'])
+            self.assertEqual(expected, inputfile.seek_these_risksnps(riskSnps, inputfile.get_contig_order()))
+            index = vcfindex.VcfIndex(fileName)
+            index.build()
+            self.assertTrue(index.load())
+            self.assertEqual(expected, inputfile.index_these_risksnps(riskSnps, index))
+            #swap two lines of the same length, keeping the size and modification time
+            swapped = list(lines)
+            swapped[5], swapped[6] = lines[5].replace('rs58108140', 'rs75062661'), lines[6].replace('rs75062661', 'rs58108140')
+            write_synthetic_vcf(tempDir, lines=swapped)
+            os.utime(fileName, (1000000000, 1000000000))
+            self.assertTrue(index.load())
+            self.assertEqual(expected[:3] + ['4'], inputfile.index_these_risksnps(riskSnps, index))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_query(self):
+        '''
+        VcfFile.query should answer id and region queries from the index file,
+        and rebuild the index when the vcf file changes.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            fileName = write_synthetic_vcf(tempDir)
+            inputfile = vcffile.VcfFile(fileName)
+            records = inputfile.query(ids=['rs7927997', 'rsnotinfile', 'rs58108140'])
+            self.assertEqual(['rs58108140', 'rs7927997'], [record.id for record in records])
+            self.assertTrue(os.path.exists(fileName + vcfindex.INDEX_SUFFIX))
+            self.assertEqual([os.path.basename(fileName)],
+                             vcffile.get_vcf_file_names(tempDir))
+            records = inputfile.query(region='chr1:10000-70000')
+            self.assertEqual(['rs58108140', 'rs75062661'], [record.id for record in records])
+            records = inputfile.query(region='chr2', ids=['rs3764147', 'rs58108140'])
+            self.assertEqual(['rs3764147'], [record.id for record in records])
+            riskSnps = risksnps.RiskSnps(['rs7927997', 'rs102275', 'rsnotinfile'], ['T', 'C', 'G'])
+            self.assertEqual(['4', '4', '0'], inputfile.get_these_risksnps(riskSnps))
+
+            #change the file, the index should be rebuilt rather than used
+            write_synthetic_vcf(tempDir, lines=SYNTHETICLINES + [
+                'chrX\t30000\trs9999999\tC\tT\t50.0\tPASS\tDP=10\tGT\t0/1'])
+            index = vcfindex.VcfIndex(fileName)
+            self.assertFalse(index.load())
+            records = inputfile.query(ids=['rs9999999'])
+            self.assertEqual(['rs9999999'], [record.id for record in records])
+            self.assertTrue(index.load())
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_compressed_files(self):
+        '''
+        VcfFile should read gzip and bgzf files the same as plain text ones,
+        and the directory listing should include them.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            fileName = write_synthetic_vcf(tempDir)
+            expected = vcffile.VcfFile(fileName).get_all_snps_and_locations()
+            gzipFileName = os.path.join(tempDir, 'A9002_hg19.gatk.flt.vcf.gz')
+            with open(fileName, 'rb') as srcFile:
+                destFile = gzip.open(gzipFileName, 'wb')
+                destFile.write(srcFile.read())
+                destFile.close()
+            bgzfFileName = os.path.join(tempDir, 'A9003.vcf.bgz')
+            #small blocks so the lines are split across blocks
+            bgzf.write_bgzf(fileName, bgzfFileName, 50)
+            self.assertFalse(bgzf.is_bgzf(gzipFileName))
+            self.assertTrue(bgzf.is_bgzf(bgzfFileName))
+            #the first line comes from the first block, before any threads are started
+            threadCount = threading.active_count()
+            lines = bgzf.iter_bgzf_lines(bgzfFileName, 4)
+            self.assertEqual(SYNTHETICLINES[0] + '\n', lines.next())
+            self.assertEqual(threadCount, threading.active_count())
+            self.assertEqual(SYNTHETICLINES[1:], [a_line.rstrip('\n') for a_line in lines])
+            self.assertEqual(read_file(fileName).splitlines(True), list(bgzf.iter_bgzf_lines(bgzfFileName, 1)))
+            for compressedFileName in [gzipFileName, bgzfFileName]:
+                inputfile = vcffile.VcfFile(compressedFileName, threads=2)
+                self.assertTrue(inputfile.is_compressed())
+                self.assertEqual(expected, inputfile.get_all_snps_and_locations())
+                records = inputfile.query(region='chr2', ids=['rs3764147', 'rs58108140'])
+                self.assertEqual(['rs3764147'], [record.id for record in records])
+            self.assertEqual('A9003', vcffile.VcfFile(bgzfFileName).get_person_id())
+            self.assertEqual(3, len(vcffile.get_vcf_file_names(tempDir)))
+            self.assertEqual('A9003.vcf.bgz', vcffile.VcfFile().get_persons_file_name('A9003', tempDir))
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_sharded_parse(self):
+        '''
+        Parsing a file in shards on worker processes should give the same snps
+        in the same order as reading it, with shards of lines or, when the
+        file has an index, of whole chromosomes.
+        '''
+        tempDir = tempfile.mkdtemp()
+        minShardBytes = vcfshards.MIN_SHARD_BYTES
+        try:
+            rand = random.Random(5)
+            lines = SYNTHETICLINES[:5]
+            for chrom in ['chr1', 'chr2', 'chrX']:
+                for position in range(1000, 400000, 1000):
+                    snpId = rand.choice(['rs' + str(position + rand.randint(0, 9)), '.', 'rs12;rs13',
+                                         'rs' + str(2 ** 33 + position)])
+                    alt = rand.choice(['A', 'C', 'G', 'T', 'A,T', 'G' * rand.randint(1, 300)])
+                    lines.append('\t'.join([chrom, str(position), snpId, 'C', alt, '50.0\tPASS\tDP=10\tGT\t0/1']))
+            fileName = write_synthetic_vcf(tempDir, lines=lines)
+            inputfile = vcffile.VcfFile(fileName)
+            expected = inputfile.get_all_snps_and_locations()
+            vcfshards.MIN_SHARD_BYTES = 1000
+            shards = vcfshards.get_shards(fileName, 5)
+            self.assertEqual(5, len(shards))
+            with open(fileName, 'rb') as srcFile:
+                text = srcFile.read()
+            self.assertEqual(len(text), shards[-1][1])
+            for index in range(len(shards)):
+                self.assertEqual('\n', text[shards[index][0] - 1])
+                if (index > 0):
+                    self.assertEqual(shards[index - 1][1], shards[index][0])
+            self.assertEqual(expected, inputfile.get_all_snps_and_locations(workers=3))
+            self.assertEqual(inputfile.get_all_snps_and_alleles(), inputfile.get_all_snps_and_alleles(workers=3))
+            vcfindex.VcfIndex(fileName).build()
+            shards = vcfshards.get_shards(fileName, 3)
+            self.assertEqual(3, len(shards))
+            self.assertTrue(text[shards[1][0]:].startswith('chr2\t1000\t'))
+            self.assertEqual(expected, inputfile.get_all_snps_and_locations(workers=3))
+        finally:
+            vcfshards.MIN_SHARD_BYTES = minShardBytes
+            shutil.rmtree(tempDir)
+
+    def test_genome_cache(self):
+        '''
+        The genome cache should give back what parsing the file gives, be
+        missed when the file changes and drop the least recently used files
+        when it's over its size.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            lines = SYNTHETICLINES + ['chrX\t30000\trs12;rs13\tC\tT,G\t50.0\tPASS\tDP=10\tGT\t1/2']
+            fileName = write_synthetic_vcf(tempDir, lines=lines)
+            inputfile = vcffile.VcfFile(fileName)
+            expectedAlleles = inputfile.get_all_snps_and_alleles()
+            expectedLocations = inputfile.get_all_snps_and_locations()
+            cache = genomecache.GenomeCache(os.path.join(tempDir, 'cache'))
+            self.assertEqual(None, cache.load(fileName))
+            genomecache.set_enabled(True)
+            genomecache.cacheDir = cache.cacheDirectory
+            try:
+                self.assertEqual(expectedAlleles, inputfile.get_all_snps_and_alleles())
+                self.assertNotEqual(None, cache.load(fileName))
+                self.assertEqual(expectedAlleles, inputfile.get_all_snps_and_alleles())
+                self.assertEqual(expectedLocations, inputfile.get_all_snps_and_locations())
+                self.assertEqual('rs12;rs13', cache.load(fileName).get_snp_id(5))
+                #a changed file has a different cache file
+                os.utime(fileName, (1000000000, 1000000000))
+                self.assertEqual(None, cache.load(fileName))
+                otherFileName = write_synthetic_vcf(tempDir, 'A9002', lines)
+                vcffile.VcfFile(otherFileName).get_all_snps_and_alleles()
+                cache.maxBytes = os.path.getsize(cache.get_cache_file_name(otherFileName))
+                #a file another worker removed as this one listed the cache is skipped
+                listdir = os.listdir
+                os.listdir = lambda directory: listdir(directory) + ['gone' + genomecache.CACHE_SUFFIX]
+                try:
+                    cache.evict()
+                finally:
+                    os.listdir = listdir
+                self.assertEqual(1, len(os.listdir(cache.cacheDirectory)))
+                self.assertNotEqual(None, cache.load(otherFileName))
+            finally:
+                genomecache.set_enabled(False)
+                genomecache.cacheDir = genomecache.DEFAULT_CACHE_DIR
+        finally:
+            shutil.rmtree(tempDir)
+
 
 class TestRiskSnps(unittest.TestCase):
     '''
@@ -79,15 +496,12 @@ class TestRiskSnps(unittest.TestCase):
 
     def test_read_from_file(self):
         '''
-        RiskSnps.read_from_file should fill in the snps with the expected risk snps.
+        risksnps.read_from_file should return the expected risk snps.
 
         Here we use a known risk snps file and compare what is read in to what is expected.
         '''
-        riskSnpsExpected = risksnps.RiskSnps()
-        riskSnpsExpected.set_snps(['rs1998598','rs2549794','rs2797685'])
-        riskSnpsExpected.set_alleles(['G','C', 'A'])
-        riskSnpAllelesActual = risksnps.RiskSnps()
-        riskSnpAllelesActual.read_from_file(SOURCEFILENAMEDEFAULT)
+        riskSnpsExpected = risksnps.RiskSnps(['rs1998598','rs2549794','rs2797685'], ['G','C', 'A'])
+        riskSnpAllelesActual = risksnps.read_from_file(SOURCEFILENAMEDEFAULT)
         self.assertEqual(71, riskSnpAllelesActual.len())
         self.assertEqual(riskSnpsExpected.get_snp(0), riskSnpAllelesActual.get_snp(0))
         self.assertEqual(riskSnpsExpected.get_allele(0), riskSnpAllelesActual.get_allele(0))
@@ -96,13 +510,59 @@ class TestRiskSnps(unittest.TestCase):
         self.assertEqual(riskSnpsExpected.get_snp(2), riskSnpAllelesActual.get_snp(2))
         self.assertEqual(riskSnpsExpected.get_allele(2), riskSnpAllelesActual.get_allele(2))
 
+    def test_snp_index(self):
+        '''
+        RiskSnps should keep the snpId to index and snpId to (allele, odds ratio)
+        dictionaries up to date as the snps and alleles are set.
+        '''
+        riskSnps = risksnps.RiskSnps(['rs102275', 'rs3764147', 'rs102275'], ['C', 'G', 'T'])
+        self.assertEqual(0, riskSnps.get_index('rs102275'))
+        self.assertEqual(1, riskSnps.get_index('rs3764147'))
+        self.assertEqual(-1, riskSnps.get_index('rsnotthere'))
+        self.assertEqual(('G', None), riskSnps.riskAlleleMap['rs3764147'])
+
+    def test_panel_memo(self):
+        '''
+        risksnps.read_from_file should parse a file once and share the one
+        read only panel, with its typed columns, until the file changes.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            panelFileName = os.path.join(tempDir, 'panel.csv')
+            with open(panelFileName, 'w') as destFile:
+                destFile.write('dbSNP ID,Risk Allele,OddsRatio\nrs102275,C,1.5\nrs3764147,AT,\n')
+            first = risksnps.read_from_file(panelFileName)
+            second = risksnps.read_from_file(panelFileName)
+            self.assertTrue(first is second)
+            self.assertEqual(('rs102275', 'rs3764147'), second.snps)
+            self.assertEqual(('1.5', ''), second.oddsratio)
+            self.assertRaises(AttributeError, setattr, second, 'oddsratio', ['2.0', '3.0'])
+            self.assertTrue(isinstance(second.snps, tuple))
+            self.assertEqual([2, 0], list(second.alleleCodes))
+            self.assertEqual(vcffile.get_allele_numbers(['C', 'G'], second.alleles),
+                             vcffile.get_allele_numbers(['C', 'G'], second.alleleCodes))
+            self.assertEqual(1.5, second.oddsRatios[0])
+            self.assertTrue(math.isnan(second.oddsRatios[1]))
+            #a set makes a new panel and leaves the shared one as it was
+            changed = second.set_odds_ratios(['2.0', '3.0'])
+            self.assertEqual([2.0, 3.0], list(changed.oddsRatios))
+            self.assertEqual(('C', '2.0'), changed.riskAlleleMap['rs102275'])
+            self.assertEqual(('1.5', ''), first.oddsratio)
+            self.assertEqual(1.5, first.oddsRatios[0])
+            self.assertNotEqual(first.get_key(), changed.get_key())
+            os.utime(panelFileName, (1000000000, 1000000000))
+            third = risksnps.read_from_file(panelFileName)
+            self.assertFalse(third is first)
+            self.assertEqual(first.snps, third.snps)
+            self.assertRaises(IOError, risksnps.read_from_file, os.path.join(tempDir, 'missing.csv'))
+        finally:
+            shutil.rmtree(tempDir)
+
     def test_vcffile_get_these_risksnps(self):
         '''
         VcfFile.get_these_risksnps should return the alleles for the specified snps
         '''
-        riskSnps = risksnps.RiskSnps()
-        riskSnps.set_snps(['rs102275', 'rs3764147', 'rs7927997', 'rs415890', 'rs4077515', 'rs3810936', 'rs2476601', 'rs3792109'])
-        riskSnps.set_alleles(['C','G','T','C','T','C','G','A'])
+        riskSnps = risksnps.RiskSnps(['rs102275', 'rs3764147', 'rs7927997', 'rs415890', 'rs4077515', 'rs3810936', 'rs2476601', 'rs3792109'], ['C','G','T','C','T','C','G','A'])
         snpDataFile = vcffile.VcfFile(SAMPLEFILENAME)
         alleles = snpDataFile.get_these_risksnps(riskSnps)
         self.assertEqual(riskSnps.len(), len(alleles))
@@ -127,8 +587,7 @@ class TestRiskSnpTable(unittest.TestCase):
         '''
         table = risksnptable.RiskSnpTable()
         #these are some snps that I know are in the sample file 
-        table.riskSnps.set_snps(['rs7553640', 'rsnotinfile', 'rs2072928', 'rsalsonotthere', 'rs28640257'])
-        table.riskSnps.set_alleles(['C', 'T', 'G', 'C', 'G'])
+        table.riskSnps = risksnps.RiskSnps(['rs7553640', 'rsnotinfile', 'rs2072928', 'rsalsonotthere', 'rs28640257'], ['C', 'T', 'G', 'C', 'G'])
         personline = table.get_one_person_from_file(SAMPLEFILENAME)
         print "personline: " + str(personline) + "\n"
         
@@ -153,7 +612,871 @@ class TestRiskSnpTable(unittest.TestCase):
         self.assertEqual('rs1998598', headerCols[1])
         self.assertEqual('rs2549794', headerCols[2])
         #self.assertTrue(headerLine.find("PersonId, rs1998598, rs2549794") == 0)
+
+    def test_add_all(self):
+        '''
+        RiskSnpTable.add_all should write one row per person in person id order,
+        the same with a pool of workers as without.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputDir = os.path.join(tempDir, 'vcfdata') + '/'
+            os.mkdir(inputDir)
+            personIds = write_synthetic_cohort(inputDir, 4)
+            outputFileNames = []
+            for workers in [1, 2]:
+                outputFileName = os.path.join(tempDir, 'risksnptable' + str(workers) + '.csv')
+                table = risksnptable.RiskSnpTable(inputDir, outputFileName)
+                table.riskSnps = risksnps.RiskSnps(['rs58108140', 'rs102275', 'rs7927997'], ['A', 'C', 'T'])
+                table.add_all(workers=workers)
+                outputFileNames.append(outputFileName)
+            lines = read_file(outputFileNames[0]).splitlines()
+            self.assertEqual('PersonId,rs58108140,rs102275,rs7927997', lines[0])
+            self.assertEqual(personIds, [line.split(',')[0] for line in lines[1:]])
+            self.assertEqual('A9010,0,4,4', lines[1])
+            self.assertEqual(read_file(outputFileNames[0]), read_file(outputFileNames[1]))
+        finally:
+            shutil.rmtree(tempDir)
         
+class TestTallTable(unittest.TestCase):
+    '''
+    The TallTable classes should create a table with one row per person and snp.
+    '''
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        print self.__class__.__name__ 
+        self.tempDir = tempfile.mkdtemp()
+        self.inputDir = os.path.join(self.tempDir, 'vcfdata') + '/'
+        os.mkdir(self.inputDir)
+        write_synthetic_cohort(self.inputDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+        unittest.TestCase.tearDown(self)
+
+    def test_add_all(self):
+        '''
+        TallTable.add_all should write the people in person id order, the same
+        with a pool of workers as without.
+        '''
+        outputFileName = os.path.join(self.tempDir, 'talltable.csv')
+        table = talltable.TallTable(self.inputDir, outputFileName)
+        table.add_all()
+        lines = read_file(outputFileName).splitlines()
+        self.assertEqual('personid,snpid,allele', lines[0])
+        self.assertEqual('A9010,rs75062661,G', lines[1])
+        self.assertEqual(14, len(lines))
+        self.assertEqual('A9012', lines[-1].split(',')[0])
+        parallelFileName = os.path.join(self.tempDir, 'talltable2.csv')
+        talltable.TallTable(self.inputDir, parallelFileName).add_all(workers=2, window=1)
+        self.assertEqual(read_file(outputFileName), read_file(parallelFileName))
+
+    def test_risk_snp_add_all(self):
+        '''
+        RiskSnpTallTable.add_all should write only the risk snps, the same with
+        a pool of workers as without.
+        '''
+        outputFileNames = []
+        for workers in [1, 3]:
+            outputFileName = os.path.join(self.tempDir, 'risk' + str(workers) + '.csv')
+            table = talltable.RiskSnpTallTable(self.inputDir, outputFileName)
+            table.riskSnps = risksnps.RiskSnps(['rs102275', 'rs7927997'], ['C', 'T'], ['1.1', '1.2'])
+            table.add_all(workers=workers)
+            outputFileNames.append(outputFileName)
+        lines = read_file(outputFileNames[0]).splitlines()
+        self.assertEqual('index,personid,snpid,allele,oddsratio', lines[0])
+        self.assertEqual('0,A9010,rs102275,4,1.1', lines[1])
+        self.assertEqual(read_file(outputFileNames[0]), read_file(outputFileNames[1]))
+
+    def test_format_rows(self):
+        '''
+        csvrows.format_rows should write the same text as csv.DictWriter,
+        quoting alleles like A,G, and TallTable should write it for them.
+        '''
+        rows = [['A9010', 'rs1', 'A,G'], [0, 'A9010', 'rs2', 'T', '1.1'], ['say "hi"', 'a\nb', 'a\rb'],
+                [1.5, None, 7L, ''], [''], ['', ''], []]
+        expected = StringIO.StringIO()
+        writer = csv.writer(expected, lineterminator='\n')
+        for row in rows:
+            writer.writerow(row)
+        self.assertEqual(expected.getvalue(), csvrows.format_rows(rows))
+        write_synthetic_vcf(self.inputDir, 'A9020', SYNTHETICLINES + [
+            'chrX\t30000\trs9999999\tC\tT,G\t50.0\tPASS\tDP=10\tGT\t1/2'])
+        outputFileName = os.path.join(self.tempDir, 'talltable.csv')
+        table = talltable.TallTable(self.inputDir, outputFileName)
+        table.add_all()
+        expected = StringIO.StringIO()
+        writer = csv.DictWriter(expected, fieldnames=table.get_column_names(), lineterminator='\n')
+        writer.writeheader()
+        for srcFileName in cohort.get_sorted_file_names(self.inputDir):
+            for row in table.get_one_person_rows(srcFileName):
+                writer.writerow(dict(zip(table.get_column_names(), row)))
+        self.assertEqual(expected.getvalue(), read_file(outputFileName))
+        self.assertTrue('A9020,rs9999999,"T,G"' in read_file(outputFileName))
+
+    def test_output_formats(self):
+        '''
+        The tall tables should write the same table as gzip csv and as typed,
+        dictionary encoded columns.
+        '''
+        csvFileName = os.path.join(self.tempDir, 'risk.csv')
+        tables = []
+        for outputFormat in [tablesink.FORMAT_CSV, tablesink.FORMAT_CSV_GZIP, tablesink.FORMAT_NPZ]:
+            table = talltable.RiskSnpTallTable(self.inputDir, csvFileName, outputFormat)
+            table.riskSnps = risksnps.RiskSnps(['rs102275', 'rs7927997'], ['C', 'T'], ['1.1', ''])
+            table.add_all()
+            tables.append(table.filename)
+        self.assertEqual(['risk.csv', 'risk.csv.gz', 'risk.npz'], [os.path.basename(name) for name in tables])
+        gzipFile = gzip.open(tables[1], 'rb')
+        self.assertEqual(read_file(tables[0]), gzipFile.read())
+        gzipFile.close()
+        with open(tables[0], 'r') as srcFile:
+            rows = list(csv.reader(srcFile))
+        columns = tablesink.read_npz(tables[2])
+        self.assertEqual(set(rows[0]), set(columns))
+        for index in range(len(rows[0])):
+            fieldName = rows[0][index]
+            values = [row[index] for row in rows[1:]]
+            if (fieldName == talltable.FIELD_ODDSRATIO):
+                self.assertEqual([float(value) if value else 'nan' for value in values],
+                                 [value if value == value else 'nan' for value in columns[fieldName]])
+            elif (fieldName in [talltable.FIELD_INDEX, talltable.FIELD_ALLELE]):
+                self.assertEqual([int(value) for value in values], list(columns[fieldName]))
+            else:
+                self.assertEqual(values, columns[fieldName])
+        #the blocks spilled to the columns' files come back in order
+        npzFileName = os.path.join(self.tempDir, 'blocks.npz')
+        with tablesink.open_sink(npzFileName, ['id', 'count'], [tablesink.TYPE_STR, tablesink.TYPE_INT],
+                                 tablesink.FORMAT_NPZ) as sink:
+            for block in range(3):
+                sink.write_rows([['p' + str(index % 4), index] for index in range(block * 5, block * 5 + 5)])
+            self.assertEqual([range(0, 4), range(4, 8), range(8, 12), range(12, 15)],
+                             [list(values) for values in sink.columns[1].iter_blocks(4)])
+        columns = tablesink.read_npz(npzFileName)
+        self.assertEqual(range(15), list(columns['count']))
+        self.assertEqual(['p' + str(index % 4) for index in range(15)], columns['id'])
+
+    def test_pipeline(self):
+        '''
+        The pipeline stages should compose into the same rows the table
+        presets write, and select_people should read only those people and
+        raise IOError for a person with no file.
+        '''
+        table = talltable.RiskSnpTallTable(self.inputDir, os.path.join(self.tempDir, 'risk.csv'))
+        table.riskSnps = risksnps.RiskSnps(['rs102275', 'rs7927997', 'rs58108140'], ['C', 'T', 'G'], ['1.1', '1.2', '1.3'])
+        srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        genotypes = pipeline.read_cohort(srcFileNames)
+        genotypes = pipeline.restrict_to_panel(genotypes, table.riskSnps)
+        genotypes = pipeline.encode_alleles(genotypes, table.riskSnps)
+        genotypes = pipeline.drop_missing(genotypes)
+        rows = list(pipeline.to_rows(genotypes, table.get_genotype_row))
+        expected = []
+        for srcFileName in srcFileNames:
+            expected.extend(table.get_one_person_rows(srcFileName))
+        self.assertEqual(sorted(expected), sorted(rows))
+        self.assertEqual(['A9012', 'A9010'], [os.path.basename(name)[:5] for name in
+                                              pipeline.select_people(srcFileNames, ['A9012', 'A9010'])])
+        self.assertRaises(IOError, list, pipeline.select_people(srcFileNames, ['A9012', 'A9999', 'A9010']))
+        outputFileName = os.path.join(self.tempDir, 'some.csv')
+        for workers in [1, 2]:
+            tallsomeppl.TallSomePeople(self.inputDir, outputFileName).add_some(['A9011'], workers)
+            lines = read_file(outputFileName).splitlines()
+            self.assertEqual(5, len(lines))
+            self.assertEqual(['A9011'], list(set([line.split(',')[0] for line in lines[1:]])))
+
+
+class TestGenotypeMatrix(unittest.TestCase):
+    '''
+    Tests for the GenotypeMatrix class and the tables built on it.
+    '''
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        print self.__class__.__name__ 
+        self.tempDir = tempfile.mkdtemp()
+        self.inputDir = os.path.join(self.tempDir, 'vcfdata') + '/'
+        os.mkdir(self.inputDir)
+        self.personIds = write_synthetic_cohort(self.inputDir, 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+        unittest.TestCase.tearDown(self)
+
+    def test_add_person_alleles(self):
+        '''
+        GenotypeMatrix should code alleles as small integers, 0 for missing, and
+        read short rows as missing for the snps added after them.
+        '''
+        matrix = genotypematrix.GenotypeMatrix()
+        matrix.add_person_alleles('A1', [['rs1', 'A'], ['rs2', 'C']])
+        matrix.add_person_alleles('A2', [['rs3', 'A'], ['rs1', 'G']])
+        self.assertEqual(['rs1', 'rs2', 'rs3'], matrix.snpIds)
+        self.assertEqual('B', matrix.rows[0].typecode)
+        self.assertEqual([1, 2, 0], list(matrix.get_row(0)))
+        self.assertEqual([3, 0, 1], list(matrix.get_row(1)))
+        self.assertEqual('0', matrix.get_allele(0, 'rs3'))
+        self.assertEqual([('rs1', 'G'), ('rs3', 'A')], list(matrix.iter_snps_and_alleles(1)))
+        #more than 255 alleles widen the rows
+        matrix.add_person_alleles('A3', [['rs' + str(number), 'A' * number] for number in range(300)])
+        self.assertEqual('H', matrix.rows[0].typecode)
+        self.assertEqual([1, 2, 0], list(matrix.get_row(0))[:3])
+        self.assertEqual('A' * 299, matrix.get_allele(2, 'rs299'))
+
+    def test_get_difference_counts(self):
+        '''
+        GenotypeMatrix.get_difference_counts should count the snps where each pair
+        of rows differ, for one and two byte codes.
+        '''
+        rand = random.Random(7)
+        for alleleCount in [4, 300]:
+            matrix = genotypematrix.GenotypeMatrix()
+            for personNumber in range(5):
+                snpsAndAlleles = []
+                for snpNumber in range(rand.randint(0, 400)):
+                    if (rand.random() < 0.5):
+                        snpsAndAlleles.append(['rs' + str(snpNumber), str(rand.randint(1, alleleCount))])
+                matrix.add_person_alleles('A' + str(personNumber), snpsAndAlleles)
+            counts = matrix.get_difference_counts()
+            for personIndex in range(5):
+                for compareIndex in range(5):
+                    row = matrix.get_row(personIndex)
+                    compareRow = matrix.get_row(compareIndex)
+                    expected = len([column for column in range(len(row)) if row[column] != compareRow[column]])
+                    self.assertEqual(expected, counts[personIndex][compareIndex])
+        self.assertEqual('H', matrix.typecode)
+
+    def test_difference_counts(self):
+        '''
+        DifferenceCounts.create_file should count the same differences as
+        count_diffs does on each pair's sorted snps and alleles.
+        '''
+        outputFileName = os.path.join(self.tempDir, 'diffcounts.csv')
+        diffs = differencecounts.DifferenceCounts(self.inputDir, outputFileName)
+        diffs.create_file()
+        people = {}
+        for srcFileName in vcffile.get_vcf_file_names(self.inputDir):
+            srcFile = vcffile.VcfFile(self.inputDir + srcFileName)
+            people[srcFile.get_person_id()] = sorted(srcFile.get_all_snps_and_alleles())
+        with open(outputFileName, 'r') as srcFile:
+            rows = list(csv.DictReader(srcFile))
+        self.assertEqual(len(self.personIds), len(rows))
+        for row in rows:
+            personId = row[differencecounts.FIELD_PERSONID]
+            for comparePerson in self.personIds:
+                expected = diffs.count_diffs(people[personId], people[comparePerson])
+                self.assertEqual(str(expected), row[comparePerson])
+
+    def test_repeated_snps(self):
+        '''
+        A file with more than one line for a snp should have every line
+        counted, as the merge of two people's sorted snps counts them, from
+        one person and multi sample files.
+        '''
+        repeatDir = os.path.join(self.tempDir, 'repeats') + '/'
+        os.mkdir(repeatDir)
+        people = {'A9201': [['rs1', 'G'], ['rs1', 'T'], ['rs2', 'C']],
+                  'A9202': [['rs1', 'T'], ['rs2', 'C']],
+                  'A9203': [['rs1', 'G'], ['rs1', 'G']],
+                  'A9204': [['rs1', 'G'], ['rs2', 'C'], ['rs2', 'A'], ['rs2', 'C']]}
+        for personId in people:
+            write_synthetic_vcf(repeatDir, personId, SYNTHETICLINES[:5] +
+                                ['chr1\t' + str(int(snpId[2:]) * 100) + '\t' + snpId + '\tA\t' + allele +
+                                 '\t50.0\tPASS\tDP=10\tGT\t0/1' for snpId, allele in people[personId]])
+        multiLines = MULTISAMPLELINES + ['chr2\t12000\trs102275\tT\tA\t50.0\tPASS\tDP=10\tGT\t1/1\t0/0\t1/1']
+        multiData = vcffile.VcfFile(write_synthetic_vcf(repeatDir, 'A9100', multiLines))
+        sampleNames = multiData.get_sample_names()
+        for sampleName in sampleNames:
+            people[sampleName] = []
+        for record, alleles in multiData.iter_sample_alleles():
+            for sampleIndex in range(len(sampleNames)):
+                if (alleles[sampleIndex] != '0'):
+                    people[sampleNames[sampleIndex]].append([record.id, alleles[sampleIndex]])
+        self.assertEqual(1, count_diffs_by_merge(people['A9203'], [['rs1', 'G']]))
+        outputFileName = os.path.join(self.tempDir, 'repeats.csv')
+        differencecounts.DifferenceCounts(repeatDir, outputFileName).create_file()
+        with open(outputFileName, 'r') as srcFile:
+            rows = list(csv.DictReader(srcFile))
+        self.assertEqual(len(people), len(rows))
+        for row in rows:
+            personId = row[differencecounts.FIELD_PERSONID]
+            for comparePerson in people:
+                expected = count_diffs_by_merge(sorted(people[personId]), sorted(people[comparePerson]))
+                self.assertEqual(str(expected), row[comparePerson])
+        matrix = genotypematrix.GenotypeMatrix()
+        for personId in ['A9201', 'A9202', 'A9203']:
+            matrix.add_person_alleles(personId, people[personId])
+        self.assertEqual([[0, 2, 2], [2, 0, 3], [2, 3, 0]], matrix.get_difference_counts())
+
+    def test_risk_snp_compare(self):
+        '''
+        RiskSnpCompare should count the same pairs from RiskSnpTable's matrix as
+        from the table it wrote.
+        '''
+        table = risksnptable.RiskSnpTable(self.inputDir, os.path.join(self.tempDir, 'risksnptable.csv'))
+        table.riskSnps = risksnps.RiskSnps(['rs58108140', 'rs102275', 'rs7927997', 'rs3764147'], ['A', 'C', 'T', 'G'])
+        table.add_all()
+        fromFile = risksnptable.RiskSnpCompare(table.filename).getSameCounts()
+        fromMatrix = risksnptable.RiskSnpCompare(matrix=table.matrix).getSameCounts()
+        self.assertEqual(fromFile, fromMatrix)
+        self.assertEqual(3, fromMatrix['rs102275']['rs102275'])
+        self.assertEqual(2, fromMatrix['rs102275']['rs7927997'])
+        compare = risksnptable.RiskSnpCompare(matrix=table.matrix,
+                                              outputDiffsName=os.path.join(self.tempDir, 'wide.csv'),
+                                              outputTallName=os.path.join(self.tempDir, 'tall.csv'))
+        compare.write_tall_and_wide_compares()
+        wideLines = read_file(compare.diffsFileName).splitlines()
+        self.assertEqual('snpId,rs58108140,rs102275,rs7927997,rs3764147', wideLines[0])
+        expected = [str(fromMatrix['rs102275'][snpId]) for snpId in table.riskSnps.snps]
+        self.assertEqual('rs102275,' + ','.join(expected), wideLines[2])
+        tallLines = read_file(compare.diffsTallName).splitlines()
+        self.assertTrue('rs102275,rs7927997,2' in tallLines)
+        self.assertEqual(len([1 for snpId in fromMatrix for count in fromMatrix[snpId].values() if count]),
+                         len(tallLines) - 1)
+
+    def test_get_cooccurrence_counts(self):
+        '''
+        GenotypeMatrix.get_cooccurrence_counts should count the people who have
+        the code for both of each pair of snps.
+        '''
+        rand = random.Random(11)
+        matrix = genotypematrix.GenotypeMatrix(['rs' + str(number) for number in range(40)],
+                                               genotypematrix.RISK_CODES)
+        for personNumber in range(70):
+            matrix.add_person_codes('A' + str(personNumber), [rand.randint(0, 4) for column in range(40)])
+        counts = matrix.get_cooccurrence_counts(4)
+        for columnA in range(40):
+            for columnB in range(40):
+                expected = len([row for row in matrix.rows if row[columnA] == 4 and row[columnB] == 4])
+                self.assertEqual(expected, counts[columnA][columnB])
+
+    def test_tall_table_from_matrix(self):
+        '''
+        TallTable.add_all should write the same rows from a GenotypeMatrix as
+        from the files when the people have their snps in the same order.
+        '''
+        srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        matrix = genotypematrix.build_allele_matrix(srcFileNames)
+        fromFiles = os.path.join(self.tempDir, 'fromfiles.csv')
+        talltable.TallTable(self.inputDir, fromFiles).add_all()
+        fromMatrix = os.path.join(self.tempDir, 'frommatrix.csv')
+        talltable.TallTable(self.inputDir, fromMatrix).add_all(matrix=matrix)
+        self.assertEqual(sorted(read_file(fromFiles).splitlines()),
+                         sorted(read_file(fromMatrix).splitlines()))
+
+    def test_multi_sample(self):
+        '''
+        A multi sample vcf file should give each sample the alleles of its GT
+        field, and make the same matrices and tall table rows as the same
+        people in one person files.
+        '''
+        sampleNames = MULTISAMPLENAMES
+        multiDir = os.path.join(self.tempDir, 'multi') + '/'
+        os.mkdir(multiDir)
+        multiFileName = write_multi_sample_vcf(multiDir)
+        srcData = vcffile.VcfFile(multiFileName)
+        self.assertTrue(srcData.is_multi_sample())
+        self.assertFalse(vcffile.VcfFile(write_synthetic_vcf(self.tempDir)).is_multi_sample())
+        self.assertEqual(sampleNames, srcData.get_sample_names())
+        self.assertEqual(['A', 'A', '0'], vcffile.decode_samples('GT:DP', ['0/1:5', '1|1:7', './.:0'], 'A'))
+        self.assertEqual(['C,G', '0', 'G'], vcffile.decode_samples('GT:DP', ['1/2:5', '0/0:5', '2/2:5'], 'C,G'))
+        sampleAlleles = [(record.id, alleles) for record, alleles in srcData.iter_sample_alleles()]
+        self.assertEqual(['rs58108140', 'rs102275', 'rs3764147', 'rs7927997'], [snpId for snpId, alleles in sampleAlleles])
+        self.assertEqual(['G', '0', '0'], sampleAlleles[2][1])
+        #the same people, one file each with the snps they have
+        singleDir = os.path.join(self.tempDir, 'single') + '/'
+        os.mkdir(singleDir)
+        for sampleIndex in range(len(sampleNames)):
+            personLines = SYNTHETICLINES[:5]
+            for record, alleles in srcData.iter_sample_alleles():
+                if (alleles[sampleIndex] != '0'):
+                    personLines.append('\t'.join([record.chrom, record.pos, record.id, record.ref,
+                                                   alleles[sampleIndex], '50.0\tPASS\tDP=10\tGT\t0/1']))
+            write_synthetic_vcf(singleDir, sampleNames[sampleIndex], personLines)
+        multiFileNames = cohort.get_sorted_file_names(multiDir)
+        singleFileNames = cohort.get_sorted_file_names(singleDir)
+        riskSnps = risksnps.RiskSnps(['rs58108140', 'rs102275', 'rs7927997', 'rs3764147'], ['A', 'G', 'T', 'G'])
+        for workers in [1, 2]:
+            fromMulti = genotypematrix.build_risk_snp_matrix(multiFileNames, riskSnps, workers)
+            fromSingle = genotypematrix.build_risk_snp_matrix(singleFileNames, riskSnps, workers)
+            self.assertEqual(sampleNames, fromMulti.personIds)
+            self.assertEqual(map(list, fromSingle.rows), map(list, fromMulti.rows))
+            fromMulti = genotypematrix.build_allele_matrix(multiFileNames, workers)
+            fromSingle = genotypematrix.build_allele_matrix(singleFileNames, workers)
+            self.assertEqual(sampleNames, fromMulti.personIds)
+            for personIndex in range(len(sampleNames)):
+                self.assertEqual(sorted(fromSingle.iter_snps_and_alleles(personIndex)),
+                                 sorted(fromMulti.iter_snps_and_alleles(personIndex)))
+        riskMatrix = genotypematrix.build_risk_snp_matrix(multiFileNames, riskSnps)
+        self.assertEqual([[4, 0, 4, 4], [4, 0, 4, 0], [0, 4, 0, 0]], map(list, riskMatrix.rows))
+        #a snp listed twice is numbered for each of its risk alleles
+        riskSnps = risksnps.RiskSnps(['rs58108140', 'rs102275', 'rs58108140'], ['A', 'G', 'G'])
+        alleles = srcData.get_these_risksnps_by_sample(riskSnps)
+        self.assertEqual(['4', '4', '0'], [sampleNumbers[0] for sampleNumbers in alleles])
+        self.assertEqual(['1', '1', '0'], [sampleNumbers[2] for sampleNumbers in alleles])
+        tables = []
+        for inputDir, workers in [(multiDir, 1), (multiDir, 2), (singleDir, 1)]:
+            fileName = os.path.join(self.tempDir, 'tall' + str(len(tables)) + '.csv')
+            talltable.TallTable(inputDir, fileName).add_all(workers)
+            tables.append(sorted(read_file(fileName).splitlines()))
+        self.assertEqual(tables[0], tables[1])
+        self.assertEqual(tables[0], tables[2])
+
+    def test_dosages(self):
+        '''
+        The dosages should count the copies of the risk allele in each GT,
+        for one person and multi sample files, and sum over the cohort.
+        '''
+        self.assertEqual(1, vcffile.get_gt_dosage('0/1', ['G', 'A'], 'A'))
+        self.assertEqual(2, vcffile.get_gt_dosage('1|1', ['G', 'A'], 'A'))
+        self.assertEqual(0, vcffile.get_gt_dosage('1/1', ['G', 'A'], 'C'))
+        self.assertEqual(2, vcffile.get_gt_dosage('0/0', ['G', 'A'], 'G'))
+        self.assertEqual(1, vcffile.get_gt_dosage('1/2', ['T', 'C', 'G'], 'G'))
+        self.assertEqual(vcffile.DOSAGE_MISSING, vcffile.get_gt_dosage('./.', ['G', 'A'], 'A'))
+        self.assertEqual(vcffile.DOSAGE_MISSING, vcffile.get_gt_dosage('', ['G', 'A'], 'A'))
+        riskSnps = risksnps.RiskSnps(['rs58108140', 'rs102275', 'rs7927997', 'rs3764147', 'rs1'], ['A', 'G', 'T', 'G', 'A'])
+        write_multi_sample_vcf(self.inputDir)
+        srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        for workers in [1, 2]:
+            matrix = genotypematrix.build_dosage_matrix(srcFileNames, riskSnps, workers)
+            self.assertEqual(self.personIds + MULTISAMPLENAMES, matrix.personIds)
+            self.assertEqual('b', matrix.rows[0].typecode)
+            self.assertEqual([[1, 1, 1, 2, -1], [2, 0, 1, 0, -1], [-1, 2, 0, -1, -1]],
+                             map(list, matrix.rows[-3:]))
+        #a one person file's GT counts the alt allele only when it's the risk allele
+        self.assertEqual([1, 0, 0, 2, -1], list(matrix.rows[1]))
+        rows = map(list, matrix.rows)
+        for column in range(matrix.snp_count()):
+            dosages = [row[column] for row in rows if row[column] != vcffile.DOSAGE_MISSING]
+            self.assertEqual(sum(dosages), matrix.get_dosage_sums()[column])
+            self.assertEqual(len(dosages), matrix.get_called_counts()[column])
+        self.assertEqual([sum([dosage for dosage in row if dosage > 0]) for row in rows],
+                         matrix.get_person_dosage_sums())
+        riskMatrix = matrix.get_risk_matrix()
+        self.assertEqual([4, 0, 4, 0, 0], list(riskMatrix.get_row(5)))
+        self.assertEqual(matrix.personIds, riskMatrix.personIds)
+        self.assertEqual('4', riskMatrix.get_allele(4, 'rs58108140'))
+
+    def test_risk_scores(self):
+        '''
+        RiskScoreTable should score everyone for each panel in one pass: the
+        sum of their risk allele dosages times the log odds ratios.
+        '''
+        panelFileNames = []
+        panelRows = [[['rs58108140', 'A', '2.0'], ['rs102275', 'G', '1.5'], ['rs7927997', 'T', 'NA']],
+                     [['rs102275', 'C', '0.5'], ['rs3764147', 'G', '3.0'], ['rs58108140', 'A', '2.0']]]
+        for panelIndex in range(len(panelRows)):
+            panelFileName = os.path.join(self.tempDir, 'panel' + str(panelIndex) + '.csv')
+            with open(panelFileName, 'w') as destFile:
+                destFile.write(','.join([risksnps.FIELD_SNP_ID, risksnps.FIELD_ALLELE, risksnps.FIELD_ODDS_RATIO]) + '\n')
+                for row in panelRows[panelIndex]:
+                    destFile.write(','.join(row) + '\n')
+            panelFileNames.append(panelFileName)
+        write_multi_sample_vcf(self.inputDir)
+        tableFileName = os.path.join(self.tempDir, 'riskscores.csv')
+        table = riskscores.RiskScoreTable(self.inputDir, tableFileName, panelFileNames)
+        table.add_all(workers=2)
+        with open(tableFileName, 'r') as srcFile:
+            rows = list(csv.DictReader(srcFile))
+        self.assertEqual(self.personIds + MULTISAMPLENAMES, [row['PersonId'] for row in rows])
+        #the samples' dosages are in test_dosages, the panels share rs58108140
+        self.assertAlmostEqual(math.log(2.0) + math.log(1.5), float(rows[4]['panel0_score']))
+        self.assertEqual('2', rows[4]['panel0_called'])
+        self.assertAlmostEqual(math.log(0.5) + 2 * math.log(3.0) + math.log(2.0), float(rows[4]['panel1_score']))
+        self.assertAlmostEqual(2 * math.log(2.0), float(rows[5]['panel0_score']))
+        self.assertAlmostEqual(2 * math.log(2.0), float(rows[5]['panel1_score']))
+        self.assertAlmostEqual(2 * math.log(1.5), float(rows[6]['panel0_score']))
+        self.assertEqual(['3', '3', '1'], [rows[index]['panel1_called'] for index in [4, 5, 6]])
+        scorer = riskscores.RiskScorer(table.get_panels())
+        self.assertEqual(4, scorer.riskSnps.len())
+        matrix = genotypematrix.build_dosage_matrix(cohort.get_sorted_file_names(self.inputDir), scorer.riskSnps)
+        fromMatrix = scorer.score_matrix(matrix)
+        for index in range(len(rows)):
+            self.assertEqual([rows[index][fieldName] for fieldName in scorer.get_field_names()],
+                             csvrows.format_rows([fromMatrix[index]]).rstrip('\n').split(','))
+
+    def test_incremental(self):
+        '''
+        With incremental, adding a person should add their rows to the tables
+        and compare them with everyone, keeping the counts already in the
+        difference table, and a changed file should make the tables again.
+        '''
+        stagingDir = os.path.join(self.tempDir, 'staging') + '/'
+        os.mkdir(stagingDir)
+        for srcFileName in cohort.get_sorted_file_names(self.inputDir):
+            shutil.move(srcFileName, stagingDir)
+        stagedFileNames = cohort.get_sorted_file_names(stagingDir)
+        for srcFileName in stagedFileNames[:3]:
+            shutil.copy(srcFileName, self.inputDir)
+        tallFileName = os.path.join(self.tempDir, 'talltable.csv')
+        diffsFileName = os.path.join(self.tempDir, 'diffcounts.csv')
+        talltable.TallTable(self.inputDir, tallFileName).add_all(incremental=True)
+        diffs = differencecounts.DifferenceCounts(self.inputDir, diffsFileName)
+        diffs.create_file(incremental=True)
+        #a count only the table knows about shows the known counts are kept
+        personIds, counts = diffs.read_counts()
+        counts[0][1] = counts[1][0] = 99
+        with open(diffsFileName, 'w') as destFile:
+            destFile.write(','.join([differencecounts.FIELD_PERSONID] + personIds) + '\n')
+            for index in range(len(personIds)):
+                destFile.write(','.join([personIds[index]] + [str(count) for count in counts[index]]) + '\n')
+        #record the edited table in the manifest, or it's taken as a stopped run and made again
+        diffsManifest = manifest.Manifest(manifest.get_manifest_name(diffsFileName))
+        self.assertTrue(diffsManifest.load())
+        diffsManifest.save(diffsFileName)
+        shutil.copy(stagedFileNames[3], self.inputDir)
+        talltable.TallTable(self.inputDir, tallFileName).add_all(incremental=True)
+        diffs.create_file(incremental=True)
+        fullTallFileName = os.path.join(self.tempDir, 'fulltalltable.csv')
+        talltable.TallTable(self.inputDir, fullTallFileName).add_all()
+        self.assertEqual(read_file(fullTallFileName), read_file(tallFileName))
+        fullDiffs = differencecounts.DifferenceCounts(self.inputDir, os.path.join(self.tempDir, 'full.csv'))
+        fullDiffs.create_file()
+        fullIds, fullCounts = fullDiffs.read_counts()
+        personIds, counts = diffs.read_counts()
+        self.assertEqual(personIds[:3], [os.path.basename(name)[:5] for name in stagedFileNames[:3]])
+        for indexA in range(len(personIds)):
+            for indexB in range(len(personIds)):
+                expected = fullCounts[fullIds.index(personIds[indexA])][fullIds.index(personIds[indexB])]
+                if (sorted([indexA, indexB]) == [0, 1]):
+                    expected = 99
+                self.assertEqual(expected, counts[indexA][indexB])
+        #a changed file means everything is counted again
+        with open(stagedFileNames[0], 'r') as srcFile:
+            lines = srcFile.readlines()
+        with open(os.path.join(self.inputDir, os.path.basename(stagedFileNames[0])), 'w') as destFile:
+            destFile.write(''.join(lines[:-1]))
+        diffs.create_file(incremental=True)
+        self.assertNotEqual(99, diffs.read_counts()[1][0][1])
+
+    def test_incremental_stopped(self):
+        '''
+        With incremental, a run stopped after adding rows to the table but
+        before saving the manifest should make the table again next time
+        rather than add the same people twice.
+        '''
+        stagingDir = os.path.join(self.tempDir, 'staging') + '/'
+        os.mkdir(stagingDir)
+        for srcFileName in cohort.get_sorted_file_names(self.inputDir):
+            shutil.move(srcFileName, stagingDir)
+        stagedFileNames = cohort.get_sorted_file_names(stagingDir)
+        for srcFileName in stagedFileNames[:3]:
+            shutil.copy(srcFileName, self.inputDir)
+        tallFileName = os.path.join(self.tempDir, 'talltable.csv')
+        talltable.TallTable(self.inputDir, tallFileName).add_all(incremental=True)
+        shutil.copy(stagedFileNames[3], self.inputDir)
+        save = manifest.Manifest.save
+        def stop(self, tableFileName):
+            raise KeyboardInterrupt()
+        manifest.Manifest.save = stop
+        try:
+            self.assertRaises(KeyboardInterrupt, talltable.TallTable(self.inputDir, tallFileName).add_all, incremental=True)
+        finally:
+            manifest.Manifest.save = save
+        talltable.TallTable(self.inputDir, tallFileName).add_all(incremental=True)
+        fullTallFileName = os.path.join(self.tempDir, 'fulltalltable.csv')
+        talltable.TallTable(self.inputDir, fullTallFileName).add_all()
+        self.assertEqual(read_file(fullTallFileName), read_file(tallFileName))
+
+
+class TestSnpIds(unittest.TestCase):
+    '''
+    SnpIds should number rs ids by their digits and keep the other ids in a file.
+    '''
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        print self.__class__.__name__
+        self.tempDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.tempDir, 'snpids.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+        unittest.TestCase.tearDown(self)
+
+    def test_numbers(self):
+        '''
+        rs ids should be their numbers, other ids negative numbers that are
+        the same after the table is saved and loaded again, in any process.
+        '''
+        snpIds = snpids.SnpIds(self.fileName)
+        snpIds.load()
+        self.assertEqual(12028261, snpIds.get_number('rs12028261'))
+        self.assertEqual([-1, -2, -1], list(snpIds.get_numbers(['rs12;rs13', 'rs012', 'rs12;rs13'])))
+        self.assertEqual(-3, snpIds.get_number('rs' + str(2 ** 31)))
+        self.assertEqual(['rs5', 'rs12;rs13', 'rs012'], snpIds.get_ids([5, -1, -2]))
+        other = snpids.SnpIds(self.fileName)
+        other.load()
+        self.assertEqual(-2, other.get_number('rs012'))
+        self.assertEqual(-4, other.get_number('chr1:1234'))
+        #an id another process numbered first keeps its number, and isn't written twice
+        self.assertEqual([-5, -4], list(snpIds.get_numbers(['chr2:5', 'chr1:1234'])))
+        self.assertEqual('chr2:5', other.get_id(-5))
+        self.assertEqual(-5, other.get_number('chr2:5'))
+        self.assertEqual(5, len(read_file(self.fileName).splitlines()))
+        again = snpids.SnpIds(self.fileName)
+        again.load()
+        self.assertEqual(snpIds.otherIds, again.otherIds)
+        #a panel numbers its other ids in memory and leaves the file alone
+        riskSnps = risksnps.RiskSnps(['rs5', 'rs20;rs21', 'rsnotinfile', 'rs20;rs21'])
+        numbers = list(riskSnps.snpNumbers)
+        self.assertEqual(5, numbers[0])
+        self.assertTrue(numbers[1] < snpids.LOCAL_NUMBER_LIMIT)
+        self.assertEqual(numbers[1], numbers[3])
+        self.assertEqual(1, riskSnps.get_number_index(numbers[1]))
+        self.assertEqual(['rs5', 'rs20;rs21', 'rsnotinfile'], again.get_ids(numbers[:3]))
+        self.assertEqual('rsnotinfile', again.get_id(numbers[2]))
+        self.assertFalse(os.path.exists(snpids.fileName) and 'rsnotinfile' in read_file(snpids.fileName))
+        self.assertEqual(5, len(read_file(self.fileName).splitlines()))
+
+    def test_matrix_from_columns(self):
+        '''
+        A GenotypeMatrix should get the same rows from GenomeColumns, joined
+        on snp numbers, as from the snp id and allele strings.
+        '''
+        records = [vcffile.VcfRecord('chr1', '10', 'rs10', 'A', 'G'),
+                   vcffile.VcfRecord('chr1', '20', 'rs20;rs21', 'C', 'T'),
+                   vcffile.VcfRecord('chr2', '30', 'rs30', 'G', 'A')]
+        byNumber = genotypematrix.GenotypeMatrix()
+        byString = genotypematrix.GenotypeMatrix()
+        for person in [records, records[::-1][:2]]:
+            columns = genomecache.GenomeColumns()
+            columns.add_records(person)
+            byNumber.add_person_columns('A' + str(len(byNumber.rows)), columns)
+            byString.add_person_alleles('A' + str(len(byString.rows)), [[record.id, record.alt] for record in person])
+        self.assertEqual(byString.snpIds, byNumber.snpIds)
+        self.assertEqual(byString.alleles, byNumber.alleles)
+        self.assertEqual(byString.rows, byNumber.rows)
+        self.assertEqual(2, differencecounts.DifferenceCounts().count_diffs(
+            [[record.id, record.alt] for record in records], [['rs20;rs21', 'T'], ['rs30', 'C']]))
+
+    def test_merge_join(self):
+        '''
+        mergejoin.join should count the same, different and one sided snps
+        the same as a join on a dictionary, however the runs fall.
+        '''
+        rand = random.Random(3)
+        alleleCodes = mergejoin.AlleleCodes()
+        people = []
+        for personNumber in range(6):
+            #long runs both have and long runs only one has
+            snps = {}
+            for start in range(0, 5000, 500):
+                if (rand.random() < 0.7):
+                    for snpNumber in range(start, start + rand.randint(1, 500)):
+                        snps['rs' + str(snpNumber + 1)] = rand.choice('ACGT')
+            people.append(snps)
+        sortedPeople = [mergejoin.from_pairs(map(list, snps.items()), alleleCodes) for snps in people]
+        for left in range(len(people)):
+            counts = mergejoin.join_many(sortedPeople[left], sortedPeople)
+            for right in range(len(people)):
+                both = set(people[left]) & set(people[right])
+                same = len([snpId for snpId in both if people[left][snpId] == people[right][snpId]])
+                expected = mergejoin.JoinCounts(same, len(both) - same, len(people[left]) - len(both),
+                                                len(people[right]) - len(both))
+                self.assertEqual(expected, counts[right])
+        self.assertEqual(mergejoin.JoinCounts(0, 0, 0, 2), mergejoin.join(mergejoin.SortedSnps([], []),
+                                                                          mergejoin.SortedSnps([2, 1], [0, 0])))
+        self.assertEqual(3, mergejoin.gallop(array('i', [1, 2, 3, 7, 9]), 5, 0))
+
+
+class TestSimilarity(unittest.TestCase):
+    '''
+    similarity should compare every pair of people in a GenotypeMatrix.
+    '''
+
+    def test_pair_counts(self):
+        '''
+        get_pair_counts should count each pair the same as comparing their
+        codes one snp at a time, in blocks and on worker processes.
+        '''
+        rand = random.Random(5)
+        matrix = genotypematrix.GenotypeMatrix()
+        for personNumber in range(7):
+            snpsAndAlleles = [['rs' + str(snpNumber), rand.choice('ACG')] for snpNumber in range(300)
+                              if rand.random() < 0.8]
+            matrix.add_person_alleles('A' + str(personNumber), snpsAndAlleles)
+        rows = [matrix.get_row(personIndex) for personIndex in range(matrix.person_count())]
+        oneBlock = similarity.get_pair_counts(matrix)
+        for counts in [oneBlock, similarity.get_pair_counts(matrix, blockSize=3),
+                       similarity.get_pair_counts(matrix, workers=2, blockSize=2)]:
+            for personIndex in range(len(rows)):
+                for compareIndex in range(len(rows)):
+                    pairs = zip(rows[personIndex], rows[compareIndex])
+                    both = len([pair for pair in pairs if pair[0] and pair[1]])
+                    same = len([pair for pair in pairs if pair[0] and pair[0] == pair[1]])
+                    #the (snp, allele) pairs either has
+                    either = len([pair for pair in pairs if pair[0]]) + len([pair for pair in pairs if pair[1]]) - same
+                    self.assertEqual(len([pair for pair in pairs if pair[0] != pair[1]]),
+                                     counts.get_value(similarity.METRIC_HAMMING, personIndex, compareIndex))
+                    self.assertEqual(float(same) / both,
+                                     counts.get_value(similarity.METRIC_IBS, personIndex, compareIndex))
+                    self.assertEqual(float(same) / either,
+                                     counts.get_value(similarity.METRIC_JACCARD, personIndex, compareIndex))
+        self.assertEqual(matrix.get_difference_counts(),
+                         [oneBlock.get_row(similarity.METRIC_HAMMING, personIndex) for personIndex in range(len(rows))])
+
+    def test_similarity_table(self):
+        '''
+        SimilarityTable should write a table the shape of the DifferenceCounts
+        table, with the same counts for hamming, and its tall table.
+        '''
+        tempDir = tempfile.mkdtemp()
+        try:
+            inputDir = os.path.join(tempDir, 'vcfdata') + '/'
+            os.mkdir(inputDir)
+            personIds = write_synthetic_cohort(inputDir, 4)
+            diffsFileName = os.path.join(tempDir, 'diffcounts.csv')
+            differencecounts.DifferenceCounts(inputDir, diffsFileName).create_file()
+            hammingFileName = os.path.join(tempDir, 'hamming.csv')
+            tallFileName = os.path.join(tempDir, 'tall.csv')
+            similarity.SimilarityTable(inputDir, hammingFileName, similarity.METRIC_HAMMING).create_file(
+                workers=2, tallFileName=tallFileName)
+            diffIds, diffCounts = differencecounts.DifferenceCounts(inputDir, diffsFileName).read_counts()
+            hammingIds, hammingCounts = differencecounts.DifferenceCounts(inputDir, hammingFileName).read_counts()
+            self.assertEqual(sorted(personIds), hammingIds)
+            for indexA in range(len(personIds)):
+                for indexB in range(len(personIds)):
+                    self.assertEqual(diffCounts[diffIds.index(hammingIds[indexA])][diffIds.index(hammingIds[indexB])],
+                                     hammingCounts[indexA][indexB])
+            self.assertEqual(1 + len(personIds) ** 2, len(read_file(tallFileName).splitlines()))
+            jaccardFileName = os.path.join(tempDir, 'jaccard.csv')
+            similarity.SimilarityTable(inputDir, jaccardFileName).create_file()
+            with open(jaccardFileName, 'r') as srcFile:
+                rows = list(csv.DictReader(srcFile))
+            self.assertEqual(['1.0'] * len(personIds), [row[row['personId']] for row in rows])
+            self.assertEqual(rows[0][personIds[1]], rows[1][personIds[0]])
+            #a tall table can only be flattened from a csv table
+            npzTable = similarity.SimilarityTable(inputDir, jaccardFileName, outputFormat=tablesink.FORMAT_NPZ)
+            self.assertRaises(ValueError, npzTable.create_file, tallFileName=tallFileName)
+        finally:
+            shutil.rmtree(tempDir)
+
+
+class TestMinHash(unittest.TestCase):
+    '''
+    minhash should sketch people and find the pairs that are nearly the same.
+    '''
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        print self.__class__.__name__
+        self.tempDir = tempfile.mkdtemp()
+        self.inputDir = os.path.join(self.tempDir, 'vcfdata') + '/'
+        os.mkdir(self.inputDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+        unittest.TestCase.tearDown(self)
+
+    def test_sketches(self):
+        '''
+        A sketch should be the same from pairs and from GenomeColumns, and the
+        share of places two sketches agree should be near the Jaccard
+        similarity of the two sets of pairs.
+        '''
+        records = [vcffile.VcfRecord('chr1', str(index), 'rs' + str(index + 1), 'A', 'CG'[index % 2])
+                   for index in range(3000)] + [vcffile.VcfRecord('chr2', '5', 'rs20;rs21', 'A', 'T')]
+        columns = genomecache.GenomeColumns()
+        columns.add_records(records)
+        pairs = [[record.id, record.alt] for record in records]
+        sketch = minhash.sketch_pairs(pairs)
+        self.assertEqual(sketch, minhash.sketch_columns(columns))
+        self.assertEqual(minhash.SKETCH_SIZE, len(sketch))
+        #2000 of 3000 alleles the same is a Jaccard similarity of 2000 / 4000
+        changed = [[snpId, 'T'] if index % 3 == 0 else [snpId, allele]
+                   for index, (snpId, allele) in enumerate(pairs[:3000])]
+        self.assertTrue(abs(0.5 - minhash.estimate_similarity(minhash.sketch_pairs(pairs[:3000]),
+                                                              minhash.sketch_pairs(changed))) < 0.15)
+        self.assertEqual(1.0, minhash.estimate_similarity(minhash.sketch_pairs(pairs[:2]), minhash.sketch_pairs(pairs[:2])))
+        other = minhash.sketch_pairs([[snpId, 'T'] for snpId, allele in pairs])
+        self.assertEqual([(0, 2)], minhash.get_candidate_pairs([sketch, other, sketch], 16))
+        self.assertEqual(16, minhash.choose_bands(128, 0.9))
+
+    def test_related_people(self):
+        '''
+        RelatedPeople should write the pairs at or above the threshold with
+        their exact counts, and sketch only new files when files are added.
+        '''
+        personIds = write_synthetic_cohort(self.inputDir)
+        shutil.copy(os.path.join(self.inputDir, personIds[0] + '_hg19.gatk.flt.vcf'),
+                    os.path.join(self.inputDir, 'A9099_hg19.gatk.flt.vcf'))
+        outputFileName = os.path.join(self.tempDir, 'relatives.csv')
+        related = minhash.RelatedPeople(self.inputDir, outputFileName, 0.9,
+                                        os.path.join(self.tempDir, 'sketches.txt'))
+        related.create_file()
+        lines = read_file(outputFileName).splitlines()
+        self.assertEqual(['A,B,estimate,jaccard,same,differences', 'A9010,A9099,1.0,1.0,4,0'], lines)
+        multiFileName = write_multi_sample_vcf(self.inputDir)
+        srcFileNames = cohort.get_sorted_file_names(self.inputDir)
+        self.assertEqual([multiFileName], related.update_sketches(srcFileNames))
+        self.assertEqual(len(personIds) + 1 + len(MULTISAMPLENAMES), len(related.store.get_people(srcFileNames)))
+        related.create_file(workers=2)
+        self.assertEqual(lines, read_file(outputFileName).splitlines())
+
+
+class TestCorrelationMatrix(unittest.TestCase):
+    '''
+    CorrelationMatrix should turn a matrix into a tall table and back.
+    '''
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        print self.__class__.__name__
+        self.tempDir = tempfile.mkdtemp()
+        self.wideFileName = os.path.join(self.tempDir, 'wide.csv')
+        with open(self.wideFileName, 'w') as destFile:
+            destFile.write('Field,x,y,z\nx,1,0.5,-0.2\ny,0.5,1,\nz,-0.2,,1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+        unittest.TestCase.tearDown(self)
+
+    def test_flatten(self):
+        '''
+        flatten should write the cells a row at a time in column order, in
+        blocks of rows, keeping only the big ones with threshold and each
+        pair once with upperTriangle; unflatten should rebuild the matrix.
+        '''
+        tallFileName = os.path.join(self.tempDir, 'tall.csv')
+        matrix = correlationmatrix.CorrelationMatrix(self.wideFileName, tallFileName)
+        matrix.flatten(blockSize=2)
+        lines = read_file(tallFileName).splitlines()
+        self.assertEqual(['A,B,value', 'x,x,1', 'x,y,0.5', 'x,z,-0.2', 'y,x,0.5'], lines[:5])
+        self.assertEqual(10, len(lines))
+        rebuiltFileName = os.path.join(self.tempDir, 'rebuilt.csv')
+        matrix.unflatten(rebuiltFileName)
+        self.assertEqual(read_file(self.wideFileName), read_file(rebuiltFileName))
+        matrix.flatten(threshold=0.3, upperTriangle=True)
+        lines = read_file(tallFileName).splitlines()
+        self.assertEqual(['A,B,value', 'x,x,1', 'x,y,0.5', 'y,y,1', 'z,z,1'], lines)
+        #the lower triangle comes back from the upper one, a block of rows at a time
+        matrix.flatten(upperTriangle=True)
+        matrix.unflatten(rebuiltFileName, symmetric=True, maxBlockCells=4)
+        self.assertEqual(read_file(self.wideFileName), read_file(rebuiltFileName))
+
+    def test_flatten_non_numeric(self):
+        '''
+        A cell that isn't a number, such as NA, should be missing (NaN) in
+        every column format, as it's kept as text in csv.
+        '''
+        with open(self.wideFileName, 'w') as destFile:
+            destFile.write('Field,x,y\nx,1,NA\ny,,1\n')
+        outputFormats = [tablesink.FORMAT_NPZ]
+        if (tablesink.pyarrow is not None):
+            outputFormats.append(tablesink.FORMAT_ARROW)
+        for outputFormat in outputFormats:
+            matrix = correlationmatrix.CorrelationMatrix(self.wideFileName, os.path.join(self.tempDir, 'tall.csv'),
+                                                         outputFormat)
+            matrix.flatten()
+            if (outputFormat == tablesink.FORMAT_NPZ):
+                values = list(tablesink.read_npz(matrix._output_file_name)[correlationmatrix.FIELD_VALUE_NAME])
+            else:
+                table = tablesink.pyarrow.feather.read_table(matrix._output_file_name)
+                values = table.column(correlationmatrix.FIELD_VALUE_NAME).to_pylist()
+            self.assertEqual([1.0, 'nan', 'nan', 1.0], [value if value == value else 'nan' for value in values])
+
+
 def main():
     unittest.main()
 
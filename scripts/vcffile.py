@@ -1,4 +1,263 @@
+import os
+import sys
+import contextlib
+from array import array
+import bgzf
 import risksnps
+import vcfindex
+import vcfshards
+import genomecache
+
+CONTIG_HEADER = '##contig=<ID='
+VCF_SUFFIX = '.vcf'
+COMPRESSED_SUFFIXES = ['.gz', '.bgz']
+SEEK_SCAN_BYTES = 65536     #when seeking, stop bisecting and read forward below this many bytes
+SAMPLES_START = 9           #the sample columns come after CHROM POS ID REF ALT QUAL FILTER INFO FORMAT
+GT_KEY = 'GT'
+GT_MEMO_SIZE = 100000
+DOSAGE_MISSING = -1         #the dosage of a snp that wasn't called
+NO_ALLELE_NUMBER = '0'      #the allele number of an allele that isn't A, C, G or T, or isn't there
+#the allele number of each allele for each risk allele, see get_an_allele_number
+RISK_ALLELE_NUMBERS = {'C': {'C':'4', 'G':'3', 'T':'2', 'A':'1'},
+                       'A': {'A':'4', 'G':'3', 'T':'2', 'C':'1'},
+                       'T': {'T':'4', 'G':'3', 'C':'2', 'A':'1'},
+                       'G': {'G':'4', 'T':'3', 'C':'2', 'A':'1'}}
+
+#the alt allele numbers in each GT value seen, see get_gt_alt_numbers
+_gtAltNumbers = {}
+
+
+class VcfRecord(object):
+    '''
+    One data line from a vcf file: the chromosome, position, id, reference
+    allele and alternative allele.  The values are kept as the strings found
+    in the file.
+    '''
+
+    __slots__ = ('chrom', 'pos', 'id', 'ref', 'alt')
+
+    def __init__(self, chrom, pos, id, ref, alt):
+        self.chrom = chrom
+        self.pos = pos
+        self.id = id
+        self.ref = ref
+        self.alt = alt
+
+    def __repr__(self):
+        return 'VcfRecord(%r, %r, %r, %r, %r)' % (self.chrom, self.pos, self.id, self.ref, self.alt)
+
+
+def parse_record(line):
+    '''
+    Splits one data line and returns a VcfRecord, or None if the line doesn't
+    have an id column.  Missing ref or alt columns are returned as blanks.
+
+    Only the first five columns are split out, the rest of the line is left
+    in one piece since we don't use it.
+    '''
+    split = line.split(None, 5)
+    fieldCount = len(split)
+    if (fieldCount < 3):
+        return None
+    if (fieldCount < 5):
+        split.extend([''] * (5 - fieldCount))
+    return VcfRecord(split[0], split[1], split[2], split[3], split[4])
+
+
+def iter_line_records(lines, snpsOnly=False):
+    '''
+    Yields a VcfRecord for each data line in lines.  Header lines (starting
+    with #) are skipped without being split, and each data line is split
+    only once.  If snpsOnly is set, lines without a snp id (a string
+    starting with rs) are skipped.
+    '''
+    for a_line in lines:
+        if (a_line.startswith('#')):
+            continue
+        split = a_line.split(None, 5)
+        fieldCount = len(split)
+        if (fieldCount < 5):
+            if (fieldCount < 3):
+                continue
+            split.extend([''] * (5 - fieldCount))
+        if (snpsOnly and not split[2].startswith('rs')):
+            continue
+        yield VcfRecord(split[0], split[1], split[2], split[3], split[4])
+
+
+def parse_region(region):
+    '''
+    Splits a region string like chr1:10000-20000 into the chromosome, start
+    and end.  A missing start or end covers the rest of the chromosome.
+    '''
+    chrom, colon, span = region.partition(':')
+    start = 1
+    end = sys.maxint
+    if (span):
+        span = span.replace(',', '')
+        first, dash, last = span.partition('-')
+        if (first):
+            start = int(first)
+        if (last):
+            end = int(last)
+    return (chrom, start, end)
+
+
+def get_gt_alt_numbers(gt):
+    '''
+    Returns the alt allele numbers (1 for the first alt allele and so on) in
+    a GT value such as 0/1, 1|2 or ./., in order and without repeats.  There
+    are only a few different GT values in a file, so they're remembered.
+    '''
+    numbers = _gtAltNumbers.get(gt)
+    if (numbers is None):
+        found = set()
+        for part in gt.replace('|', '/').split('/'):
+            if (part.isdigit() and int(part) > 0):
+                found.add(int(part))
+        numbers = tuple(sorted(found))
+        if (len(_gtAltNumbers) < GT_MEMO_SIZE):
+            _gtAltNumbers[gt] = numbers
+    return numbers
+
+
+def decode_gt(gt, altAlleles):
+    '''
+    Returns the allele a sample with this GT has, in the same terms as the
+    ALT column of a one person file: the alt alleles it carries, joined with
+    commas, or '0' if it has none (it's the same as the reference or wasn't
+    called).
+    '''
+    alleles = [altAlleles[number - 1] for number in get_gt_alt_numbers(gt) if number <= len(altAlleles)]
+    if (not alleles):
+        return '0'
+    return ','.join(alleles)
+
+
+def get_sample_gts(formatField, sampleFields):
+    '''
+    Returns the GT value of each sample on a line, from its FORMAT column and
+    its sample columns, or '' for a sample without one.
+    '''
+    keys = formatField.split(':')
+    if (GT_KEY not in keys):
+        return [''] * len(sampleFields)
+    gtIndex = keys.index(GT_KEY)
+    if (len(keys) == 1):
+        return sampleFields
+    if (gtIndex == 0):
+        return [sampleField.split(':', 1)[0] for sampleField in sampleFields]
+    #a sample can leave off its trailing fields
+    return [(sampleField.split(':') + [''] * gtIndex)[gtIndex] for sampleField in sampleFields]
+
+
+def decode_samples(formatField, sampleFields, alt):
+    '''
+    Returns the allele (see decode_gt) of each sample on a line, from its
+    FORMAT column, its sample columns and its ALT column.  Each different GT
+    value on the line is decoded once and the samples are looked up from
+    those, rather than each sample being decoded on its own.
+    '''
+    gts = get_sample_gts(formatField, sampleFields)
+    altAlleles = alt.split(',')
+    decoded = dict((gt, decode_gt(gt, altAlleles)) for gt in set(gts))
+    return map(decoded.__getitem__, gts)
+
+
+def get_gt_dosage(gt, alleles, riskAllele):
+    '''
+    Returns the count of copies of riskAllele (0, 1 or 2) in a GT value, with
+    alleles the REF allele followed by the ALT alleles, so 0/1 with REF A, ALT
+    G and risk allele G is 1 and 1|1 is 2.  A GT that isn't all called (./.,
+    0/., or none at all) is DOSAGE_MISSING.
+    '''
+    parts = gt.replace('|', '/').split('/')
+    dosage = 0
+    for part in parts:
+        if (not part.isdigit()):
+            return DOSAGE_MISSING
+        number = int(part)
+        if (number < len(alleles) and alleles[number] == riskAllele):
+            dosage += 1
+    return dosage
+
+
+def decode_sample_dosages(formatField, sampleFields, ref, alt, riskAllele):
+    '''
+    Returns the dosage of riskAllele (see get_gt_dosage) for each sample on a
+    line, decoding each different GT value on the line once.
+    '''
+    gts = get_sample_gts(formatField, sampleFields)
+    alleles = [ref] + alt.split(',')
+    decoded = dict((gt, get_gt_dosage(gt, alleles, riskAllele)) for gt in set(gts))
+    return map(decoded.__getitem__, gts)
+
+
+class AlleleNumberTable(dict):
+    '''
+    AlleleNumberTable maps every (risk allele, allele) pair to its allele
+    number, built once from RISK_ALLELE_NUMBERS, and the same for every
+    (risk allele code, allele) pair, with the codes of RiskSnps.alleleCodes
+    (see risksnps.ALLELE_CODES).  It gives NO_ALLELE_NUMBER for any other
+    pair.  Looking a pair up is one dictionary lookup, and
+    map(table.__getitem__, pairs) encodes a whole list of pairs in C.
+    '''
+
+    def __init__(self):
+        dict.__init__(self)
+        for riskAllele in RISK_ALLELE_NUMBERS:
+            for allele, alleleNumber in RISK_ALLELE_NUMBERS[riskAllele].items():
+                self[(riskAllele, allele)] = alleleNumber
+                self[(risksnps.ALLELE_CODES[riskAllele], allele)] = alleleNumber
+
+    def __missing__(self, pair):
+        return NO_ALLELE_NUMBER
+
+
+ALLELE_NUMBER_TABLE = AlleleNumberTable()
+
+
+def get_allele_number(allele, riskAllele):
+    '''Returns the allele number of one allele for this risk allele or its code (see VcfFile.get_an_allele_number).'''
+    return ALLELE_NUMBER_TABLE[(riskAllele, allele)]
+
+
+def get_allele_numbers(alleles, riskAlleles):
+    '''
+    Returns the list of allele numbers for a list of alleles against the
+    list of their risk alleles, or the array of their codes (see
+    RiskSnps.alleleCodes), all at once.  A missing allele ('' or '0')
+    is NO_ALLELE_NUMBER.
+    '''
+    if (len(riskAlleles) < len(alleles)):
+        riskAlleles = list(riskAlleles) + [''] * (len(alleles) - len(riskAlleles))
+    return map(ALLELE_NUMBER_TABLE.__getitem__, zip(riskAlleles, alleles))
+
+
+def get_rs_ids(snpIds):
+    '''Returns the set of these snp ids that start with rs, the only ones looked for in a vcf file.'''
+    return set(snpId for snpId in snpIds if snpId.startswith('rs'))
+
+
+def get_vcf_file_names(directory):
+    '''
+    Returns the names of the vcf files in directory, plain or compressed,
+    leaving out anything else that is kept there, such as index files.
+    '''
+    fileNames = []
+    for fileName in os.listdir(directory):
+        if (strip_compressed_suffix(fileName).endswith(VCF_SUFFIX)):
+            fileNames.append(fileName)
+    return fileNames
+
+
+def strip_compressed_suffix(fileName):
+    '''Returns the file name without a .gz or .bgz ending.'''
+    for suffix in COMPRESSED_SUFFIXES:
+        if (fileName.endswith(suffix)):
+            return fileName[:-len(suffix)]
+    return fileName
+
 
 class VcfFile():
     '''Variant Call Format files.
@@ -8,90 +267,538 @@ class VcfFile():
     along with the reference allele and the alternative allele found for this
     person.
 
+    A file can also hold many people (samples), named in the #CHROM header
+    line, each with a column of FORMAT fields whose GT field says which
+    alleles they have.  get_sample_names and iter_sample_alleles read those.
+
     Here we provide methods to pull the snps from the file to support the
     creation of file formats that contain more than one person for visualization
     and analysis of the genomic data provided.  
+
+    The file can be plain text, gzip or bgzf (blocked gzip, as written by
+    bgzip).  bgzf files are decompressed on the number of threads given to
+    the constructor, by default bgzf.threads, the module setting (see
+    bgzf.set_threads and bgzf.iter_bgzf_lines).  Compressed files
+    can't be seeked by line offset, so they are always read from the start.
     '''
 
 
-    def __init__(self,filename = ""):
+    def __init__(self,filename = "", threads=None):
         self.filename = filename
+        self.seekScanBytes = SEEK_SCAN_BYTES
+        self.threads = threads
+        self._sampleNames = None
+
+    def is_compressed(self):
+        '''True if the file is gzip or bgzf compressed.'''
+        return bgzf.is_gzip(self.filename)
+
+    def open_lines(self):
+        '''
+        Opens the file for reading lines, decompressing it if it is compressed.
+        Use it in a with statement, the lines are read by iterating over it.
+        '''
+        if (self.is_compressed()):
+            return contextlib.closing(bgzf.iter_lines(self.filename, self.threads))
+        return open(self.filename, 'r')
     
     def get_first_snp_line(self):
         '''
         Reads the file until it encounters a line with a snp id (rsxxx) and
         returns the line containing the snp or blank if none are found.
         '''
-        with open(self.filename, 'r') as snp_file:
+        with self.open_lines() as snp_file:
             #using with so that the file doesn't get left open it's automatically closed when
             #we leave this code block
             for a_line in snp_file:
+                if (a_line.startswith('#')):
+                    continue
                 snpId = self.get_a_snp_id(a_line)
                 if (snpId):
                     return(a_line)
         return("")
 
+    def iter_records(self, snpsOnly=False):
+        '''
+        Reads the file one line at a time, yielding a VcfRecord for each data line
+        (see iter_line_records).  If snpsOnly is set, lines without a snp id (a
+        string starting with rs) are skipped.
+        '''
+        with self.open_lines() as snp_file:
+            for record in iter_line_records(snp_file, snpsOnly):
+                yield record
+
+    def iter_snp_records(self):
+        '''
+        Yields the VcfRecords that have a snp id (a string starting with rs).
+        '''
+        return self.iter_records(snpsOnly=True)
+
+    def get_sample_names(self):
+        '''
+        Returns the names of the samples in the file, from the columns of the
+        #CHROM header line after FORMAT.  A one person file has one (or none).
+        '''
+        if (self._sampleNames is None):
+            self._sampleNames = []
+            with self.open_lines() as snp_file:
+                for a_line in snp_file:
+                    if (a_line.startswith('#CHROM')):
+                        self._sampleNames = a_line.rstrip('\r\n').split('\t')[SAMPLES_START:]
+                        break
+                    if (not a_line.startswith('#')):
+                        break
+        return self._sampleNames
+
+    def is_multi_sample(self):
+        '''True if the file holds more than one person's samples.'''
+        return len(self.get_sample_names()) > 1
+
+    def iter_sample_fields(self, snpsOnly=True, ids=None):
+        '''
+        Reads the file one line at a time, yielding (VcfRecord, FORMAT column,
+        sample columns) for the lines that have sample columns.  If ids is
+        given, only the lines for those snp ids are split.
+        '''
+        with self.open_lines() as snp_file:
+            for a_line in snp_file:
+                if (a_line.startswith('#')):
+                    continue
+                split = a_line.rstrip('\r\n').split('\t')
+                if (len(split) <= SAMPLES_START):
+                    continue
+                snpId = split[2]
+                if ((snpsOnly and not snpId.startswith('rs')) or (ids is not None and snpId not in ids)):
+                    continue
+                record = VcfRecord(split[0], split[1], snpId, split[3], split[4])
+                yield (record, split[8], split[SAMPLES_START:])
+
+    def iter_sample_alleles(self, snpsOnly=True, ids=None):
+        '''
+        Reads a multi sample file one line at a time, yielding (VcfRecord,
+        alleles) with the allele of each sample, in the order of
+        get_sample_names (see decode_samples).  If ids is given, only the lines
+        for those snp ids are decoded.
+        '''
+        for record, formatField, sampleFields in self.iter_sample_fields(snpsOnly, ids):
+            yield (record, decode_samples(formatField, sampleFields, record.alt))
+
+    def get_these_risksnp_dosages(self, riskSnps):
+        '''
+        Reads the file once looking for the snps in riskSnps and returns, for
+        each sample (in the order of get_sample_names, one for a one person
+        file), an array of signed bytes with the dosage of each snp's risk
+        allele from its GT field (see get_gt_dosage).  Snps that aren't in the
+        file, or whose GT wasn't called, are DOSAGE_MISSING.  A snp listed
+        more than once, with different risk alleles say, gets a dosage at
+        each of its places.
+
+        A byte per snp is much smaller than the list of allele number strings
+        get_these_risksnps returns, and keeps heterozygous and homozygous
+        carriers apart.
+        '''
+        sampleCount = max(1, len(self.get_sample_names()))
+        dosages = [array('b', [DOSAGE_MISSING]) * riskSnps.len() for sampleIndex in range(sampleCount)]
+        snpIndexes = {}
+        for index in range(riskSnps.len()):
+            snpIndexes.setdefault(riskSnps.snps[index], []).append(index)
+        notFound = get_rs_ids(snpIndexes)
+        if (not notFound):
+            return dosages
+        for record, formatField, sampleFields in self.iter_sample_fields(ids=snpIndexes):
+            #the first line for an id is used, as in get_these_risksnps
+            if (record.id not in notFound):
+                continue
+            for index in snpIndexes[record.id]:
+                sampleDosages = decode_sample_dosages(formatField, sampleFields[:sampleCount], record.ref,
+                                                      record.alt, riskSnps.alleles[index])
+                for sampleIndex in range(len(sampleDosages)):
+                    dosages[sampleIndex][index] = sampleDosages[sampleIndex]
+            notFound.discard(record.id)
+            if (not notFound):
+                break
+        return dosages
+
+    def get_these_risksnps_by_sample(self, riskSnps):
+        '''
+        Reads a multi sample file once looking for the snps in riskSnps.
+        Returns a list with a list for each sample (in the order of
+        get_sample_names) of the allele numbers, like get_these_risksnps.  A
+        snp listed more than once gets its numbers at each of its places, as in
+        get_these_risksnp_dosages.
+        '''
+        sampleCount = len(self.get_sample_names())
+        alleles = [['0'] * riskSnps.len() for sampleIndex in range(sampleCount)]
+        snpIndexes = {}
+        for index in range(riskSnps.len()):
+            snpIndexes.setdefault(riskSnps.snps[index], []).append(index)
+        notFound = get_rs_ids(snpIndexes)
+        if (not notFound):
+            return alleles
+        for record, sampleAlleles in self.iter_sample_alleles(ids=snpIndexes):
+            #the first line for an id is used, as in get_these_risksnps
+            if (record.id not in notFound):
+                continue
+            for index in snpIndexes[record.id]:
+                riskAllele = riskSnps.alleleCodes[index]
+                numbers = dict((allele, get_allele_number(allele, riskAllele)) for allele in set(sampleAlleles))
+                for sampleIndex in range(sampleCount):
+                    alleles[sampleIndex][index] = numbers[sampleAlleles[sampleIndex]]
+            notFound.discard(record.id)
+            if (not notFound):
+                break
+        return alleles
+
     def get_these_risksnps(self, riskSnps):
         '''
         Reads the file looking for the snps in the riskSnps argument.
         Returns a list of the allele numbers for the snps that were found.
+
+        If the file has an up to date index (see VcfIndex) we read just the
+        lines it points to.  If the risk snps have chromosomes and positions and
+        the file lists its contigs in the header (so we know its sort order),
+        we seek to each snp.  Otherwise we read the file until all the snps
+        have been found.
+
+        If the file has more than one line with a risk snp's id, the first one
+        is used, whichever way the file is read, so reading can stop once each
+        snp is found.  When seeking, that's the first line at the snp's
+        chromosome and position.  Only ids starting with rs are looked for,
+        whichever way the file is read.
+        '''
+        if (self.is_compressed()):
+            return self.scan_these_risksnps(riskSnps)
+        index = vcfindex.VcfIndex(self.filename)
+        if (index.load()):
+            return self.index_these_risksnps(riskSnps, index)
+        if (riskSnps.has_locations()):
+            contigOrder = self.get_contig_order()
+            if (contigOrder):
+                return self.seek_these_risksnps(riskSnps, contigOrder)
+        return self.scan_these_risksnps(riskSnps)
+
+    def index_these_risksnps(self, riskSnps, index):
+        '''
+        Reads the lines for the risk snps that the loaded VcfIndex points to.
+        Returns a list of the allele numbers for the snps that were found.
+
+        An id the index lists but that isn't on any of the lines it points to
+        (the file was changed without its size or modification time changing,
+        say) is looked for by reading the file, as scan_these_risksnps does.
+        Ids the index doesn't list aren't in the file.
+        '''
+        alts = ['']*(riskSnps.len())
+        snpIndex = riskSnps.snpIndex
+        offsetMap = index.get_id_offset_map(get_rs_ids(snpIndex))
+        offsets = set()
+        for idOffsets in offsetMap.values():
+            offsets.update(idOffsets)
+        found = set()
+        lineIds = set()
+        #the offsets are in file order, keep the first line for each id
+        for record in self.read_records_at(sorted(offsets)):
+            lineIds.update(record.id.split(';'))
+            riskSnpIndex = snpIndex.get(record.id)
+            if (riskSnpIndex is not None and record.id not in found):
+                alts[riskSnpIndex] = record.alt
+                found.add(record.id)
+        self.scan_alts(riskSnps, alts, set(offsetMap) - lineIds)
+        return get_allele_numbers(alts, riskSnps.alleleCodes)
+
+    def query(self, region=None, ids=None):
         '''
-        alleles = ['0']*(riskSnps.len())
-        with open(self.filename, 'r') as snp_file:
+        Returns the records in region whose id is in ids, using the file's
+        VcfIndex (which is built if it's missing or out of date).
+
+        region is a string like chr1:10000-20000 (positions from 1, both ends
+        included), chr1:10000 (to the end of the chromosome) or chr1.  Either
+        argument can be left out.  Compressed files aren't indexed, they are
+        read from the start.
+        '''
+        if (self.is_compressed()):
+            records = self.iter_records()
+            if (ids is not None):
+                idSet = set(ids)
+                records = [record for record in records if record.id in idSet]
+        else:
+            records = self.query_index(region, ids)
+        if (region is None):
+            return list(records)
+        chrom, start, end = parse_region(region)
+        selected = []
+        for record in records:
+            if (record.chrom == chrom and start <= int(record.pos) <= end):
+                selected.append(record)
+        return selected
+
+    def query_index(self, region, ids):
+        '''
+        Returns the records from the file's VcfIndex that may match the region
+        and ids, building the index if it's missing or out of date.
+        '''
+        index = vcfindex.VcfIndex(self.filename)
+        index.open()
+        if (ids is not None):
+            records = self.read_records_at(index.get_id_offsets(ids))
+        elif (region is not None and index.isSorted):
+            records = self.read_region(region, index)
+        else:
+            records = self.iter_records()
+        return records
+
+    def read_records_at(self, offsets):
+        '''
+        Yields the records on the lines starting at these byte offsets.
+        '''
+        with open(self.filename, 'rb') as snp_file:
+            for offset in offsets:
+                snp_file.seek(offset)
+                record = parse_record(snp_file.readline())
+                if (record is not None):
+                    yield record
+
+    def read_region(self, region, index):
+        '''
+        Yields the records in region, starting from the bin the loaded VcfIndex
+        gives for the region's start.  The file must be sorted.
+        '''
+        chrom, start, end = parse_region(region)
+        offset = index.get_region_offset(chrom, start)
+        if (offset is None):
+            return
+        with open(self.filename, 'rb') as snp_file:
+            snp_file.seek(offset)
             for a_line in snp_file:
-                snpId = self.get_a_snp_id(a_line)
-                if (snpId in riskSnps.snps):
-                    index = riskSnps.snps.index(snpId)
-                    riskAllele = riskSnps.alleles[index]
-                    sourceAllele = self.get_an_allele(a_line)
-                    alleleNumber = self.get_an_allele_number(sourceAllele, riskAllele)
-                    alleles[index] = alleleNumber
-        return alleles
+                record = parse_record(a_line)
+                if (record is None or record.chrom != chrom or int(record.pos) > end):
+                    break
+                if (int(record.pos) >= start):
+                    yield record
+
+    def scan_these_risksnps(self, riskSnps):
+        '''
+        Reads the file from the start looking for the snps in the riskSnps argument,
+        stopping as soon as all of them have been found, each at its first line.
+        Returns a list of the allele numbers for the snps that were found.
+        '''
+        alts = ['']*(riskSnps.len())
+        self.scan_alts(riskSnps, alts, get_rs_ids(riskSnps.snpIndex))
+        return get_allele_numbers(alts, riskSnps.alleleCodes)
+
+    def scan_alts(self, riskSnps, alts, notFound):
+        '''
+        Reads the file from the start looking for the snp ids in the set
+        notFound, stopping as soon as all of them have been found, and puts the
+        alt alleles of their first lines in alts, at the snps' indexes in
+        riskSnps.
+        '''
+        if (not notFound):
+            return
+        notFound = set(notFound)
+        snpIndex = riskSnps.snpIndex
+        for record in self.iter_snp_records():
+            if (record.id in notFound):
+                alts[snpIndex[record.id]] = record.alt
+                notFound.discard(record.id)
+                if (not notFound):
+                    break
+
+    def seek_these_risksnps(self, riskSnps, contigOrder):
+        '''
+        Finds each of the risk snps by seeking to its chromosome and position
+        rather than reading the whole file. The file must be sorted in the
+        order of contigOrder (see get_contig_order) and then by position.
+        Each snp is taken from the first line with its id at its locus.
+        Returns a list of the allele numbers for the snps that were found.
+
+        A snp that isn't at its locus (the panel's position is from another
+        build, say) is looked for by reading the file, as scan_these_risksnps
+        does, so seeking finds the same snps that reading does.
+        '''
+        alts = ['']*(riskSnps.len())
+        notFound = get_rs_ids(riskSnps.snpIndex)
+        #visit the snps in file order so the reads move forward through the file
+        loci = []
+        for index in range(riskSnps.len()):
+            snpId = riskSnps.snps[index]
+            chromRank = self.get_chrom_rank(riskSnps.chroms[index], contigOrder)
+            if (chromRank is not None and snpId in notFound and riskSnps.snpIndex.get(snpId) == index):
+                loci.append(((chromRank, int(riskSnps.positions[index])), index))
+        loci.sort()
+        with open(self.filename, 'rb') as snp_file:
+            dataStart = self.skip_header(snp_file)
+            snp_file.seek(0, os.SEEK_END)
+            fileSize = snp_file.tell()
+            for locus, index in loci:
+                snpId = riskSnps.snps[index]
+                for record in self.seek_records(snp_file, dataStart, fileSize, locus, contigOrder):
+                    if (record.id == snpId):
+                        alts[index] = record.alt
+                        notFound.discard(snpId)
+                        break
+        self.scan_alts(riskSnps, alts, notFound)
+        return get_allele_numbers(alts, riskSnps.alleleCodes)
+
+    def seek_records(self, snp_file, dataStart, fileSize, locus, contigOrder):
+        '''
+        Yields the records at locus, a (chromosome rank, position) pair, by
+        bisecting the byte offsets of the open file and then reading forward.
+        '''
+        get_key = lambda line: self.get_line_locus(line, contigOrder)
+        vcfindex.bisect_file(snp_file, dataStart, fileSize, locus, get_key, self.seekScanBytes)
+        for a_line in snp_file:
+            lineLocus = self.get_line_locus(a_line, contigOrder)
+            if (lineLocus is None or lineLocus > locus):
+                break
+            if (lineLocus == locus):
+                record = parse_record(a_line)
+                if (record is not None):
+                    yield record
+
+    def get_line_locus(self, line, contigOrder):
+        '''
+        Returns the (chromosome rank, position) of a data line or None at the end
+        of the file.  Chromosomes missing from contigOrder sort after the others.
+        '''
+        split = line.split(None, 2)
+        if (len(split) < 2):
+            return None
+        chromRank = contigOrder.get(split[0], len(contigOrder))
+        return (chromRank, int(split[1]))
+
+    def get_chrom_rank(self, chrom, contigOrder):
+        '''
+        Returns the sort position of this chromosome in contigOrder, allowing
+        for 1 vs chr1 naming, or None if it isn't there.
+        '''
+        if (chrom in contigOrder):
+            return contigOrder[chrom]
+        return contigOrder.get('chr' + chrom)
+
+    def get_contig_order(self):
+        '''
+        Reads the ##contig header lines and returns a dictionary from chromosome
+        name to its place in the file's sort order.  The dictionary is empty if
+        the header doesn't list the contigs.
+        '''
+        contigOrder = {}
+        with self.open_lines() as snp_file:
+            for a_line in snp_file:
+                if (not a_line.startswith('#')):
+                    break
+                if (a_line.startswith(CONTIG_HEADER)):
+                    contig = a_line[len(CONTIG_HEADER):].split(',')[0].rstrip('>\r\n')
+                    contigOrder[contig] = len(contigOrder)
+        return contigOrder
+
+    def skip_header(self, snp_file):
+        '''
+        Reads past the header lines of the open file and returns the offset of
+        the first data line.
+        '''
+        offset = snp_file.tell()
+        a_line = snp_file.readline()
+        while (a_line.startswith('#')):
+            offset = snp_file.tell()
+            a_line = snp_file.readline()
+        return offset
 
     def get_these_snps(self, snpsToUse):
         '''
-        Reads the file looking for the snps in the snpsToUse argument.
+        Reads the file looking for the snps in the snpsToUse argument, stopping
+        as soon as all of them have been found.
         Returns a list of the alleles for the snps that were found.
         '''
         alleles = ['0']*(len(snpsToUse))
-        with open(self.filename, 'r') as snp_file:
-            for a_line in snp_file:
-                snpId = self.get_a_snp_id(a_line)
-                if (snpId in snpsToUse):
-                    index = snpsToUse.index(snpId)
-                    sourceAllele = self.get_an_allele(a_line)
-                    alleles[index] = sourceAllele
+        #index the snps once so each line is a dictionary lookup, the first
+        #occurrence of a snp wins as it did with list.index
+        snpIndex = {}
+        for index in range(len(snpsToUse) - 1, -1, -1):
+            snpIndex[snpsToUse[index]] = index
+        notFound = get_rs_ids(snpIndex)
+        if (not notFound):
+            return alleles
+        for record in self.iter_snp_records():
+            index = snpIndex.get(record.id)
+            if (index is not None):
+                alleles[index] = record.alt
+                notFound.discard(record.id)
+                if (not notFound):
+                    break
         return alleles
 
-    def get_all_snps_and_alleles(self):
+    def get_genome_columns(self, workers=1):
+        '''
+        Returns the file's snps as GenomeColumns.  Unless the cache is turned
+        off (genomecache.enabled) they come from the genome cache, and the
+        first time the file is read they are parsed and put there.  With more
+        than one worker the file is parsed in pieces (see parse_genome_columns).
+        '''
+        if (not genomecache.enabled):
+            return self.parse_genome_columns(workers)
+        cache = genomecache.get_cache()
+        columns = cache.load(self.filename)
+        if (columns is None):
+            columns = self.parse_genome_columns(workers)
+            cache.store(self.filename, columns)
+        return columns
+
+    def parse_genome_columns(self, workers=1):
+        '''
+        Parses the file's snps into GenomeColumns.  With more than one worker
+        an uncompressed file is split into shards that are parsed on a pool of
+        worker processes (see vcfshards.read_columns); a compressed one is
+        read from the start.
+        '''
+        if (workers > 1 and not self.is_compressed()):
+            return vcfshards.read_columns(self.filename, workers)
+        columns = genomecache.GenomeColumns()
+        columns.add_records(self.iter_snp_records())
+        return columns
+
+    def iter_snps_and_alleles(self):
+        '''
+        Yields (snpId, allele) for each snp in the file, one at a time.  When
+        the genome cache is on they come from the cached columns (see
+        get_genome_columns) rather than the text.
+        '''
+        if (genomecache.enabled):
+            columns = self.get_genome_columns()
+            alleles = columns.alleles
+            alleleCodes = columns.alleleCodes
+            for index in xrange(columns.len()):
+                yield (columns.get_snp_id(index), alleles[alleleCodes[index]])
+        else:
+            for record in self.iter_snp_records():
+                yield (record.id, record.alt)
+
+    def get_all_snps_and_alleles(self, workers=1):
         '''
         Reads the file and returns a list containing all the snp, allele combinations.
+        With more than one worker a large file is parsed in parallel (see
+        parse_genome_columns).
         '''
+        if (genomecache.enabled or workers > 1):
+            return self.get_genome_columns(workers).get_all_snps_and_alleles()
         alldata = []
-        index = 0
-        with open(self.filename, 'r') as snp_file:
-            for a_line in snp_file:
-                snpId = self.get_a_snp_id(a_line)
-                if (len(snpId) > 0):
-                    sourceAllele = self.get_an_allele(a_line)
-                    alldata.append([snpId, sourceAllele])
-                    index += 1
+        for record in self.iter_snp_records():
+            alldata.append([record.id, record.alt])
         return alldata
         
-    def get_all_snps_and_locations(self):
+    def get_all_snps_and_locations(self, workers=1):
         '''
+        Reads the file and returns a list containing the snp, allele, chromosome and
+        location for each snp.  With more than one worker a large file is
+        parsed in parallel (see parse_genome_columns).
         '''
+        if (genomecache.enabled or workers > 1):
+            return self.get_genome_columns(workers).get_all_snps_and_locations()
         alldata = []
-        index = 0
-        with open(self.filename, 'r') as snp_file:
-            for a_line in snp_file:
-                snpId = self.get_a_snp_id(a_line)
-                if (len(snpId) > 0):
-                    chrom = self.get_a_chrom(a_line)
-                    location = self.get_a_location(a_line)
-                    sourceAllele = self.get_an_allele(a_line)
-                    alldata.append([snpId, sourceAllele, chrom, location])
-                    index += 1
+        for record in self.iter_snp_records():
+            chrom = record.chrom
+            if (not chrom.startswith('chr')):
+                chrom = ''
+            alldata.append([record.id, record.alt, chrom, record.pos])
         return alldata
         
     def get_a_snp_id(self, line):
@@ -114,19 +821,11 @@ class VcfFile():
 
         We convert it to a number so that the risk alleles are given the
         highest value (4), nas are still nas and everything else falls between those two.
-        This emphasizes risk alleles in the visualization.  
-        '''
-        alleleNumber = '0'
-        riskAlleleDictionary = {'C': {'C':'4', 'G':'3', 'T':'2', 'A':'1'},
-                                'A': {'A':'4', 'G':'3', 'T':'2', 'C':'1'},
-                                'T': {'T':'4', 'G':'3', 'C':'2', 'A':'1'},
-                                'G': {'G':'4', 'T':'3', 'C':'2', 'A':'1'}}
-        personId = self.get_person_id()
-        if (riskAllele in riskAlleleDictionary):
-            alleleDictionary = riskAlleleDictionary[riskAllele]
-            if (allele in alleleDictionary):
-                alleleNumber = alleleDictionary[allele]
-        return alleleNumber
+        This emphasizes risk alleles in the visualization.  The numbers come
+        from ALLELE_NUMBER_TABLE, built once (see get_allele_numbers for a
+        list of alleles at once).
+        '''
+        return ALLELE_NUMBER_TABLE[(riskAllele, allele)]
         
         
     def get_an_allele(self, line):
@@ -155,11 +854,19 @@ class VcfFile():
         location = split[1]
         return location
 
-    def get_persons_file_name(self, personId):
+    def get_persons_file_name(self, personId, directory=None):
         '''
-        Returns the name of the file that contains this person's data.
+        Returns the name of the file that contains this person's data.  If
+        directory is given and it doesn't have the usual file name for the
+        person, we look there for a vcf file, plain or compressed, with this
+        person id.
         '''
         filename = personId + '_hg19.gatk.flt.vcf'
+        if (directory is None or os.path.exists(os.path.join(directory, filename))):
+            return filename
+        for vcfFileName in get_vcf_file_names(directory):
+            if (VcfFile(vcfFileName).get_person_id() == personId):
+                return vcfFileName
         return filename
         
     def get_person_id(self):
@@ -168,6 +875,9 @@ class VcfFile():
         '''
         parts = self.filename.split('/')
         filename = parts[-1]   #the last one
+        filename = strip_compressed_suffix(filename)
+        if (filename.endswith(VCF_SUFFIX)):
+            filename = filename[:-len(VCF_SUFFIX)]
         parts = filename.split('_')
         personId = parts[0]
         return personId
@@ -0,0 +1,196 @@
+import os
+import bisect
+
+INDEX_SUFFIX = '.vcfidx'
+INDEX_HEADER = '##vcfindex'
+IDS_HEADER = '##ids'
+DEFAULT_BIN_SIZE = 16384    #the same bin width tabix uses for its linear index
+SCAN_BYTES = 4096           #stop bisecting the id lines and read forward below this many bytes
+
+
+def bisect_file(srcFile, low, high, target, get_key, scanBytes):
+    '''
+    Positions the open file so that reading forward from it reaches the first
+    line between the byte offsets low and high whose key is not less than target.
+    The lines between low and high must be sorted by get_key, which returns
+    None for the end of the file.  Bisecting stops when the range is smaller
+    than scanBytes, the caller reads forward from there.
+    '''
+    start = low
+    while (high - low > scanBytes):
+        middle = (low + high) // 2
+        srcFile.seek(middle)
+        srcFile.readline()      #finish the line we landed in
+        key = get_key(srcFile.readline())
+        if (key is None or key >= target):
+            high = middle
+        else:
+            low = middle
+    srcFile.seek(low)
+    if (low > start):
+        srcFile.readline()
+
+
+def get_id_key(line):
+    '''Returns the snp id from an id line of the index, None at the end of the file.'''
+    if (not line):
+        return None
+    return line.split('\t', 1)[0]
+
+
+class VcfIndex():
+    '''
+    VcfIndex is a sidecar file next to a vcf file that maps snp ids and
+    chromosome positions to the byte offsets of their lines in the vcf file,
+    so that a few snps or a region can be read without reading the whole file.
+
+    The sidecar is a text file.  The first line records the size and
+    modification time of the vcf file it was built from, the bin width and
+    whether the vcf file was sorted.  If the vcf file changes the index is
+    out of date and is rebuilt.  Then there is one line per bin: chromosome,
+    bin number (position // bin width) and the offset of the first line in
+    that bin.  After the ##ids line, there is one line per snp id with its
+    offset, sorted by id so that we can bisect the sidecar rather than
+    reading all of it.
+    '''
+
+    def __init__(self, vcfFileName, binSize=DEFAULT_BIN_SIZE):
+        self.vcfFileName = vcfFileName
+        self.indexFileName = vcfFileName + INDEX_SUFFIX
+        self.binSize = binSize
+        self.isSorted = False
+        self.bins = {}
+        self._idsStart = 0
+        self._idsEnd = 0
+
+    def get_fingerprint(self):
+        '''Returns the size and modification time of the vcf file as strings.'''
+        stat = os.stat(self.vcfFileName)
+        return [str(stat.st_size), repr(stat.st_mtime)]
+
+    def build(self):
+        '''
+        Reads the vcf file and writes the index file.
+        '''
+        fingerprint = self.get_fingerprint()
+        binLines = []
+        idLines = []
+        isSorted = True
+        seenChroms = set()
+        lastChrom = None
+        lastPos = -1
+        lastBin = -1
+        offset = 0
+        with open(self.vcfFileName, 'rb') as srcFile:
+            for a_line in srcFile:
+                lineOffset = offset
+                offset += len(a_line)
+                if (a_line.startswith('#')):
+                    continue
+                split = a_line.split(None, 3)
+                if (len(split) < 3):
+                    continue
+                chrom = split[0]
+                pos = int(split[1])
+                if (chrom != lastChrom):
+                    if (chrom in seenChroms):
+                        isSorted = False
+                    seenChroms.add(chrom)
+                    lastChrom = chrom
+                    lastPos = -1
+                    lastBin = -1
+                if (pos < lastPos):
+                    isSorted = False
+                lastPos = pos
+                binNumber = pos // self.binSize
+                if (binNumber != lastBin):
+                    binLines.append(chrom + '\t' + str(binNumber) + '\t' + str(lineOffset) + '\n')
+                    lastBin = binNumber
+                if (split[2] != '.'):
+                    #a line can have more than one id separated by semicolons
+                    for snpId in split[2].split(';'):
+                        idLines.append(snpId + '\t' + str(lineOffset) + '\n')
+        #the tab sorts before any id character, so sorting the lines sorts the ids
+        idLines.sort()
+        header = [INDEX_HEADER] + fingerprint + [str(self.binSize), str(int(isSorted))]
+        with open(self.indexFileName, 'wb') as destFile:
+            destFile.write('\t'.join(header) + '\n')
+            destFile.write(''.join(binLines))
+            destFile.write(IDS_HEADER + '\n')
+            for start in range(0, len(idLines), 100000):
+                destFile.write(''.join(idLines[start:start + 100000]))
+
+    def load(self):
+        '''
+        Reads the header and bins of the index file.  Returns False if there is
+        no index file or it was built from a different version of the vcf file.
+        '''
+        if (not os.path.exists(self.indexFileName)):
+            return False
+        with open(self.indexFileName, 'rb') as indexFile:
+            header = indexFile.readline().rstrip('\n').split('\t')
+            if (len(header) != 5 or header[0] != INDEX_HEADER or
+                    header[1:3] != self.get_fingerprint()):
+                return False
+            self.binSize = int(header[3])
+            self.isSorted = (header[4] == '1')
+            self.bins = {}
+            a_line = indexFile.readline()
+            while (a_line and not a_line.startswith(IDS_HEADER)):
+                chrom, binNumber, offset = a_line.split('\t')
+                if (chrom not in self.bins):
+                    self.bins[chrom] = ([], [])
+                self.bins[chrom][0].append(int(binNumber))
+                self.bins[chrom][1].append(int(offset))
+                a_line = indexFile.readline()
+            self._idsStart = indexFile.tell()
+            indexFile.seek(0, os.SEEK_END)
+            self._idsEnd = indexFile.tell()
+        return True
+
+    def open(self):
+        '''Loads the index file, building it first if it's missing or out of date.'''
+        if (not self.load()):
+            self.build()
+            self.load()
+
+    def get_id_offsets(self, snpIds):
+        '''
+        Returns the sorted offsets of the vcf lines for these snp ids.  Ids that
+        aren't in the vcf file are left out.
+        '''
+        offsets = set()
+        for idOffsets in self.get_id_offset_map(snpIds).values():
+            offsets.update(idOffsets)
+        return sorted(offsets)
+
+    def get_id_offset_map(self, snpIds):
+        '''
+        Returns a dictionary from each of these snp ids that the index lists to
+        the offsets of its vcf lines.
+        '''
+        offsetMap = {}
+        with open(self.indexFileName, 'rb') as indexFile:
+            for snpId in sorted(set(snpIds)):
+                bisect_file(indexFile, self._idsStart, self._idsEnd, snpId, get_id_key, SCAN_BYTES)
+                for a_line in indexFile:
+                    lineId, offset = a_line.split('\t')
+                    if (lineId > snpId):
+                        break
+                    if (lineId == snpId):
+                        offsetMap.setdefault(snpId, []).append(int(offset))
+        return offsetMap
+
+    def get_region_offset(self, chrom, start):
+        '''
+        Returns the offset to start reading from to find the lines on this
+        chromosome at or after start, or None if there are none.
+        '''
+        if (chrom not in self.bins):
+            return None
+        binNumbers, offsets = self.bins[chrom]
+        #the bin holding start, or the next one that has lines in it
+        index = bisect.bisect_left(binNumbers, start // self.binSize)
+        if (index == len(binNumbers)):
+            return None
+        return offsets[index]
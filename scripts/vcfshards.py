@@ -0,0 +1,121 @@
+import os
+import multiprocessing
+import bgzf
+import vcffile
+import vcfindex
+import genomecache
+
+READ_SIZE = 4194304
+MIN_SHARD_BYTES = 1048576   #a file smaller than this many bytes per worker isn't split that far
+SHARDS_PER_WORKER = 2       #more shards than workers, so a slow shard doesn't hold the others up
+
+#A shard is a (start, end) range of byte offsets in an uncompressed vcf file
+#that starts at the beginning of a line and ends at the beginning of a line
+#(or the end of the file), so it can be parsed without the rest of the file.
+#The shards cover the data lines in order, so parsing them one after another
+#gives the same records as reading the file, and merging their results in
+#shard order keeps the file's order (genomic order, for a sorted file).
+
+
+def get_line_shards(fileName, shardCount):
+    '''
+    Returns about shardCount shards of the data lines of the file, of about
+    the same size, each moved on to the start of the next line.
+    '''
+    with open(fileName, 'rb') as srcFile:
+        dataStart = vcffile.VcfFile(fileName).skip_header(srcFile)
+        srcFile.seek(0, os.SEEK_END)
+        fileSize = srcFile.tell()
+        boundaries = [dataStart]
+        for shardNumber in range(1, shardCount):
+            offset = dataStart + (fileSize - dataStart) * shardNumber // shardCount
+            #a line that starts at offset is kept whole in the next shard
+            srcFile.seek(offset - 1)
+            srcFile.readline()
+            offset = srcFile.tell()
+            if (boundaries[-1] < offset < fileSize):
+                boundaries.append(offset)
+    boundaries.append(fileSize)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def get_chrom_shards(fileName, shardCount, index):
+    '''
+    Returns shards made of whole chromosomes, from the offset of each
+    chromosome's first line in the loaded VcfIndex of a sorted file.  Each
+    shard ends at the chromosome start nearest to where an even split would
+    end it, so there can be fewer than shardCount shards.
+    '''
+    fileSize = os.path.getsize(fileName)
+    starts = sorted([offsets[0] for binNumbers, offsets in index.bins.values()])
+    boundaries = [starts[0]]
+    for shardNumber in range(1, shardCount):
+        evenEnd = starts[0] + (fileSize - starts[0]) * shardNumber // shardCount
+        nearest = min(starts, key=lambda start: abs(start - evenEnd))
+        if (nearest > boundaries[-1]):
+            boundaries.append(nearest)
+    boundaries.append(fileSize)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def get_shards(fileName, shardCount):
+    '''
+    Returns up to shardCount shards of the file: whole chromosomes if the
+    file has an up to date VcfIndex and is sorted (see get_chrom_shards),
+    otherwise ranges of lines (see get_line_shards).  Small files have fewer
+    shards, at least MIN_SHARD_BYTES each.
+    '''
+    shardCount = max(1, min(shardCount, os.path.getsize(fileName) // MIN_SHARD_BYTES))
+    index = vcfindex.VcfIndex(fileName)
+    if (shardCount > 1 and index.load() and index.isSorted and len(index.bins) > 1):
+        shards = get_chrom_shards(fileName, shardCount, index)
+        if (len(shards) > 1):
+            return shards
+    return get_line_shards(fileName, shardCount)
+
+
+def iter_shard_lines(fileName, start, end):
+    '''Yields the lines of the file between the offsets start and end, reading a block at a time.'''
+    with open(fileName, 'rb') as srcFile:
+        srcFile.seek(start)
+        remainder = ''
+        toRead = end - start
+        while (toRead > 0):
+            text = srcFile.read(min(READ_SIZE, toRead))
+            if (not text):
+                break
+            toRead -= len(text)
+            lines, remainder = bgzf.split_lines(text, remainder)
+            for a_line in lines:
+                yield a_line
+        if (remainder):
+            yield remainder
+
+
+def parse_shard(shard):
+    '''Parses the snps of one (fileName, start, end) shard into GenomeColumns, in a worker process.'''
+    fileName, start, end = shard
+    columns = genomecache.GenomeColumns()
+    columns.add_records(vcffile.iter_line_records(iter_shard_lines(fileName, start, end), snpsOnly=True))
+    return columns
+
+
+def read_columns(fileName, workers):
+    '''
+    Parses the snps of an uncompressed vcf file into GenomeColumns, the same
+    as VcfFile.parse_genome_columns does with one worker, by parsing shards of
+    it on a pool of worker processes and adding each shard's columns in
+    order as they come back.
+    '''
+    shards = [(fileName, start, end) for start, end in get_shards(fileName, workers * SHARDS_PER_WORKER)]
+    if (len(shards) == 1):
+        return parse_shard(shards[0])
+    columns = genomecache.GenomeColumns()
+    pool = multiprocessing.Pool(min(workers, len(shards)))
+    try:
+        for shardColumns in pool.imap(parse_shard, shards):
+            columns.add_columns(shardColumns)
+    finally:
+        pool.terminate()
+        pool.join()
+    return columns